@@ -1,38 +1,52 @@
+# Time to first frame counts from here, module imports included
+import time
+PROCESS_STARTED = time.perf_counter()
+
 import customtkinter as ctk
 import tkinter as tk
-from tkinter import messagebox, simpledialog
-import time
-import requests
-from requests.exceptions import RequestException
+from tkinter import filedialog, messagebox, simpledialog, ttk
+import threading
 from PIL import Image, ImageTk
-from io import BytesIO
 from datetime import datetime
 import os
-import json
-import threading
-import random
+import re
+import sqlite3
 import calendar
-
-# Directory to store journal entries and images
-SAVE_DIR = "./journal_entries/"
-IMAGE_DIR = "./journal_images/"
-RETRY_QUEUE = []  # Queue to store entries with failed image generation
-SETTINGS_FILE = "./settings.json"
+import bisect
+from collections import OrderedDict, deque
+
+from journalgen_core import JournalEngine, ThumbnailCache, RestyleJob, PREVIEW_SIZE
+from journalgen_export import export_journal
+from journalgen_import import import_file
+from journalgen_metrics import log, metrics, configure_logging
+
+# How often entries without images are re-queued, and cross-checked against the image directory
+IMAGE_CHECK_INTERVAL = 5 * 60 * 1000  # milliseconds
+IMAGE_DISK_CHECK_INTERVAL = 30 * 60 * 1000
+
+# Updates from background threads are applied on the main loop once per frame
+FRAME_INTERVAL = 16   # milliseconds between drains while updates keep coming
+IDLE_INTERVAL = 100   # milliseconds between checks while nothing is queued
+FRAME_BUDGET = 0.008  # seconds of updates applied per frame, the rest waits for the next one
+RESTYLE_REFRESH_INTERVAL = 500  # milliseconds between restyle progress updates
+METRICS_REFRESH_INTERVAL = 1000  # milliseconds between debug panel updates
+FIRST_FRAME_TIMEOUT = 2000  # milliseconds, the journal loads then even if the window hasn't drawn yet
+
+# PhotoImages kept in memory for the entry list
+PHOTO_CACHE_SIZE = 300
+
+# Virtualized entry list
+ENTRY_ROW_HEIGHT = 100  # pixels per entry row, including padding; rows with long text grow taller
+ENTRY_ROW_OVERSCAN = 2  # extra rows kept bound above and below the viewport
+
+# Large image viewer
+VIEWER_CACHE_SIZE = 12  # decoded images kept for flipping back and forth
+VIEWER_PREFETCH = 2     # neighbours decoded ahead on each side
+VIEWER_POLL_INTERVAL = 20  # milliseconds between checks for a finished decode
 
 # Placeholder image to keep positions consistent
 PLACEHOLDER_IMAGE_PATH = './placeholder.jpg'
 
-# Create save directories if not exist
-if not os.path.exists(SAVE_DIR):
-    os.makedirs(SAVE_DIR)
-if not os.path.exists(IMAGE_DIR):
-    os.makedirs(IMAGE_DIR)
-
-# Create the settings file if it doesn't exist
-if not os.path.exists(SETTINGS_FILE):
-    with open(SETTINGS_FILE, "w") as f:
-        json.dump({"always_on_top": False}, f)
-
 # Load or create a placeholder image
 def get_placeholder_image():
     if not os.path.exists(PLACEHOLDER_IMAGE_PATH):
@@ -40,75 +54,452 @@ def get_placeholder_image():
         placeholder_image.save(PLACEHOLDER_IMAGE_PATH)
     return PLACEHOLDER_IMAGE_PATH
 
-class ImageStyleManager:
-    def __init__(self):
-        self.styles = {
-            "photographic": {"prepend": "", "append": ", photorealistic style"},
-            "anime": {"prepend": "", "append": ", Illustrated_Anime_Style"},
-            "watercolor": {"prepend": "", "append": ", watercolor painting style"},
-            "sketch": {"prepend": "", "append": ", pencil sketch style"}
-        }
-        self.current_style = "photographic"
-        self.user_appearance = ""
-        self.load_settings()
-
-    def set_style(self, style_name):
-        if style_name in self.styles:
-            self.current_style = style_name
-            self.save_settings()
-
-    def set_user_appearance(self, appearance):
-        self.user_appearance = appearance
-        self.save_settings()
-
-    def get_style_string(self, content):
-        style = self.styles[self.current_style]
-        return f"{self.user_appearance} {style['prepend']} {content} {style['append']}".strip()
+class PhotoCache(ThumbnailCache):
+    # Thumbnail cache with an LRU of ready PhotoImages keyed by (path, mtime),
+    # so showing a recently viewed day needs no decoding at all
+    def __init__(self, thumb_dir, preview_dir, image_format, max_photos=PHOTO_CACHE_SIZE):
+        super().__init__(thumb_dir, preview_dir, image_format)
+        self.max_photos = max_photos
+        self.photos = OrderedDict()  # (image_path, mtime) -> ImageTk.PhotoImage
 
-    def save_settings(self):
-        settings = {
-            "current_style": self.current_style,
-            "user_appearance": self.user_appearance
-        }
-        with open("style_settings.json", "w") as f:
-            json.dump(settings, f)
-
-    def load_settings(self):
+    # Tk main thread only
+    def get_photo(self, image_path):
         try:
-            with open("style_settings.json", "r") as f:
-                settings = json.load(f)
-                self.current_style = settings.get("current_style", "photographic")
-                self.user_appearance = settings.get("user_appearance", "")
+            key = (image_path, os.stat(image_path).st_mtime)
         except FileNotFoundError:
-            # If the file doesn't exist, we'll use the default values
-            pass
-            
+            key = (image_path, None)  # Evicted original, its thumbnail is still there
+        photo = self.photos.get(key)
+        if photo is not None:
+            self.photos.move_to_end(key)
+            return photo
+
+        photo = ImageTk.PhotoImage(Image.open(self.get_thumbnail(image_path)))
+        self.photos[key] = photo
+        if len(self.photos) > self.max_photos:
+            self.photos.popitem(last=False)
+        return photo
+
+    def discard(self, image_path):
+        for key in [key for key in self.photos if key[0] == image_path]:
+            del self.photos[key]
+        super().discard(image_path)
+
+class UiDispatcher:
+    # Hands work from background threads to the Tk main loop. Threads only
+    # call post(), which never touches a widget; drain() runs on the main loop
+    # once per frame and applies what was posted, in order, until the frame's
+    # time budget is spent. A burst of finished images is spread over a few
+    # frames instead of freezing one.
+    def __init__(self, root):
+        self.root = root
+        self.queue = deque()  # (fn, args), appends and pops are thread safe
+        metrics.gauge_function("ui_queue_depth", lambda: len(self.queue))
+
+    def post(self, fn, *args):
+        self.queue.append((fn, args))
+
+    def start(self):
+        self.root.after(IDLE_INTERVAL, self.drain)
+
+    def drain(self):
+        started = time.perf_counter()
+        applied = 0
+        while self.queue and time.perf_counter() - started < FRAME_BUDGET:
+            fn, args = self.queue.popleft()
+            try:
+                fn(*args)
+            except Exception:
+                log.exception("UI update %s failed", getattr(fn, "__name__", fn))
+            applied += 1
+        if applied:
+            metrics.increment("ui_updates_applied", applied)
+            metrics.observe("ui_frame_seconds", time.perf_counter() - started)
+        self.root.after(FRAME_INTERVAL if applied else IDLE_INTERVAL, self.drain)
+
+class VirtualEntryList:
+    # Entry list drawn on a canvas with a small pool of row widgets. Only the
+    # rows in view (plus a little overscan) are bound to entries; scrolling
+    # re-binds pooled rows instead of creating widgets, and changing one entry
+    # only touches its own row. A row is as tall as its text needs: heights are
+    # measured when an entry is first bound and cached, entries not measured
+    # yet count as ENTRY_ROW_HEIGHT.
+    def __init__(self, canvas, scrollbar, thumbnail_cache, on_image_click, on_context_menu):
+        self.canvas = canvas
+        self.scrollbar = scrollbar
+        self.thumbnail_cache = thumbnail_cache
+        self.on_image_click = on_image_click    # called with (entry_id, image_path)
+        self.on_context_menu = on_context_menu  # called with (event, entry)
+
+        self.entries = []    # Entry objects of the day shown
+        self.positions = {}  # entry_id -> index in self.entries
+        self.rows = []       # pooled row widgets
+        self.bound = {}      # entry_id -> row currently showing it
+        self.heights = {}    # entry_id -> measured row height at the current wrap length
+        self.offsets = [0]   # top of every row, and the bottom of the last one
+        self.wraplength = None
+        self.refresh_pending = False
+
+        self.canvas.configure(yscrollcommand=self.on_scroll, yscrollincrement=ENTRY_ROW_HEIGHT // 4)
+        self.scrollbar.configure(command=self.canvas.yview)
+        self.canvas.bind("<Configure>", lambda e: self.schedule_refresh())
+        self.bind_wheel(self.canvas)
+
+    def bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self.canvas.yview_scroll(int(-e.delta / 120) or (-1 if e.delta > 0 else 1), "units"))
+        widget.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-1, "units"))
+        widget.bind("<Button-5>", lambda e: self.canvas.yview_scroll(1, "units"))
+
+    def on_scroll(self, first, last):
+        # Called by the canvas whenever its view moves, whatever moved it
+        self.scrollbar.set(first, last)
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.canvas.after_idle(self.refresh)
+
+    def set_entries(self, entries):
+        self.entries = list(entries)
+        self.positions = {entry.entry_id: i for i, entry in enumerate(self.entries)}
+        for row in self.rows:
+            row["index"] = None
+        self.bound = {}
+        self.heights = {}
+        self.update_scrollregion()
+        self.canvas.yview_moveto(0)
+        self.refresh()
+
+    def clear(self):
+        self.set_entries([])
+
+    def append(self, entry):
+        self.positions[entry.entry_id] = len(self.entries)
+        self.entries.append(entry)
+        self.update_scrollregion()
+        self.refresh()
+
+    def remove(self, entry_id):
+        index = self.positions.get(entry_id)
+        if index is None:
+            return
+        del self.entries[index]
+        self.positions = {entry.entry_id: i for i, entry in enumerate(self.entries)}
+        for row in self.rows:
+            if row["index"] is not None and row["index"] >= index:
+                row["index"] = None  # Shifted rows have to be re-bound
+        self.bound = {e_id: row for e_id, row in self.bound.items() if row["index"] is not None}
+        self.update_scrollregion()
+        self.refresh()
+
+    def update_entry(self, entry):
+        # Show the new version of an entry, only its own row is redrawn
+        index = self.positions.get(entry.entry_id)
+        if index is None:
+            return False
+        self.entries[index] = entry
+        self.heights.pop(entry.entry_id, None)  # Edited text may need another height
+        row = self.bound.get(entry.entry_id)
+        if row is not None:
+            self.bind_row(row, index)
+        self.update_scrollregion()
+        self.schedule_refresh()  # Rows below move if the height changed
+        return True
+
+    def scroll_to(self, entry_id):
+        index = self.positions.get(entry_id)
+        if index is not None and self.entries:
+            self.canvas.yview_moveto(self.offsets[index] / self.offsets[-1])
+
+    def row_height(self, index):
+        return self.heights.get(self.entries[index].entry_id, ENTRY_ROW_HEIGHT)
+
+    def update_scrollregion(self):
+        self.offsets = [0]
+        for index in range(len(self.entries)):
+            self.offsets.append(self.offsets[-1] + self.row_height(index))
+        width = self.canvas.winfo_width()
+        self.canvas.configure(scrollregion=(0, 0, width, self.offsets[-1]))
+
+    def create_row(self):
+        frame = ctk.CTkFrame(self.canvas, corner_radius=10, height=ENTRY_ROW_HEIGHT - 10)
+        frame.pack_propagate(False)
+        image_label = tk.Label(frame, bd=2, relief="solid")
+        image_label.pack(side=tk.LEFT, padx=5)
+        text_label = tk.Label(frame, anchor="w", justify=tk.LEFT, wraplength=self.wraplength or 500)
+        text_label.pack(side=tk.LEFT, padx=10, pady=5)
+        row = {"frame": frame, "image_label": image_label, "text_label": text_label, "index": None,
+               "window": self.canvas.create_window(10, 0, window=frame, anchor="nw", state="hidden")}
+
+        # Handlers look up whatever entry the row is bound to at click time
+        image_label.bind("<Button-1>", lambda e: self.row_clicked(row))
+        image_label.bind("<Button-3>", lambda e: self.row_context_menu(e, row))
+        text_label.bind("<Button-3>", lambda e: self.row_context_menu(e, row))
+        for widget in (frame, image_label, text_label):
+            self.bind_wheel(widget)
+        self.rows.append(row)
+        return row
+
+    def row_clicked(self, row):
+        if row["index"] is not None:
+            entry = self.entries[row["index"]]
+            self.on_image_click(entry.entry_id, entry.image_path)
+
+    def row_context_menu(self, event, row):
+        if row["index"] is not None:
+            self.on_context_menu(event, self.entries[row["index"]])
+
+    def bind_row(self, row, index):
+        entry = self.entries[index]
+        image_path = entry.image_path
+        # An evicted original still has its thumbnail
+        if image_path and (os.path.exists(image_path) or self.thumbnail_cache.has_thumbnail(image_path)):
+            photo = self.thumbnail_cache.get_photo(image_path)
+        else:
+            photo = self.thumbnail_cache.get_photo(get_placeholder_image())  # Use placeholder if no image available
+        row["image_label"].config(image=photo)
+        row["image_label"].image = photo  # Keep reference to prevent garbage collection
+        row["text_label"].config(text=entry.text)
+        row["index"] = index
+        self.bound[entry.entry_id] = row
+        # Labels compute their size on config, so the text's height is known already
+        height = max(ENTRY_ROW_HEIGHT, row["text_label"].winfo_reqheight() + 20)
+        row["frame"].configure(height=height - 10)
+        self.heights[entry.entry_id] = height
+
+    def refresh(self):
+        self.refresh_pending = False
+        width = self.canvas.winfo_width()
+        wraplength = max(width - 220, 200)
+        if wraplength != self.wraplength:
+            # Heights depend on where the text wraps, all rows are measured again
+            self.wraplength = wraplength
+            self.heights = {}
+            for row in self.rows:
+                row["text_label"].config(wraplength=wraplength)
+                row["index"] = None
+            self.update_scrollregion()
+        # Rows measured while binding can push others out of view, so repeat
+        # until every row in view has its height
+        while True:
+            measured = len(self.heights)
+            self.place_rows(width)
+            if len(self.heights) == measured:
+                break
+            self.update_scrollregion()
+
+    def place_rows(self, width):
+        height = self.canvas.winfo_height()
+        top = self.canvas.canvasy(0)
+        first = max(0, bisect.bisect_right(self.offsets, top) - 1 - ENTRY_ROW_OVERSCAN)
+        last = min(len(self.entries), bisect.bisect_left(self.offsets, top + height) + ENTRY_ROW_OVERSCAN)
+        wanted = range(first, last)
+
+        # Rows already showing a wanted entry stay as they are, the rest get recycled
+        keep = {row["index"]: row for row in self.rows if row["index"] in wanted}
+        free = [row for row in self.rows if row["index"] not in keep]
+        self.bound = {self.entries[index].entry_id: row for index, row in keep.items()}
+
+        for index in wanted:
+            row = keep.get(index)
+            if row is None:
+                row = free.pop() if free else self.create_row()
+                self.bind_row(row, index)
+            self.canvas.coords(row["window"], 10, self.offsets[index] + 5)
+            self.canvas.itemconfigure(row["window"], state="normal", width=max(width - 20, 200))
+
+        for row in free:
+            row["index"] = None
+            self.canvas.itemconfigure(row["window"], state="hidden")
+
+class ImageViewer:
+    # Popup showing one image at a time, Left/Right flip through the images of
+    # the day. Images are decoded on a background thread straight to the size
+    # they are shown at: from the stored preview when that is big enough,
+    # otherwise from the original with a reduced-scale JPEG draft. The current
+    # image's neighbours are decoded ahead into a small LRU, so flipping
+    # through a day doesn't wait on the disk or the decoder.
+    def __init__(self, root, thumbnail_cache, cache_size=VIEWER_CACHE_SIZE, on_view=None):
+        self.root = root
+        self.thumbnail_cache = thumbnail_cache
+        self.on_view = on_view  # called with the image path shown
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # (image_path, size) -> decoded PIL image
+        self.condition = threading.Condition()
+        self.wanted = []  # image paths to decode, most urgent first
+        self.worker = None
+
+        self.popup = None
+        self.label = None
+        self.images = []  # image paths of the day, in entry order
+        self.index = 0
+        self.size = None
+        self.poll_pending = False
+
+    def show(self, images, index):
+        self.images = images
+        self.index = index
+        if self.popup is None or not self.popup.winfo_exists():
+            self.create_popup()
+        self.popup.lift()
+        self.display()
+
+    def show_message(self, text):
+        # Popup with just a line of text, while an image is on its way
+        if self.popup is None or not self.popup.winfo_exists():
+            self.create_popup()
+        self.images = []
+        self.popup.title("Large Image")
+        self.label.configure(image="", text=text)
+        self.popup.lift()
+
+    def create_popup(self):
+        self.popup = tk.Toplevel(self.root)
+        self.popup.attributes('-topmost', True)  # Keep the popup on top
+
+        # Calculate 80% of screen size
+        popup_width = int(self.popup.winfo_screenwidth() * 0.8)
+        popup_height = int(self.popup.winfo_screenheight() * 0.8)
+        self.popup.geometry(f"{popup_width}x{popup_height}")
+        self.size = (popup_width, popup_height)
+
+        self.label = tk.Label(self.popup, text="Loading...")
+        self.label.pack(fill=tk.BOTH, expand=True)
+
+        # Close the popup when clicked, arrow keys move between images
+        self.label.bind("<Button-1>", lambda e: self.close())
+        self.popup.bind("<Escape>", lambda e: self.close())
+        self.popup.bind("<Left>", lambda e: self.step(-1))
+        self.popup.bind("<Right>", lambda e: self.step(1))
+        self.popup.protocol("WM_DELETE_WINDOW", self.close)
+        self.popup.focus_set()
+
+    def close(self):
+        with self.condition:
+            self.wanted = []
+        if self.popup is not None:
+            self.popup.destroy()
+        self.popup = None
+
+    def step(self, offset):
+        index = self.index + offset
+        if 0 <= index < len(self.images):
+            self.index = index
+            self.display()
+
+    def display(self):
+        self.popup.title(f"Large Image ({self.index + 1} of {len(self.images)})")
+        if self.on_view:
+            self.on_view(self.images[self.index])
+        # The current image first, then its neighbours, nearest first
+        order = [self.index]
+        for distance in range(1, VIEWER_PREFETCH + 1):
+            order += [self.index + distance, self.index - distance]
+        self.request([self.images[i] for i in order if 0 <= i < len(self.images)])
+        self.poll()
+
+    def poll(self):
+        # Tk isn't thread safe, so the main thread picks finished decodes up
+        if self.popup is None or not self.images:
+            return
+        with self.condition:
+            image = self.cache.get((self.images[self.index], self.size))
+        if image is None:
+            self.label.configure(image="", text="Loading...")
+            if not self.poll_pending:
+                self.poll_pending = True
+                self.popup.after(VIEWER_POLL_INTERVAL, self.poll_again)
+            return
+        photo = ImageTk.PhotoImage(image)
+        self.label.configure(image=photo, text="")
+        self.label.image = photo  # Keep a reference
+
+    def poll_again(self):
+        self.poll_pending = False
+        self.poll()
+
+    def request(self, image_paths):
+        with self.condition:
+            self.wanted = [path for path in image_paths if (path, self.size) not in self.cache]
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.decode_loop, name="image-viewer", daemon=True)
+                self.worker.start()
+            self.condition.notify()
+
+    def decode_loop(self):
+        while True:
+            with self.condition:
+                while not self.wanted:
+                    self.condition.wait()
+                image_path = self.wanted.pop(0)
+                size = self.size
+            try:
+                image = self.decode(image_path, size)
+            except (OSError, ValueError) as e:
+                log.warning("Could not open image %s: %s", image_path, e)
+                image = Image.new('RGB', (1, 1), (200, 200, 200))
+            with self.condition:
+                self.cache[(image_path, size)] = image
+                self.cache.move_to_end((image_path, size))
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+    def decode(self, image_path, size):
+        if size[0] <= PREVIEW_SIZE[0] and size[1] <= PREVIEW_SIZE[1]:
+            image = Image.open(self.thumbnail_cache.get_preview(image_path))
+        else:
+            image = Image.open(image_path)
+            image.draft("RGB", size)  # Let the JPEG decoder scale down for free
+        image.thumbnail(size)  # Resize image to fit the popup
+        image.load()
+        return image
+
 class JournalApp:
     def __init__(self, root):
+        started = time.perf_counter()
         self.root = root
         self.root.title("JOURNALGEN")
 
         # Set window size
         self.root.geometry("900x650")  # Adjust the size as needed
 
-        # Initialize style manager
-        self.style_manager = ImageStyleManager()
-    
+        # Storage, image generation and retries live in the engine
+        with metrics.timer("startup_engine_seconds"):
+            self.engine = JournalEngine(thumbnail_cache_class=PhotoCache)
+        configure_logging(self.engine.settings.get("log_level", "INFO"))
+        # Engine callbacks arrive on worker threads and are applied on the main loop
+        self.dispatcher = UiDispatcher(self.root)
+        self.engine.image_listeners.append(self.on_entry_image)
+        self.restyle_job = None
+        self.style_manager = self.engine.style_manager
+        self.store = self.engine.store
+        self.thumbnail_cache = self.engine.thumbnails
+        self.image_viewer = ImageViewer(self.root, self.thumbnail_cache, on_view=self.engine.mark_viewed)
+
         # Create menu bar
         self.menu_bar = tk.Menu(self.root)
         self.root.config(menu=self.menu_bar)
         self.create_style_menu()
+        self.journal_menu = tk.Menu(self.menu_bar, tearoff=0)
+        self.menu_bar.add_cascade(label="Journal", menu=self.journal_menu)
+        self.journal_menu.add_command(label="Import Diary...", command=self.import_diary)
+        self.journal_menu.add_separator()
+        self.journal_menu.add_command(label="Export Archive (.tar.gz)...", command=lambda: self.export_journal("archive"))
+        self.journal_menu.add_command(label="Export JSON Lines...", command=lambda: self.export_journal("jsonl"))
+        self.journal_menu.add_command(label="Export HTML Site...", command=lambda: self.export_journal("site"))
+        self.journal_menu.add_separator()
+        self.journal_menu.add_command(label="Optimize Image Storage", command=self.optimize_images)
+        self.export_thread = None
+        self.optimize_thread = None
+        self.debug_menu = tk.Menu(self.menu_bar, tearoff=0)
+        self.menu_bar.add_cascade(label="Debug", menu=self.debug_menu)
+        self.debug_menu.add_command(label="Metrics", command=self.show_metrics_panel)
+        self.metrics_window = None
 
         # Load settings
-        self.settings = self.load_settings()
+        self.settings = self.engine.settings
         self.root.attributes('-topmost', self.settings.get("always_on_top", False))
 
-        # Initialize retry mechanism
-        self.retry_queue = []
-        self.retry_lock = threading.Lock()
-
-        # Dictionary to store journal entries for each day
-        self.entries = {}
         self.current_day = None
         self.current_year = datetime.now().year
 
@@ -146,6 +537,10 @@ class JournalApp:
         # Calendar frame
         self.calendar_frame = tk.Frame(self.left_frame)
         self.calendar_frame.pack(fill=tk.BOTH, expand=True)
+        self.month_counts = {}  # "YYYY-MM" -> {day number: [entries, missing images]}
+        self.month_missing = {}  # "YYYY-MM" -> ids of the entries counted as missing an image
+        self.calendar_month = None
+        self.build_calendar()
 
         # Right-side frame for notebook entries and images
         self.right_frame = ctk.CTkFrame(self.main_frame)
@@ -153,13 +548,14 @@ class JournalApp:
 
         # Scrolling area for the entries
         self.entry_canvas = tk.Canvas(self.right_frame)
-        self.scrollbar = tk.Scrollbar(self.right_frame, orient="vertical", command=self.entry_canvas.yview)
-        self.entry_canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar = tk.Scrollbar(self.right_frame, orient="vertical")
 
-        # Frame inside the canvas to hold the entries
-        self.entry_frame = tk.Frame(self.entry_canvas)
-        self.entry_canvas.create_window((0, 0), window=self.entry_frame, anchor="nw")
-        self.entry_frame.bind("<Configure>", lambda e: self.entry_canvas.configure(scrollregion=self.entry_canvas.bbox("all")))
+        # Only the visible entries get widgets, recycled as the canvas scrolls
+        self.entry_list = VirtualEntryList(
+            self.entry_canvas, self.scrollbar, self.thumbnail_cache,
+            on_image_click=lambda entry_id, image_path: self.show_large_image(image_path),
+            on_context_menu=self.show_context_menu
+        )
 
         # Pack the canvas and scrollbar
         self.entry_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -177,28 +573,40 @@ class JournalApp:
         self.today_button = tk.Button(self.left_frame, text="Today", command=self.go_to_today, font=('Arial', 10))
         self.today_button.pack(pady=(10, 0))
 
+        # Search box below the Today button
+        self.search_entry = ctk.CTkEntry(self.left_frame, placeholder_text="Search...", width=120, height=28)
+        self.search_entry.pack(pady=(10, 0))
+        self.search_entry.bind("<Return>", self.search_entries)
+        self.search_window = None
+
         # Add a flag to track whether to show the warning
         self.show_post_warning = True
 
-        # Load previously saved entries if they exist
-        self.load_all_entries()
-
-        # Initialize the calendar
-        self.update_calendar()
-
-        # Load entries for the current day
-        current_day = datetime.now().day
-        self.load_entries_for_selected_day(current_day)
+        # The calendar and today's entries come from a small manifest, the
+        # rest of the journal is loaded once the window has drawn
+        self.show_manifest()
 
         # Event bindings
         self.month_dropdown.bind("<<ComboboxSelected>>", self.update_calendar)
 
-        # Start the retry process in the background
-        self.retry_thread = threading.Thread(target=self.process_retry_queue, daemon=True)
-        self.retry_thread.start()
+        # Write everything pending before the window goes away
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        self.engine.start_metrics_export()
+
+        # Apply completed images to the UI once per frame
+        self.dispatcher.start()
+
+        # The missing image scan, the retry worker and an interrupted restyle wait for the first frame
+        self.first_frame_seen = False
+        self.entry_canvas.bind("<Expose>", self.on_expose, add="+")
+        self.root.after(FIRST_FRAME_TIMEOUT, self.on_first_frame, False)
 
-        # Periodically check for entries without images
-        self.root.after(60000, self.check_entries_without_images)  # Check every minute
+        # Periodically re-queue entries without images and cross-check the image directory
+        self.check_threads = {}  # name -> thread of the last periodic check
+        self.root.after(IMAGE_CHECK_INTERVAL, self.periodic_image_check)
+        self.root.after(IMAGE_DISK_CHECK_INTERVAL, self.periodic_disk_check)
+        metrics.observe("startup_app_seconds", time.perf_counter() - started)
 
     def create_style_menu(self):
         self.style_menu = tk.Menu(self.menu_bar, tearoff=0)
@@ -230,7 +638,7 @@ class JournalApp:
 
     def set_style(self, style):
         self.style_manager.set_style(style)
-        print(f"Image style set to: {style}")
+        log.info("Image style set to: %s", style)
         self.update_style_menu()
 
     def set_user_appearance(self):
@@ -275,122 +683,265 @@ class JournalApp:
         appearance_window.protocol("WM_DELETE_WINDOW", save_appearance)
     
     def apply_style_retroactively(self, scope='all'):
+        if self.restyle_job is not None and not self.restyle_job.finished.is_set():
+            messagebox.showinfo("Apply Style", "A restyle is already running.")
+            return
         if scope == 'all':
-            entries_to_update = [(day, entry) for day, day_entries in self.entries.items() for entry in day_entries]
+            start_day = end_day = None
         elif scope == 'month':
-            current_month = datetime.now().strftime("%Y-%m")
-            entries_to_update = [(day, entry) for day, day_entries in self.entries.items() if day.startswith(current_month) for entry in day_entries]
+            # The month on display, not necessarily the current one
+            start_day, end_day = f"{self.calendar_month}-01", f"{self.calendar_month}-31"
         elif scope == 'day':
-            entries_to_update = [(self.current_day, entry) for entry in self.entries.get(self.current_day, [])]
-        
-        for day, (entry_id, entry_text, _) in entries_to_update:
-            content = entry_text.split('] ', 1)[1] if '] ' in entry_text else entry_text
-            self.retry_image(entry_id, content)
-        
-        print(f"Applied new style to {len(entries_to_update)} entries.")
-
-    def process_retry_queue(self):
-        while True:
-            with self.retry_lock:
-                if self.retry_queue:
-                    entry_id, entry_text = self.retry_queue.pop(0)
-                    image_path = os.path.join(IMAGE_DIR, f'{entry_id}.jpg')
-                    if not os.path.exists(image_path):
-                        print(f"Retrying image generation for entry: {entry_id}")
-                        self.generate_image_async(entry_id, entry_text, self.update_entry_with_image)
-                    else:
-                        print(f"Image already exists for entry: {entry_id}")
-            time.sleep(5)  # Wait 5 seconds before next retry attempt
-
-    def add_to_retry_queue(self, entry_id, entry_text):
-        with self.retry_lock:
-            if not any(entry_id == item[0] for item in self.retry_queue):
-                self.retry_queue.append((entry_id, entry_text))
-                print(f"Added entry {entry_id} to retry queue")
+            if self.current_day is None:
+                # No day picked since the year changed, never an open range
+                messagebox.showinfo("Apply Style", "Pick a day first.")
+                return
+            start_day = end_day = self.current_day
+        self.start_restyle(RestyleJob(self.engine, start_day, end_day))
+
+    def on_expose(self, event):
+        # Drawing happens in idle callbacks, this one runs after them
+        if not self.first_frame_seen:
+            self.root.after_idle(self.on_first_frame)
+
+    def on_first_frame(self, drawn=True):
+        if self.first_frame_seen:
+            return
+        self.first_frame_seen = True
+        if drawn:
+            seconds = time.perf_counter() - PROCESS_STARTED
+            metrics.observe("startup_first_frame_seconds", seconds)
+            log.info("First frame drawn %.2fs after start, loading the journal", seconds)
+        else:
+            log.info("Window not drawn yet, loading the journal anyway")
+        self.engine.start_loader(on_loaded=self.on_journal_loaded)
+
+    def on_journal_loaded(self, migrated):
+        # Called on the loader thread
+        self.dispatcher.post(self.apply_journal_loaded, migrated)
+
+    def apply_journal_loaded(self, migrated):
+        if migrated:
+            # Old JSON entries reached the database after the first frame was drawn from it
+            self.reload_view()
+        self.offer_restyle_resume()
+
+    def offer_restyle_resume(self):
+        job = RestyleJob.resume(self.engine)
+        if job is None:
+            return
+        finished = job.position
+        if messagebox.askyesno("Apply Style", f"A {job.style} restyle was interrupted after "
+                                              f"{finished} of {job.total} entries. Resume it?"):
+            self.start_restyle(job)
+        else:
+            job.clear_checkpoint()
+
+    def start_restyle(self, job):
+        self.restyle_job = job
+        job.start()
+        log.info("Applying %s style to %d entries", job.style, job.total)
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Applying {job.style} style")
+        window.geometry("360x130")
+        window.resizable(False, False)
+        self.restyle_window = window
+
+        self.restyle_label = tk.Label(window, anchor="w")
+        self.restyle_label.pack(fill=tk.X, padx=10, pady=(10, 5))
+        self.restyle_progress = ttk.Progressbar(window, maximum=max(job.total, 1), length=340)
+        self.restyle_progress.pack(padx=10)
+
+        button_frame = tk.Frame(window)
+        button_frame.pack(pady=10)
+        self.restyle_pause_button = tk.Button(button_frame, text="Pause", width=8, command=self.toggle_restyle_pause)
+        self.restyle_pause_button.pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="Cancel", width=8, command=self.cancel_restyle).pack(side=tk.LEFT, padx=5)
+        # Closing the window only hides the progress, the job keeps running
+        window.protocol("WM_DELETE_WINDOW", window.withdraw)
+
+        self.refresh_restyle_window()
+
+    def toggle_restyle_pause(self):
+        if self.restyle_job.is_paused():
+            self.restyle_job.resume_run()
+            self.restyle_pause_button.config(text="Pause")
+        else:
+            self.restyle_job.pause()
+            self.restyle_pause_button.config(text="Resume")
+
+    def cancel_restyle(self):
+        self.restyle_job.cancel()
+        self.restyle_window.destroy()
+
+    def refresh_restyle_window(self):
+        job = self.restyle_job
+        if not self.restyle_window.winfo_exists():
+            return
+        finished, total, eta = job.progress()
+        if job.finished.is_set():
+            self.restyle_window.destroy()
+            return
+        self.restyle_progress.config(value=finished)
+        status = "paused" if job.is_paused() else (f"about {int(eta)}s left" if eta is not None else "starting")
+        self.restyle_label.config(text=f"{finished} of {total} entries, {job.failed} failed, {status}")
+        self.root.after(RESTYLE_REFRESH_INTERVAL, self.refresh_restyle_window)
+
+    def show_metrics_panel(self):
+        # Live view of the metrics registry, refreshed while the window is open
+        if self.metrics_window is not None and self.metrics_window.winfo_exists():
+            self.metrics_window.lift()
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Metrics")
+        window.geometry("640x400")
+        columns = ("value", "count", "p50", "p95", "max")
+        tree = ttk.Treeview(window, columns=columns)
+        tree.heading("#0", text="Metric")
+        tree.column("#0", width=220)
+        for column in columns:
+            tree.heading(column, text=column)
+            tree.column(column, width=80, anchor=tk.E)
+        tree.pack(fill=tk.BOTH, expand=True)
+        self.metrics_window = window
+        self.metrics_tree = tree
+        self.refresh_metrics_panel()
+
+    def refresh_metrics_panel(self):
+        if self.metrics_window is None or not self.metrics_window.winfo_exists():
+            self.metrics_window = None
+            return
+
+        def milliseconds(seconds):
+            return f"{seconds * 1000:.1f} ms" if seconds is not None else ""
+
+        for name, values in metrics.snapshot().items():
+            if values["type"] == "histogram":
+                row = ("", values["count"], milliseconds(values["p50"]), milliseconds(values["p95"]),
+                       milliseconds(values["max"]))
             else:
-                print(f"Entry {entry_id} is already in the retry queue")
-
-    def check_entries_without_images(self):
-        print("Checking for entries without images...")
-        for day, entries in self.entries.items():
-            for entry_id, entry_text, image_path in entries:
-                if image_path is None or not os.path.exists(image_path):
-                    print(f"Found entry without image: {entry_id}")
-                    entry_content = entry_text.split('] ', 1)[1] if '] ' in entry_text else entry_text
-                    self.add_to_retry_queue(entry_id, entry_content)
-                else:
-                    print(f"Entry {entry_id} already has an image: {image_path}")
-        self.root.after(300000, self.check_entries_without_images)  # Check every 5 minutes
-
-    def update_entry_with_image(self, entry_id, image_path):
-        updated = False
-        for day, entries in self.entries.items():
-            for i, (e_id, e, img) in enumerate(entries):
-                if e_id == entry_id:
-                    print(f"Updating entry {entry_id} with image: {image_path}")
-                    self.entries[day][i] = (e_id, e, image_path)
-                    updated = True
-                    break
-            if updated:
-                break
-        
-        if updated:
-            print(f"Successfully updated entry {entry_id} with image.")
-            self.save_to_file()
+                row = (values["value"], "", "", "", "")
+            if self.metrics_tree.exists(name):
+                self.metrics_tree.item(name, values=row)
+            else:
+                self.metrics_tree.insert("", tk.END, iid=name, text=name, values=row)
+        self.root.after(METRICS_REFRESH_INTERVAL, self.refresh_metrics_panel)
+
+    def import_diary(self):
+        path = filedialog.askopenfilename(title="Import diary", filetypes=[
+            ("Diaries", "*.txt *.md *.markdown *.jsonl *.ndjson"), ("All files", "*.*")])
+        if not path:
+            return
+
+        # Parsing and the database write happen off the main loop, images follow in the background
+        def run():
+            try:
+                summary = import_file(self.engine, path)
+            except (OSError, ValueError) as e:
+                log.exception("Import of %s failed", path)
+                self.dispatcher.post(messagebox.showerror, "Import", f"Import failed: {e}")
+                return
+            self.dispatcher.post(self.on_import_finished, summary)
+
+        threading.Thread(target=run, name="import", daemon=True).start()
+
+    def on_import_finished(self, summary):
+        self.reload_view()
+        messagebox.showinfo("Import", f"Imported {summary['entries']} entries over {summary['days']} days, "
+                                      f"skipped {summary['duplicates']} already in the journal. "
+                                      "Their images are generated in the background.")
+
+    def export_journal(self, format):
+        if self.export_thread is not None and self.export_thread.is_alive():
+            messagebox.showinfo("Export", "An export is already running.")
+            return
+        if format == "site":
+            output = filedialog.askdirectory(title="Export HTML site to folder", mustexist=False)
         else:
-            print(f"Could not find entry {entry_id} to update with image.")
-
-    def generate_image_async(self, entry_id, journal_content, callback):
-        def fetch_image():
-            image_path = os.path.join(IMAGE_DIR, f'{entry_id}.jpg')
-            max_retries = 3
-            base_wait_time = 5  # seconds
-
-            for attempt in range(max_retries):
-                try:
-                    print(f"Generating image for entry: {entry_id} (Attempt {attempt + 1}/{max_retries})")
-                    seed = random.randint(0, 999999)
-                    styled_content = self.style_manager.get_style_string(journal_content)
-                    response = requests.get(
-                        f'https://image.pollinations.ai/prompt/{styled_content}?nologo=true&seed={seed}&width=1920&height=1080',
-                        timeout=60  # Increased timeout to 60 seconds
-                    )
-                    response.raise_for_status()  # Raises an HTTPError for bad responses
-
-                    if response.content:
-                        image = Image.open(BytesIO(response.content))
-                        image.save(image_path)
-                        print(f"Image saved to: {image_path}")
-                        callback(entry_id, image_path)
-                        print(f"Image successfully generated for entry {entry_id} with seed {seed}")
-                        return
-                    else:
-                        print(f"Received empty response for entry {entry_id}")
-                        raise RequestException("Empty response received")
-
-                except RequestException as e:
-                    print(f"Error generating image for entry {entry_id} (Attempt {attempt + 1}/{max_retries}): {str(e)}")
-                    if attempt < max_retries - 1:
-                        wait_time = base_wait_time * (2 ** attempt)  # Exponential backoff
-                        print(f"Retrying in {wait_time} seconds...")
-                        time.sleep(wait_time)
-                    else:
-                        print(f"Max retries reached for entry {entry_id}. Adding to retry queue.")
-                        self.add_to_retry_queue(entry_id, journal_content)
-
-            print(f"Failed to generate image for entry {entry_id} after {max_retries} attempts.")
-
-        threading.Thread(target=fetch_image).start()
-
-    # Load settings from file
-    def load_settings(self):
-        with open(SETTINGS_FILE, "r") as f:
-            return json.load(f)
+            extension = ".tar.gz" if format == "archive" else ".jsonl"
+            output = filedialog.asksaveasfilename(title="Export journal", defaultextension=extension,
+                                                  initialfile=f"journal{extension}")
+        if not output:
+            return
+
+        # Runs in the background, an interrupted export picks up where it stopped next time
+        def run():
+            try:
+                summary = export_journal(self.engine, output, format)
+            except (OSError, ValueError) as e:
+                log.exception("Export to %s failed", output)
+                self.dispatcher.post(messagebox.showerror, "Export", f"Export failed: {e}")
+                return
+            self.dispatcher.post(messagebox.showinfo, "Export",
+                                 f"Exported {summary['entries']} entries and {summary['images']} images "
+                                 f"to {output} in {summary['seconds']:.1f}s.")
+
+        self.export_thread = threading.Thread(target=run, name="export", daemon=True)
+        self.export_thread.start()
+
+    def optimize_images(self):
+        if self.optimize_thread is not None and self.optimize_thread.is_alive():
+            messagebox.showinfo("Optimize Image Storage", "Image storage is already being optimized.")
+            return
+
+        # Conversion runs in other processes, renamed images reach the list through the image listeners
+        def run():
+            try:
+                summary = self.engine.migrate_images()
+            except (OSError, sqlite3.Error) as e:
+                log.exception("Optimizing image storage failed")
+                self.dispatcher.post(messagebox.showerror, "Optimize Image Storage", f"Optimizing failed: {e}")
+                return
+            self.dispatcher.post(messagebox.showinfo, "Optimize Image Storage",
+                                 f"Converted {summary['converted']} of {summary['images']} images to "
+                                 f"{summary['format']} and saved {summary['saved_bytes'] / 1024 / 1024:.1f} MB.")
+
+        self.optimize_thread = threading.Thread(target=run, name="optimize-images", daemon=True)
+        self.optimize_thread.start()
+
+    def periodic_image_check(self):
+        self.start_check("image-check", self.engine.check_entries_without_images)
+        self.root.after(IMAGE_CHECK_INTERVAL, self.periodic_image_check)
+
+    def periodic_disk_check(self):
+        self.start_check("disk-check", self.engine.verify_images_on_disk)
+        self.root.after(IMAGE_DISK_CHECK_INTERVAL, self.periodic_disk_check)
+
+    def start_check(self, name, check):
+        # The checks read the whole journal and list the image directory, so
+        # they run off the main loop, one of each kind at a time. Nothing on
+        # screen comes from their results (the calendar counts come from the
+        # database), so nothing is posted back.
+        thread = self.check_threads.get(name)
+        if thread is not None and thread.is_alive():
+            return
+
+        def run():
+            try:
+                check()
+            except (OSError, sqlite3.Error):
+                log.exception("Periodic %s failed", name)
+
+        self.check_threads[name] = threading.Thread(target=run, name=name, daemon=True)
+        self.check_threads[name].start()
+
+    def reload_view(self):
+        # Calendar counts and the day on screen may both have new entries
+        self.month_counts = {}
+        self.month_missing = {}
+        if self.current_day:
+            self.go_to_entry(self.current_day)
+        else:
+            self.update_calendar()
+
+    def on_close(self):
+        self.engine.close()
+        self.root.destroy()
 
     # Save settings to file
     def save_settings(self):
-        with open(SETTINGS_FILE, "w") as f:
-            json.dump(self.settings, f)
+        self.engine.save_settings()
 
     # Toggle Always on Top
     def toggle_always_on_top(self):
@@ -408,11 +959,13 @@ class JournalApp:
         self.load_entries_for_selected_day(today)
 
     def highlight_day(self, day):
-        for button in self.calendar_buttons:
-            if button["text"] == str(day):
-                button.config(bg="lightblue")
-            else:
-                button.config(bg="SystemButtonFace")
+        if self.highlighted_button is not None:
+            self.highlighted_button.config(bg=self.calendar_bg)
+            self.highlighted_button = None
+        button = self.day_buttons.get(day)
+        if button is not None:
+            button.config(bg="lightblue")
+            self.highlighted_button = button
 
     def change_year(self, delta):
         self.current_year += delta
@@ -420,43 +973,72 @@ class JournalApp:
         self.update_calendar()
         self.clear_entries()
 
-    def update_calendar(self, event=None):
-        for widget in self.calendar_frame.winfo_children():
-            widget.destroy()
-        self.calendar_buttons = []
-
-        selected_month = self.month_var.get()
-        month_index = list(calendar.month_name)[1:].index(selected_month) + 1
-
-        first_weekday, num_days = calendar.monthrange(self.current_year, month_index)
-        first_weekday = (first_weekday + 1) % 7
-
-        # Create labels for weekdays
+    def build_calendar(self):
+        # The grid is created once, update_calendar only relabels it
         weekdays = ['S', 'M', 'T', 'W', 'T', 'F', 'S']
         for i, day in enumerate(weekdays):
             label = tk.Label(self.calendar_frame, text=day, width=2, font=('Arial', 7))
             label.grid(row=0, column=i, sticky="nsew", padx=1, pady=1)
 
-        day_count = 1
+        self.calendar_buttons = []
         for i in range(6):
             for j in range(7):
-                if (i == 0 and j < first_weekday) or (day_count > num_days):
-                    label = tk.Label(self.calendar_frame, text="", width=2, height=1)
-                    label.grid(row=i+1, column=j, sticky="nsew", padx=1, pady=1)
-                else:
-                    button = tk.Button(self.calendar_frame, text=str(day_count),
-                                       command=lambda d=day_count: self.load_entries_for_selected_day(d),
-                                       width=2, height=1, font=('Arial', 7))
-                    button.grid(row=i+1, column=j, sticky="nsew", padx=1, pady=1)
-                    self.calendar_buttons.append(button)
-                    day_count += 1
+                button = tk.Button(self.calendar_frame, text="", width=2, height=2, font=('Arial', 7))
+                button.grid(row=i+1, column=j, sticky="nsew", padx=1, pady=1)
+                self.calendar_buttons.append(button)
+        self.calendar_bg = self.calendar_buttons[0].cget("bg")
+        self.calendar_fg = self.calendar_buttons[0].cget("fg")
+        self.day_buttons = {}  # day number -> button, for the month on display
+        self.highlighted_button = None
+
+    def get_month_counts(self, year, month):
+        # Per-day [entries, missing images] for a month, cached and kept up to date incrementally
+        month_key = f"{year}-{month:02d}"
+        counts = self.month_counts.get(month_key)
+        if counts is None:
+            self.engine.flush()  # Count what's pending in the journal writer too
+            start_day, end_day = f"{month_key}-01", f"{month_key}-31"
+            counts = self.set_month_counts(month_key, self.store.day_counts(start_day, end_day),
+                                           self.store.imageless_entries(start_day, end_day))
+        return counts
+
+    def set_month_counts(self, month_key, day_counts, missing):
+        # Missing images are counted from the ids, so an image that was already
+        # in when the month was counted isn't taken off again when it's applied
+        counts = {int(day[-2:]): [value[0], 0] for day, value in day_counts.items()}
+        for day in missing.values():
+            counts.setdefault(int(day[-2:]), [0, 0])[1] += 1
+        self.month_counts[month_key] = counts
+        self.month_missing[month_key] = set(missing)
+        return counts
+
+    def adjust_day_counts(self, day, entries_delta=0, missing_delta=0):
+        counts = self.month_counts.get(day[:7])
+        if counts is None:
+            return  # Month not cached yet, it will be counted when first shown
+        day_number = int(day[-2:])
+        day_counts = counts.setdefault(day_number, [0, 0])
+        day_counts[0] += entries_delta
+        day_counts[1] += missing_delta
+        if self.calendar_month == day[:7]:
+            self.label_day_button(day_number)
+
+    def label_day_button(self, day_number):
+        button = self.day_buttons.get(day_number)
+        if button is None:
+            return
+        count, missing = self.month_counts.get(self.calendar_month, {}).get(day_number, [0, 0])
+        # Second line: number of entries, then entries still waiting for an image
+        if missing:
+            button.config(text=f"{day_number}\n{count}·{missing}", fg="darkorange")
+        elif count:
+            button.config(text=f"{day_number}\n{count}", fg=self.calendar_fg)
+        else:
+            button.config(text=f"{day_number}\n", fg=self.calendar_fg)
 
-        current_date = datetime.now()
-        if selected_month == current_date.strftime("%B") and self.current_year == current_date.year:
-            self.highlight_day(current_date.day)
+    def update_calendar(self, event=None):
+        month_index = self.draw_calendar()
 
-        self.year_label.config(text=str(self.current_year))
-        
         # Update current_day to match the selected month and year
         self.current_day = f"{self.current_year}-{month_index:02d}-01"
         
@@ -464,57 +1046,64 @@ class JournalApp:
         self.clear_entries()
         self.load_entries_for_selected_day(1)
 
+    def draw_calendar(self):
+        # Labels the grid for the selected month and returns its number
+        selected_month = self.month_var.get()
+        month_index = list(calendar.month_name)[1:].index(selected_month) + 1
+
+        first_weekday, num_days = calendar.monthrange(self.current_year, month_index)
+        first_weekday = (first_weekday + 1) % 7
+
+        self.calendar_month = f"{self.current_year}-{month_index:02d}"
+        self.get_month_counts(self.current_year, month_index)
+        self.highlight_day(None)
+        self.day_buttons = {}
+        for cell, button in enumerate(self.calendar_buttons):
+            day_number = cell - first_weekday + 1
+            if 1 <= day_number <= num_days:
+                button.config(state=tk.NORMAL, relief=tk.RAISED,
+                              command=lambda d=day_number: self.load_entries_for_selected_day(d))
+                self.day_buttons[day_number] = button
+                self.label_day_button(day_number)
+            else:
+                button.config(text="", state=tk.DISABLED, relief=tk.FLAT, command="")
+
+        current_date = datetime.now()
+        if selected_month == current_date.strftime("%B") and self.current_year == current_date.year:
+            self.highlight_day(current_date.day)
+
+        self.year_label.config(text=str(self.current_year))
+        return month_index
+
     def clear_entries(self):
-        for widget in self.entry_frame.winfo_children():
-            widget.destroy()
+        self.entry_list.clear()
         self.current_day = None
 
-    def load_all_entries(self):
-        self.entries = {}
-        for filename in os.listdir(SAVE_DIR):
-            if filename.endswith('.json'):
-                date = filename[:-5]  # Remove '.json' from the filename
-                file_path = os.path.join(SAVE_DIR, filename)
-                try:
-                    with open(file_path, "r") as f:
-                        day_entries = json.load(f)
-                    self.entries[date] = day_entries
-                    print(f"Loaded {len(day_entries)} entries for {date}")
-                except json.JSONDecodeError:
-                    print(f"Error loading journal entries for {date}. File may be corrupted.")
-        
-        # Set current_day to today's date
-        self.current_day = datetime.now().strftime("%Y-%m-%d")
-        print(f"Current day set to: {self.current_day}")
-        
-        self.check_entries_without_images()
-        
+    def show_manifest(self):
+        # Today's month and entries for the first frame, without waiting for the journal to load
+        today = datetime.now().strftime("%Y-%m-%d")
+        with metrics.timer("startup_manifest_seconds"):
+            day_counts, missing, day_entries = self.engine.manifest(today)
+        self.set_month_counts(today[:7], day_counts, missing)
+        self.draw_calendar()
+        self.current_day = today
+        self.entry_list.set_entries(day_entries)
+        log.debug("Loaded %d entries for %s", len(day_entries), self.current_day)
+
     def load_entries_for_selected_day(self, day):
         selected_month = self.month_var.get()
         month_index = list(calendar.month_name)[1:].index(selected_month) + 1
         selected_date = f"{self.current_year}-{month_index:02d}-{day:02d}"
         
-        self.highlight_day(day)
-        self.current_day = selected_date
-        print(f"Loading entries for: {self.current_day}")
-
-        # Clear previous entries
-        for widget in self.entry_frame.winfo_children():
-            widget.destroy()
-
-        # Load and display entries for the selected day
-        if self.current_day in self.entries:
-            for entry_id, entry, image_path in self.entries[self.current_day]:
-                self.insert_saved_entry(entry_id, entry, image_path)
-            print(f"Loaded {len(self.entries[self.current_day])} entries for {self.current_day}")
-        else:
-            print(f"No entries found for {self.current_day}")
+        with metrics.timer("day_render_seconds"):
+            self.highlight_day(day)
+            self.current_day = selected_date
 
-    def save_to_file(self):
-        if self.current_day:
-            save_path = os.path.join(SAVE_DIR, f"{self.current_day}.json")
-            with open(save_path, "w") as f:
-                json.dump(self.entries.get(self.current_day, []), f)
+            # Load and display entries for the selected day, fetching their pending images first
+            self.engine.show_day(self.current_day)
+            day_entries = self.engine.day_entries(self.current_day)
+            self.entry_list.set_entries(day_entries)
+        log.debug("Loaded %d entries for %s", len(day_entries), self.current_day)
 
     def add_entry(self, event=None):
         entry_text = self.input_entry.get()
@@ -526,17 +1115,69 @@ class JournalApp:
 
     def process_entry(self, entry_text):
         self.input_entry.delete(0, tk.END)
-        entry_id = datetime.now().strftime("%Y%m%d%H%M%S")
-        current_time = datetime.now().strftime("[%I:%M%p] ")
-        full_entry = current_time + entry_text
-        
-        if self.current_day not in self.entries:
-            self.entries[self.current_day] = []
-        
-        self.entries[self.current_day].append((entry_id, full_entry, None))
-        self.save_to_file()
-        self.insert_saved_entry(entry_id, full_entry, None)
-        generate_image_async(entry_id, entry_text, self.update_entry_with_image)
+        entry = self.engine.add_entry(self.current_day, entry_text)
+        missing = self.month_missing.get(self.current_day[:7])
+        if missing is not None:
+            missing.add(entry.entry_id)
+        self.adjust_day_counts(self.current_day, 1, 1)
+        self.insert_saved_entry(entry)
+
+    def search_entries(self, event=None):
+        # "from:YYYY-MM-DD" and "to:YYYY-MM-DD" limit the date range, quoted text is a phrase
+        query = self.search_entry.get().strip()
+        start_day = end_day = None
+        for key, value in re.findall(r'\b(from|to):(\d{4}-\d{2}-\d{2})', query):
+            if key == "from":
+                start_day = value
+            else:
+                end_day = value
+        query = re.sub(r'\b(from|to):\d{4}-\d{2}-\d{2}', '', query).strip()
+        if not query:
+            return
+
+        started = time.perf_counter()
+        self.engine.flush()  # Entries added a moment ago are searchable too
+        results = self.store.search(query, start_day, end_day)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.show_search_results(query, results, elapsed_ms)
+
+    def show_search_results(self, query, results, elapsed_ms):
+        if self.search_window is None or not self.search_window.winfo_exists():
+            self.search_window = tk.Toplevel(self.root)
+            self.search_window.geometry("600x400")
+            self.search_status = tk.Label(self.search_window, anchor="w")
+            self.search_status.pack(fill=tk.X, padx=10, pady=(10, 0))
+            list_frame = tk.Frame(self.search_window)
+            list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+            self.search_list = tk.Listbox(list_frame, activestyle="none")
+            self.search_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            scrollbar = tk.Scrollbar(list_frame, command=self.search_list.yview)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            self.search_list.config(yscrollcommand=scrollbar.set)
+            self.search_list.bind("<<ListboxSelect>>", self.open_search_result)
+
+        self.search_window.title(f"Search: {query}")
+        self.search_status.config(text=f"{len(results)} results in {elapsed_ms:.1f} ms")
+        self.search_results = results
+        self.search_list.delete(0, tk.END)
+        for day, entry_id, text in results:
+            self.search_list.insert(tk.END, f"{day}  {text}")
+        self.search_window.lift()
+
+    def open_search_result(self, event=None):
+        selection = self.search_list.curselection()
+        if selection:
+            day, entry_id, _ = self.search_results[selection[0]]
+            self.go_to_entry(day, entry_id)
+
+    def go_to_entry(self, day, entry_id=None):
+        year, month, day_number = (int(part) for part in day.split('-'))
+        self.month_var.set(calendar.month_name[month])
+        self.current_year = year
+        self.update_calendar()
+        self.load_entries_for_selected_day(day_number)
+        if entry_id:
+            self.entry_list.scroll_to(entry_id)
 
     def go_to_today(self):
         today = datetime.now()
@@ -572,148 +1213,73 @@ class JournalApp:
         tk.Button(dialog, text="Post on Selected Day", command=post_selected).pack(fill=tk.X, padx=50, pady=5)
         tk.Button(dialog, text="Always Post on Selected Day", command=post_selected_no_warning).pack(fill=tk.X, padx=50, pady=5)
 
-    # Save the current entry with timestamp and asynchronously fetch the image
-    def save_entry(self, entry_id, entry_text):
-        current_time = datetime.now().strftime("[%I:%M%p] ")  # Generate timestamp
-        full_entry = current_time + entry_text
-        self.entries.setdefault(self.current_day, []).append((entry_id, full_entry, None))  # Add the entry without an image initially
-
-        # Immediately save the current state to JSON to ensure it persists
-        self.save_to_file()
-
-        self.insert_saved_entry(entry_id, full_entry, None)  # Insert text-only entry with placeholder image
-
-        # Asynchronously generate the image and update the entry when available
-        generate_image_async(entry_id, entry_text, self.update_entry_with_image)
-
-    # Update an entry with the generated image
-    def update_entry_with_image(self, entry_id, image_path):
-        # Find the entry in the list and update its image path
-        if self.current_day in self.entries:
-            for i, (e_id, e, img) in enumerate(self.entries[self.current_day]):
-                if e_id == entry_id:
-                    print(f"Updating entry {entry_id} with image")
-                    self.entries[self.current_day][i] = (e_id, e, image_path)
-                    self.replace_existing_entry_with_image(entry_id, e, image_path)
-                    break  # Avoid unnecessary iteration
-            else:
-                print(f"Could not find entry {entry_id} in current day {self.current_day}.")
-        else:
-            print(f"No entries found for the current day.")
-
-        # Save the updated entries
-        self.save_to_file()
-
-    def replace_existing_entry_with_image(self, entry_id, entry, image_path):
-        print(f"Replacing image for entry: {entry_id}")
-        for widget in self.entry_frame.winfo_children():
-            if isinstance(widget, ctk.CTkFrame):
-                for child in widget.winfo_children():
-                    if isinstance(child, tk.Label) and child.cget("text") == entry:
-                        image_label = widget.winfo_children()[0]  # Assuming image is the first child
-                        if os.path.exists(image_path):
-                            img_thumbnail = Image.open(image_path)
-                            img_thumbnail.thumbnail((150, 84))  # 16:9 aspect ratio for thumbnail
-                            photo = ImageTk.PhotoImage(img_thumbnail)
-                            image_label.config(image=photo)
-                            image_label.image = photo  # Keep a reference
-                            print(f"Successfully replaced image for entry: {entry_id}")
-                            return
-        print(f"Could not find widget to update for entry: {entry_id}")
+    # Called by the engine, usually from an image worker, when an entry gets
+    # its image. Widgets are only touched later, on the main loop.
+    def on_entry_image(self, entry_id, day, old_image_path, image_path):
+        self.dispatcher.post(self.apply_entry_image, entry_id, day, old_image_path, image_path)
+
+    def apply_entry_image(self, entry_id, day, old_image_path, image_path):
+        missing = self.month_missing.get(day[:7])
+        if missing is not None and entry_id in missing:
+            missing.discard(entry_id)
+            self.adjust_day_counts(day, 0, -1)
+        if day == self.current_day:
+            entry = self.engine.get_entry(entry_id)
+            if entry is not None:
+                self.replace_existing_entry_with_image(entry)
+
+    def replace_existing_entry_with_image(self, entry):
+        # The entry list maps entry ids to rows, so only this entry's row is redrawn
+        if not self.entry_list.update_entry(entry):
+            log.debug("Entry %s is not on the day shown", entry.entry_id)
 
     # Function to insert saved entry with text and image (or placeholder image)
-    def insert_saved_entry(self, entry_id, entry, image_path=None):
-        entry_frame = ctk.CTkFrame(self.entry_frame, corner_radius=10)
-        entry_frame.pack(fill=tk.X, padx=10, pady=5)
-
-        if image_path and os.path.exists(image_path):
-            img_thumbnail = Image.open(image_path)
-            img_thumbnail.thumbnail((150, 84))  # 16:9 aspect ratio for thumbnail
-        else:
-            img_thumbnail = Image.open(get_placeholder_image())  # Use placeholder if no image available
-        
-        photo = ImageTk.PhotoImage(img_thumbnail)
-        image_label = tk.Label(entry_frame, image=photo, bd=2, relief="solid")
-        image_label.image = photo  # Keep reference to prevent garbage collection
-        image_label.pack(side=tk.LEFT, padx=5)
-
-        # Display text aligned to the right of the image
-        text_label = tk.Label(entry_frame, text=entry, anchor="w", justify=tk.LEFT, wraplength=500)
-        text_label.pack(side=tk.LEFT, padx=10, pady=5)
-        
-        print(f"Inserted entry: {entry_id} with image path: {image_path}")
-
-        # Bind left-click to show large image
-        image_label.bind("<Button-1>", lambda e: self.show_large_image(image_path))
-        
-        # Bind right-click for context menu
-        image_label.bind("<Button-3>", lambda event: self.show_context_menu(event, entry_id, entry_text=entry))
-        text_label.bind("<Button-3>", lambda event: self.show_context_menu(event, entry_id, entry_text=entry))
+    def insert_saved_entry(self, entry):
+        self.entry_list.append(entry)
 
     def show_large_image(self, image_path):
+        if image_path and self.engine.is_evicted(image_path):
+            # Only the thumbnail was kept to save space, make the original again first
+            if self.engine.restore_image(
+                    image_path, lambda path: self.dispatcher.post(self.show_large_image, path),
+                    lambda path: self.dispatcher.post(self.image_viewer.show_message, "Couldn't regenerate the image.")):
+                self.image_viewer.show_message("Regenerating image...")
+            return
         if image_path and os.path.exists(image_path):
-            popup = tk.Toplevel(self.root)
-            popup.title("Large Image")
-            popup.attributes('-topmost', True)  # Keep the popup on top
-
-            # Calculate 80% of screen size
-            screen_width = popup.winfo_screenwidth()
-            screen_height = popup.winfo_screenheight()
-            popup_width = int(screen_width * 0.8)
-            popup_height = int(screen_height * 0.8)
-
-            popup.geometry(f"{popup_width}x{popup_height}")
-
-            img = Image.open(image_path)
-            img.thumbnail((popup_width, popup_height))  # Resize image to fit the popup
-            photo = ImageTk.PhotoImage(img)
-
-            label = tk.Label(popup, image=photo)
-            label.image = photo  # Keep a reference
-            label.pack(fill=tk.BOTH, expand=True)
-
-            # Close the popup when clicked
-            label.bind("<Button-1>", lambda e: popup.destroy())
-
-    def show_context_menu(self, event, entry_id, entry_text):
+            # Flip through the images of the entries on screen
+            images = [entry.image_path for entry in self.entry_list.entries
+                      if entry.image_path and os.path.exists(entry.image_path)]
+            if image_path not in images:
+                images = [image_path]
+            self.image_viewer.show(images, images.index(image_path))
+
+    def show_context_menu(self, event, entry):
         context_menu = tk.Menu(self.root, tearoff=0)
-        
-        # Extract the content part of the entry (remove timestamp)
-        content = entry_text.split('] ', 1)[1] if '] ' in entry_text else entry_text
-        
-        context_menu.add_command(label="Regen Image", command=lambda: self.retry_image(entry_id, content))
-        context_menu.add_command(label="Edit Entry", command=lambda: self.edit_entry(entry_id, entry_text))
+        entry_id = entry.entry_id
+        context_menu.add_command(label="Regen Image", command=lambda: self.retry_image(entry_id, entry.content, new_seed=True))
+        context_menu.add_command(label="Edit Entry", command=lambda: self.edit_entry(entry))
         context_menu.add_command(label="Delete Entry", command=lambda: self.delete_entry(entry_id))
         context_menu.post(event.x_root, event.y_root)
     
-    def edit_entry(self, entry_id, entry_text):
+    def edit_entry(self, entry):
         # Create a popup window for editing
         edit_popup = tk.Toplevel(self.root)
         edit_popup.title("Edit Entry")
         edit_popup.geometry("500x400")  # Significantly reduced height
 
-        # Extract the timestamp and the actual content
-        timestamp, actual_text = entry_text.split(']', 1)
-        actual_text = actual_text.strip()
-
-        # Use a Text widget for multi-line editing
+        # Use a Text widget for multi-line editing, the entry keeps its time
         text_box = tk.Text(edit_popup, wrap=tk.WORD, height=8)  # Reduced height
         text_box.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 5))
-        text_box.insert(tk.END, actual_text)
+        text_box.insert(tk.END, entry.content)
 
         # Function to save changes
         def save_changes():
             new_text = text_box.get("1.0", tk.END).strip()
-            full_entry = f"{timestamp}] {new_text}"
-            for i, (e_id, _, image_path) in enumerate(self.entries[self.current_day]):
-                if e_id == entry_id:
-                    self.entries[self.current_day][i] = (e_id, full_entry, image_path)
-                    break
-            self.save_to_file()
-            day = int(self.current_day.split()[1])  # Extract the day number from self.current_day
-            self.load_entries_for_selected_day(day)
+            updated = self.engine.update_entry_content(entry.entry_id, new_text)
+            if updated is not None:
+                self.entry_list.update_entry(updated)
             edit_popup.destroy()
-            self.retry_image(entry_id, new_text)
+            self.retry_image(entry.entry_id, new_text)
 
         # Add a "Save" button
         save_button = tk.Button(edit_popup, text="Save", command=save_changes)
@@ -723,34 +1289,27 @@ class JournalApp:
         edit_popup.bind("<Control-s>", lambda event: save_changes())
 
     def delete_entry(self, entry_id):
-        # Find and remove the entry from self.entries
-        for i, (e_id, _, image_path) in enumerate(self.entries[self.current_day]):
-            if e_id == entry_id:
-                del self.entries[self.current_day][i]  # Delete the entry
-                break
-        # Remove the image from the filesystem
-        image_file = os.path.join(IMAGE_DIR, f'{entry_id}.jpg')
-        if os.path.exists(image_file):
-            os.remove(image_file)
+        deleted = self.engine.delete_entry(entry_id)
+        if deleted is None:
+            log.warning("Could not find entry %s to delete", entry_id)
+            return
+        day, entry = deleted
+        missing = self.month_missing.get(day[:7], set())
+        self.adjust_day_counts(day, -1, -1 if entry_id in missing else 0)
+        missing.discard(entry_id)
         # Refresh the display
-        self.load_entries_for_selected_day()
-        self.save_to_file()
+        self.entry_list.remove(entry_id)
 
-    def retry_image(self, entry_id, entry_text):
-        print(f"Retrying image generation for entry: {entry_id}")
-        
-        def callback(entry_id, image_path):
-            self.update_entry_with_image(entry_id, image_path)
-            # Force a complete reload of the current day's entries
-            current_day = int(self.current_day.split('-')[2])
-            self.load_entries_for_selected_day(current_day)
+    def retry_image(self, entry_id, entry_text, priority=None, new_seed=False):
+        log.debug("Retrying image generation for entry %s", entry_id)
         
-        self.generate_image_async(entry_id, entry_text, callback)
+        # on_entry_image refreshes just this entry's row if it's on screen
+        self.engine.request_image(entry_id, entry_text, priority, new_seed=new_seed)
     
 # Initialize the app
 if __name__ == "__main__":
+    configure_logging()
     ctk.set_appearance_mode("System")
     root = ctk.CTk()
     app = JournalApp(root)
-    # generate_image_async = lambda entry_id, journal_content, callback: app.generate_image_async(entry_id, journal_content, callback)
     root.mainloop()
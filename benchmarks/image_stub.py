@@ -0,0 +1,131 @@
+# Local stand-in for the image.pollinations.ai /prompt/... endpoint, so image
+# generation can be measured without the network:
+#
+#   python benchmarks/image_stub.py --port 8765 --latency 0.5 --failure-rate 0.1 --throttle-rate 0.05
+#
+# then set "image_base_url": "http://127.0.0.1:8765/prompt/" in settings.json.
+# Failures are answered with HTTP 500, throttles with 429 and a Retry-After
+# header. Latency, failures and throttles come from a seeded random generator,
+# so a run with the same settings sees the same sequence of delays and errors.
+import argparse
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import BytesIO
+from urllib.parse import urlsplit, parse_qs
+
+from PIL import Image
+
+DEFAULT_PORT = 8765
+
+class ImageStub:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, failure_rate=0.0, throttle_rate=0.0,
+                 retry_after=1, seed=0):
+        self.latency = latency  # seconds before every response
+        self.jitter = jitter    # extra random seconds, up to this much
+        self.failure_rate = failure_rate  # share of requests answered with an error
+        self.throttle_rate = throttle_rate  # share of requests answered with 429 Too Many Requests
+        self.retry_after = retry_after  # seconds sent in Retry-After with a 429
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.images = {}  # (width, height) -> JPEG bytes
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.handle(self)
+
+            def log_message(self, format, *args):
+                pass  # Keep benchmark output readable
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/prompt/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="image-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def image_bytes(self, width, height):
+        # One noisy JPEG per size, about as large as a real generated image
+        with self.lock:
+            data = self.images.get((width, height))
+            if data is None:
+                buffer = BytesIO()
+                Image.effect_noise((width, height), 40).convert("RGB").save(buffer, "JPEG", quality=85)
+                data = self.images[(width, height)] = buffer.getvalue()
+            return data
+
+    def handle(self, request):
+        url = urlsplit(request.path)
+        if not url.path.startswith("/prompt/"):
+            request.send_error(404)
+            return
+        query = parse_qs(url.query)
+        width = int(query.get("width", ["1920"])[0])
+        height = int(query.get("height", ["1080"])[0])
+
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.failure_rate
+            throttle = not fail and self.random.random() < self.throttle_rate
+            if fail:
+                self.failures += 1
+            if throttle:
+                self.throttled += 1
+        if throttle:
+            request.send_response(429)
+            request.send_header("Retry-After", str(self.retry_after))
+            request.send_header("Content-Length", "0")
+            request.end_headers()
+            return
+        time.sleep(delay)
+        if fail:
+            request.send_error(500, "Stub failure")
+            return
+
+        data = self.image_bytes(width, height)
+        request.send_response(200)
+        request.send_header("Content-Type", "image/jpeg")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local image service stub")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stub = ImageStub(port=args.port, latency=args.latency, jitter=args.jitter,
+                     failure_rate=args.failure_rate, throttle_rate=args.throttle_rate,
+                     retry_after=args.retry_after, seed=args.seed)
+    print(f"Serving images at {stub.base_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# Benchmarks JOURNALGEN's engine on synthetic journals against the local image
+# stub, so results don't depend on the network:
+#
+#   python benchmarks/run_benchmarks.py --sizes 1000,10000 --output results.json
+#   python benchmarks/run_benchmarks.py --sizes 1000,10000 --compare results.json
+#
+# Journals, latencies and failures are all seeded, and every timing is the
+# median of --repeat runs, so two runs of the same command are comparable.
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_stub import ImageStub
+from synthetic_journal import generate
+from journalgen_core import JournalEngine, RestyleJob
+from journalgen_providers import HttpImageProvider
+from journalgen_cli import BatchRun
+from journalgen_metrics import configure_logging, metrics
+
+DEFAULT_SIZES = "1000,10000,100000"
+DAY_SAMPLES = 200  # random days opened for the day load timing
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+def summary(samples):
+    return {"median": round(statistics.median(samples), 6), "min": round(min(samples), 6), "runs": len(samples)}
+
+def open_engine(args, stub):
+    # No requests per second cap, the adaptive concurrency limit still applies
+    provider = HttpImageProvider("stub", stub.base_url, rate=0, max_concurrency=args.workers)
+    return JournalEngine(".", num_workers=args.workers, provider=provider)
+
+def bench_size(entries, args, stub, work_dir):
+    journal_dir = os.path.join(work_dir, f"journal-{entries}")
+    info = generate(journal_dir, entries, seed=args.seed)
+    os.chdir(journal_dir)  # Image paths in the journal are relative, as in the app
+    results = {"journal": info}
+
+    # First start: JSON migration into journal.db plus the load itself
+    engine = open_engine(args, stub)
+    seconds, _ = timed(engine.load_entries)
+    engine.close()
+    results["load_all_entries_first_start"] = round(seconds, 6)
+
+    # Later starts, fresh engine every time. The app draws its first frame
+    # from the engine and today's manifest, the load runs behind it.
+    first_frame_times, load_times, check_times = [], [], []
+    today = datetime.now().strftime("%Y-%m-%d")
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        engine = open_engine(args, stub)
+        engine.manifest(today)
+        first_frame_times.append(time.perf_counter() - started)
+        load_times.append(timed(engine.load_entries)[0])
+        check_times.append(timed(engine.check_entries_without_images)[0])
+        engine.close()
+        if os.path.exists("retry_queue.json"):
+            os.remove("retry_queue.json")
+    results["startup_first_frame"] = summary(first_frame_times)
+    results["load_all_entries"] = summary(load_times)
+    results["check_entries_without_images"] = summary(check_times)
+
+    engine = open_engine(args, stub)
+    engine.load_entries()
+
+    # What the app does when a day is clicked, minus the widgets
+    rng = random.Random(args.seed)
+    days = sorted(engine.store.day_counts("", "9999"))
+    sample = [rng.choice(days) for _ in range(DAY_SAMPLES)]
+    day_times = []
+    for day in sample:
+        started = time.perf_counter()
+        engine.show_day(day)  # Reads in the months around the day when they aren't in memory
+        engine.day_entries(day)
+        day_times.append(time.perf_counter() - started)
+    results["load_entries_for_selected_day"] = summary(day_times)
+
+    # Apply Style over the last days of the journal
+    start_day = days[-args.restyle_days] if len(days) >= args.restyle_days else days[0]
+    job = RestyleJob(engine, start_day, days[-1], "watercolor", max_in_flight=args.workers * 2, rate=0)
+    started = time.perf_counter()
+    job.start()
+    job.finished.wait()
+    seconds = time.perf_counter() - started
+    results["apply_style_retroactively"] = {
+        "days": len(days) - days.index(start_day), "images": job.done, "failed": job.failed,
+        "seconds": round(seconds, 6), "images_per_second": round(job.done / seconds, 3) if seconds else 0.0,
+    }
+
+    # End to end image throughput: entries without an image, generated in bulk
+    jobs = []
+    for entry_id in sorted(engine.missing_images):
+        entry = engine.get_entry(entry_id)
+        if entry is not None:
+            jobs.append((entry_id, entry.content))
+    results["image_throughput"] = BatchRun(engine, jobs[:args.images]).run()
+    engine.close()
+    return results
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+    }
+
+def headline(results):
+    # The single number per benchmark used for comparisons, lower is better
+    return {
+        "load_all_entries_first_start": results["load_all_entries_first_start"],
+        "startup_first_frame": results["startup_first_frame"]["median"],
+        "load_all_entries": results["load_all_entries"]["median"],
+        "check_entries_without_images": results["check_entries_without_images"]["median"],
+        "load_entries_for_selected_day": results["load_entries_for_selected_day"]["median"],
+        "apply_style_retroactively": results["apply_style_retroactively"]["seconds"],
+        "image_throughput": results["image_throughput"]["seconds"],
+    }
+
+def print_report(report, baseline=None):
+    for size, results in report["results"].items():
+        print(f"\n{size} entries")
+        previous = headline(baseline["results"][size]) if baseline and size in baseline["results"] else {}
+        for name, seconds in headline(results).items():
+            line = f"  {name:<32} {seconds * 1000:>12.3f} ms"
+            if previous.get(name):
+                line += f"  ({seconds / previous[name]:.2f}x of baseline)"
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JOURNALGEN on synthetic journals")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated entry counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per timing, the median is reported")
+    parser.add_argument("--workers", type=int, default=4, help="image worker threads")
+    parser.add_argument("--images", type=int, default=200, help="images generated for the throughput run")
+    parser.add_argument("--restyle-days", type=int, default=30, help="days restyled by the Apply Style run")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub seconds per image")
+    parser.add_argument("--jitter", type=float, default=0.0, help="stub extra random seconds per image")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of stub requests that fail")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of stub requests answered with 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="where journals are generated (default: a temp dir, removed afterwards)")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the engine's log output")
+    args = parser.parse_args()
+    # The engine logs every step to stderr, keep that out of the timings and the report
+    configure_logging("INFO" if args.verbose else "ERROR")
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    settings = {key: value for key, value in vars(args).items()
+                if key not in ("work_dir", "output", "compare", "verbose")}
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("settings", {}) != settings:
+            print("Warning: baseline was run with different settings, ratios may not be comparable")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="journalgen-bench-")
+    cwd = os.getcwd()
+    stub = ImageStub(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                     throttle_rate=args.throttle_rate, seed=args.seed).start()
+    report = {"environment": environment(), "settings": settings, "results": {}}
+    try:
+        for size in sizes:
+            print(f"Benchmarking {size} entries...")
+            report["results"][str(size)] = bench_size(size, args, stub, work_dir)
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        stub.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    report["stub"] = {"requests": stub.requests, "failures": stub.failures, "throttled": stub.throttled}
+    report["metrics"] = metrics.snapshot()  # Fetch latency histograms and counters over the whole run
+
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
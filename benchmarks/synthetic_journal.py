@@ -0,0 +1,80 @@
+# Builds a fake journal in the old journal_entries/ + journal_images/ layout,
+# the way a long time user's journal looks before its first start:
+#
+#   python benchmarks/synthetic_journal.py /tmp/journal-10k --entries 10000
+#
+# The same seed always gives the same journal, entry for entry.
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from PIL import Image
+
+WORDS = (
+    "morning coffee walk park rain sun meeting friend dinner book movie garden city train "
+    "beach mountain river dog cat market music concert work project idea dream quiet "
+    "evening night sky stars bread kitchen letter phone call laugh tired happy long short "
+    "snow wind autumn spring summer winter street bridge old new bright grey blue green"
+).split()
+
+DEFAULT_YEARS = 10
+DEFAULT_MISSING_RATE = 0.05  # share of entries whose image was never generated
+
+def image_bytes():
+    # Every entry shares the same small JPEG, the files only need to exist
+    buffer = BytesIO()
+    Image.new("RGB", (64, 36), (120, 140, 160)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def generate(journal_dir, entries, years=DEFAULT_YEARS, missing_rate=DEFAULT_MISSING_RATE, seed=0,
+             end_day="2024-12-31"):
+    # Spread entries over the years before end_day, several per day on busy days
+    rng = random.Random(seed)
+    save_dir = os.path.join(journal_dir, "journal_entries")
+    image_dir = os.path.join(journal_dir, "journal_images")
+    os.makedirs(save_dir, exist_ok=True)
+    os.makedirs(image_dir, exist_ok=True)
+    data = image_bytes()
+
+    last = datetime.strptime(end_day, "%Y-%m-%d")
+    first = last - timedelta(days=365 * years - 1)
+    span = (last - first).days + 1
+    # Random times in seconds since the first day, one per entry and all distinct
+    # so the timestamp ids never collide
+    moments = sorted(rng.sample(range(span * 24 * 60 * 60), entries))
+
+    days = {}
+    with_images = 0
+    for moment in moments:
+        when = first + timedelta(seconds=moment)
+        entry_id = when.strftime("%Y%m%d%H%M%S")
+        text = when.strftime("[%I:%M%p] ") + " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 30)))
+        image_path = None
+        if rng.random() >= missing_rate:
+            image_path = os.path.join("journal_images", f"{entry_id}.jpg")
+            with open(os.path.join(journal_dir, image_path), "wb") as f:
+                f.write(data)
+            with_images += 1
+        days.setdefault(when.strftime("%Y-%m-%d"), []).append((entry_id, text, image_path))
+
+    for day, day_entries in days.items():
+        with open(os.path.join(save_dir, f"{day}.json"), "w") as f:
+            json.dump(day_entries, f)
+    return {"entries": entries, "days": len(days), "images": with_images,
+            "first_day": min(days), "last_day": max(days)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic journal")
+    parser.add_argument("journal_dir")
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--years", type=int, default=DEFAULT_YEARS)
+    parser.add_argument("--missing-rate", type=float, default=DEFAULT_MISSING_RATE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(generate(args.journal_dir, args.entries, args.years, args.missing_rate, args.seed), indent=2))
+
+if __name__ == "__main__":
+    main()
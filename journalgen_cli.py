@@ -0,0 +1,241 @@
+# Command line for batch work on a journal, no display needed:
+#
+#   python journalgen_cli.py stats
+#   python journalgen_cli.py verify
+#   python journalgen_cli.py backfill --workers 8
+#   python journalgen_cli.py regen --from 2023-01-01 --to 2023-12-31 --style watercolor
+#   python journalgen_cli.py regen --resume
+#   python journalgen_cli.py evict --budget-mb 500
+#   python journalgen_cli.py optimize-images --processes 4
+#   python journalgen_cli.py import diary.md
+#   python journalgen_cli.py export --format archive journal.tar.gz
+#   python journalgen_cli.py export --format site --from 2023-01-01 site/
+import argparse
+import json
+import sys
+import threading
+import time
+
+from journalgen_core import JournalEngine, RestyleJob, PRIORITY_BACKGROUND
+from journalgen_export import EXPORT_FORMATS, EXPORT_WORKERS, export_journal
+from journalgen_import import IMPORT_FORMATS, import_file
+from journalgen_metrics import metrics, configure_logging
+
+# Seconds between progress lines during batch runs
+REPORT_INTERVAL = 5
+
+class BatchRun:
+    # Submits a set of image jobs to the engine and waits for all of them,
+    # printing progress and throughput along the way
+    def __init__(self, engine, jobs):
+        self.engine = engine
+        self.jobs = jobs  # list of (entry_id, content)
+        self.remaining = {entry_id for entry_id, _ in jobs}
+        self.done = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def on_image(self, entry_id, day, old_image_path, image_path):
+        self.mark_done(entry_id, failed=False)
+
+    def on_failure(self, entry_id, content):
+        self.mark_done(entry_id, failed=True)
+
+    def mark_done(self, entry_id, failed):
+        with self.lock:
+            if entry_id not in self.remaining:
+                return
+            self.remaining.discard(entry_id)
+            if failed:
+                self.failed += 1
+            else:
+                self.done += 1
+            if not self.remaining:
+                self.finished.set()
+
+    def run(self):
+        total = len(self.jobs)
+        if not total:
+            print("Nothing to do.")
+            return {"total": 0, "done": 0, "failed": 0, "seconds": 0.0, "images_per_second": 0.0}
+
+        self.engine.image_listeners.append(self.on_image)
+        self.engine.failure_listeners.append(self.on_failure)
+        started = time.perf_counter()
+        try:
+            for entry_id, content in self.jobs:
+                self.engine.request_image(entry_id, content, PRIORITY_BACKGROUND)
+
+            while not self.finished.wait(REPORT_INTERVAL):
+                with self.lock:
+                    finished = self.done + self.failed
+                elapsed = time.perf_counter() - started
+                rate = finished / elapsed if elapsed else 0.0
+                eta = (total - finished) / rate if rate else float("inf")
+                print(f"{finished}/{total} images ({self.failed} failed), {rate:.2f} images/s, ETA {eta:.0f}s")
+        finally:
+            self.engine.image_listeners.remove(self.on_image)
+            self.engine.failure_listeners.remove(self.on_failure)
+
+        elapsed = time.perf_counter() - started
+        result = {
+            "total": total,
+            "done": self.done,
+            "failed": self.failed,
+            "seconds": round(elapsed, 2),
+            "images_per_second": round(total / elapsed, 3) if elapsed else 0.0,
+        }
+        print(f"Finished {total} images in {elapsed:.1f}s ({result['images_per_second']} images/s), "
+              f"{self.failed} failed and left in the retry queue")
+        return result
+
+def run_stats(engine, args):
+    print(json.dumps(engine.stats(), indent=2))
+    return 0
+
+def run_verify(engine, args):
+    problems = engine.verify()
+    for problem in problems:
+        print(problem)
+    print(f"{len(problems)} problems found")
+    return 1 if problems else 0
+
+def run_backfill(engine, args):
+    jobs = []
+    for entry_id in sorted(engine.missing_images):
+        entry = engine.get_entry(entry_id)
+        if entry is not None:
+            jobs.append((entry_id, entry.content))
+    if args.limit:
+        jobs = jobs[:args.limit]
+    BatchRun(engine, jobs).run()
+    return 0
+
+def run_regen(engine, args):
+    if args.style and args.style not in engine.style_manager.styles:
+        print(f"Unknown style {args.style}, choose from: {', '.join(engine.style_manager.styles)}")
+        return 2
+
+    max_in_flight = engine.image_generator.num_workers * 2
+    if args.resume:
+        job = RestyleJob.resume(engine, max_in_flight=max_in_flight, rate=args.rate)
+        if job is None:
+            print("Nothing to resume")
+            return 1
+        print(f"Resuming {job.style} restyle after {job.position} of {job.total} entries")
+    else:
+        job = RestyleJob(engine, args.start_day, args.end_day, args.style, max_in_flight=max_in_flight,
+                         rate=args.rate)
+
+    started = time.perf_counter()
+    job.start()
+    try:
+        while not job.finished.wait(REPORT_INTERVAL):
+            finished, total, eta = job.progress()
+            rate = job.done / (time.perf_counter() - started)
+            eta_text = f"ETA {eta:.0f}s" if eta is not None else "ETA unknown"
+            print(f"{finished}/{total} images ({job.failed} failed), {rate:.2f} images/s, {eta_text}")
+    except KeyboardInterrupt:
+        # Leave the checkpoint behind so --resume can pick up from here
+        print("Interrupted, run again with --resume to continue")
+        return 130
+    elapsed = time.perf_counter() - started
+    print(f"Regenerated {job.done} images in {elapsed:.1f}s ({job.done / elapsed if elapsed else 0:.2f} images/s), "
+          f"{job.failed} failed and left in the retry queue")
+    return 0
+
+def run_evict(engine, args):
+    budget = int(args.budget_mb * 1024 * 1024) if args.budget_mb is not None else engine.storage_budget()
+    if not budget:
+        print('No image budget set, use --budget-mb or "image_storage_mb" in settings.json')
+        return 2
+    evicted = engine.enforce_storage_budget(budget)
+    print(f"Evicted {evicted} images, their thumbnails are kept and they come back when opened")
+    return 0
+
+def run_optimize_images(engine, args):
+    summary = engine.migrate_images(args.processes)
+    print(f"Checked {summary['images']} images in {summary['seconds']:.1f}s, converted {summary['converted']} "
+          f"to {summary['format']} (originals {summary['originals']}), "
+          f"saved {summary['saved_bytes'] / 1024 / 1024:.1f} MB")
+    return 0
+
+def run_import(engine, args):
+    # Images are left to the app, or a backfill run, rather than queued and abandoned on exit
+    summary = import_file(engine, args.path, args.format, request_images=False)
+    print(f"Imported {summary['entries']} entries over {summary['days']} days in {summary['seconds']:.1f}s, "
+          f"skipped {summary['duplicates']} already in the journal")
+    if summary["entries"]:
+        print("Run backfill, or open the app, to generate their images")
+    return 0
+
+def run_export(engine, args):
+    engine.store.migrate_from_json(engine.save_dir)  # A journal never opened since journal.db came in
+    summary = export_journal(engine, args.output, args.format, args.start_day, args.end_day,
+                             workers=args.export_workers, resume=not args.restart)
+    print(f"Exported {summary['entries']} entries and {summary['images']} images to {summary['output']} "
+          f"in {summary['seconds']:.1f}s{' (resumed)' if summary['resumed'] else ''}")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch maintenance for a JOURNALGEN journal")
+    parser.add_argument("--dir", default=".", help="journal directory (default: current directory)")
+    parser.add_argument("--workers", type=int, default=None, help="parallel image workers")
+    parser.add_argument("--log-level", default="WARNING", help="DEBUG, INFO, WARNING or ERROR (default: WARNING)")
+    parser.add_argument("--metrics-file", help="write the run's metrics to this JSON file when done")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("stats", help="print journal statistics")
+    commands.add_parser("verify", help="check the database, search index and images")
+
+    backfill = commands.add_parser("backfill", help="generate images for entries that have none")
+    backfill.add_argument("--limit", type=int, default=0, help="stop after this many entries")
+
+    regen = commands.add_parser("regen", help="regenerate the images of a date range")
+    regen.add_argument("--from", dest="start_day", help="first day, YYYY-MM-DD")
+    regen.add_argument("--to", dest="end_day", help="last day, YYYY-MM-DD")
+    regen.add_argument("--style", help="image style to use instead of the saved one")
+    regen.add_argument("--rate", type=float, default=0, help="max image requests per second (default: unlimited)")
+    regen.add_argument("--resume", action="store_true", help="continue an interrupted restyle")
+
+    evict = commands.add_parser("evict", help="evict least recently viewed images over the storage budget")
+    evict.add_argument("--budget-mb", type=float, help="budget to enforce (default: image_storage_mb setting)")
+
+    optimize = commands.add_parser("optimize-images",
+                                   help="convert thumbnails, previews and, with compress_originals, originals "
+                                        "to the image_format setting")
+    optimize.add_argument("--processes", type=int, default=None, help="parallel processes (default: one per CPU)")
+
+    import_ = commands.add_parser("import", help="add the entries of a text, Markdown or JSON Lines diary")
+    import_.add_argument("path", help="file to import")
+    import_.add_argument("--format", choices=IMPORT_FORMATS,
+                         help="text, markdown or jsonl (default: from the file extension)")
+
+    export = commands.add_parser("export", help="export the journal to one archive, JSON Lines file or HTML site")
+    export.add_argument("output", help="file to write, or directory for --format site")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="archive",
+                        help="archive (.tar.gz, default), jsonl or site")
+    export.add_argument("--from", dest="start_day", help="first day, YYYY-MM-DD")
+    export.add_argument("--to", dest="end_day", help="last day, YYYY-MM-DD")
+    export.add_argument("--export-workers", type=int, default=EXPORT_WORKERS, help="parallel image threads")
+    export.add_argument("--restart", action="store_true", help="start over instead of resuming an interrupted export")
+
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+    engine = JournalEngine(args.dir, num_workers=args.workers)
+    try:
+        # Export streams from the database and doesn't need the journal in memory
+        if args.command != "export":
+            engine.load_entries()
+        handlers = {"stats": run_stats, "verify": run_verify, "backfill": run_backfill, "regen": run_regen,
+                    "evict": run_evict, "optimize-images": run_optimize_images, "import": run_import,
+                    "export": run_export}
+        return handlers[args.command](engine, args)
+    finally:
+        engine.close()
+        if args.metrics_file:
+            metrics.write_file(args.metrics_file)
+
+if __name__ == "__main__":
+    sys.exit(main())
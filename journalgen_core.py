@@ -0,0 +1,2236 @@
+# GUI-free core of JOURNALGEN: journal storage, prompt styling, image
+# generation and the retry queue. Used by the Tk app in JOURNALGEN.py and by
+# the batch command line in journalgen_cli.py. Importing this module has no
+# side effects, directories and settings are created by JournalEngine.
+import time
+from PIL import Image, features
+from datetime import datetime
+import os
+import json
+import threading
+import random
+import heapq
+import itertools
+import sqlite3
+import re
+import hashlib
+import contextlib
+from collections import Counter
+
+from journalgen_metrics import log, metrics
+from journalgen_providers import ProviderError, create_provider
+
+# Journal files, relative to the journal's base directory
+JOURNAL_DB = "journal.db"
+SAVE_DIR = "journal_entries"  # Per-day JSON files from before journal.db, migrated once
+IMAGE_DIR = "journal_images"
+THUMB_DIR = "journal_thumbs"
+PREVIEW_DIR = "journal_previews"
+RETRY_QUEUE_FILE = "retry_queue.json"  # Entries with failed image generation
+RESTYLE_CHECKPOINT_FILE = "restyle_checkpoint.json"  # Progress of an unfinished restyle
+SETTINGS_FILE = "settings.json"
+STYLE_SETTINGS_FILE = "style_settings.json"
+
+# Backoff for the persistent retry queue
+RETRY_BASE_DELAY = 60  # seconds, doubled for every failed retry
+RETRY_MAX_DELAY = 6 * 60 * 60
+
+# Image worker pool defaults (overridable with "image_workers" in settings.json)
+DEFAULT_IMAGE_WORKERS = 4
+IMAGE_MAX_RETRIES = 3
+IMAGE_BASE_WAIT_TIME = 5  # seconds, doubled on every failed attempt and jittered
+IMAGE_MAX_WAIT_TIME = 5 * 60
+
+# Restyle pipeline limits
+RESTYLE_MAX_IN_FLIGHT = 8  # images requested but not finished yet
+RESTYLE_RATE = 2.0  # image requests per second
+RESTYLE_CHECKPOINT_INTERVAL = 2.0  # seconds between checkpoint writes
+
+# Journal writes are collected for this many seconds and then written together
+WRITE_BEHIND_DELAY = 0.5
+
+# "fsync" in settings.json: how hard writes are pushed to disk. Maps to SQLite's
+# synchronous setting; "always" also fsyncs the JSON files before renaming them.
+FSYNC_POLICIES = {"always": "FULL", "normal": "NORMAL", "off": "OFF"}
+DEFAULT_FSYNC_POLICY = "normal"
+
+# Seconds between rewrites of the "metrics_file" from settings.json
+METRICS_WRITE_INTERVAL = 30
+
+# Storage budget for full size images, "image_storage_mb" in settings.json (0 for no limit)
+STORAGE_CHECK_INTERVAL = 60  # seconds between budget checks
+STORAGE_TARGET = 0.9         # eviction frees space down to this share of the budget
+
+# Rows read per query when the journal is streamed instead of loaded whole
+STREAM_BATCH_SIZE = 1000
+
+# Months of entries kept in memory around the month on screen, "resident_months"
+# in settings.json. Other months are read from journal.db when needed.
+RESIDENT_MONTHS = 3
+IMPORT_FLUSH_MONTHS = 12  # an import writes and lets go of its months this often
+
+# Image job priorities, lower values are fetched first
+PRIORITY_VISIBLE = 0     # entries of the day currently on screen
+PRIORITY_NORMAL = 1      # new entries and single regenerations
+PRIORITY_BACKGROUND = 2  # bulk restyles and retries
+
+# Image provider, "image_provider" in settings.json picks another one
+DEFAULT_IMAGE_PROVIDER = "pollinations"
+
+# Size requested from the image service, "image_size": "1280x720" in settings.json asks for less
+IMAGE_WIDTH = 1920
+IMAGE_HEIGHT = 1080
+
+# Entry list thumbnails and screen sized previews, made together from each download
+THUMB_SIZE = (150, 84)  # 16:9 aspect ratio
+PREVIEW_SIZE = (960, 540)
+PREVIEW_QUALITY = 88
+THUMB_QUALITY = 85
+
+# Stored image formats: name -> (PIL format, file extension). Thumbnails and
+# previews are written in "image_format" from settings.json. Originals are
+# kept as the image service sent them, unless "compress_originals" re-encodes
+# them in that format too.
+IMAGE_FORMATS = {"webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg")}
+DEFAULT_IMAGE_FORMAT = "webp" if features.check("webp") else "jpeg"
+ORIGINAL_QUALITY = 90
+MIGRATION_RENAME_BATCH = 500  # converted originals renamed in the journal at a time
+
+# The "[02:05PM] " that starts an entry's stored text
+ENTRY_TIME = re.compile(r"\[(0[1-9]|1[0-2]):([0-5]\d)([AP]M)\] (.*)", re.S)
+
+class Entry:
+    # One journal entry. time_of_day is minutes after midnight, or None for
+    # text without a time prefix; the text stored in journal.db is rebuilt
+    # from it and content exactly. Entries are values: changes make a new one
+    # with replace(), so a list handed out never changes under its holder.
+    __slots__ = ("entry_id", "time_of_day", "content", "image_path")
+
+    def __init__(self, entry_id, time_of_day, content, image_path=None):
+        self.entry_id = entry_id
+        self.time_of_day = time_of_day
+        self.content = content
+        self.image_path = image_path
+
+    @classmethod
+    def from_text(cls, entry_id, text, image_path=None):
+        match = ENTRY_TIME.fullmatch(text)
+        if match is None:
+            return cls(entry_id, None, text, image_path)
+        hour = int(match.group(1)) % 12 + (12 if match.group(3) == "PM" else 0)
+        return cls(entry_id, hour * 60 + int(match.group(2)), match.group(4), image_path)
+
+    @classmethod
+    def at(cls, entry_id, moment, content, image_path=None):
+        return cls(entry_id, moment.hour * 60 + moment.minute, content, image_path)
+
+    @property
+    def text(self):
+        if self.time_of_day is None:
+            return self.content
+        hour, minute = divmod(self.time_of_day, 60)
+        return f"[{(hour - 1) % 12 + 1:02d}:{minute:02d}{'PM' if hour >= 12 else 'AM'}] {self.content}"
+
+    @property
+    def has_image(self):
+        return self.image_path is not None
+
+    def replace(self, **changes):
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return Entry(**values)
+
+    def __repr__(self):
+        return f"Entry({self.entry_id!r}, {self.text!r}, {self.image_path!r})"
+
+# Write JSON through a temp file and rename, so readers never see half a file.
+# fsync also forces it to disk before the rename, for the "always" fsync policy.
+def write_json_atomic(path, data, fsync=False):
+    # Each writer has its own temp file, so writers on other threads can't rename it away
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+class ImageStyleManager:
+    def __init__(self, path=STYLE_SETTINGS_FILE):
+        self.path = path
+        self.styles = {
+            "photographic": {"prepend": "", "append": ", photorealistic style"},
+            "anime": {"prepend": "", "append": ", Illustrated_Anime_Style"},
+            "watercolor": {"prepend": "", "append": ", watercolor painting style"},
+            "sketch": {"prepend": "", "append": ", pencil sketch style"}
+        }
+        self.current_style = "photographic"
+        self.user_appearance = ""
+        self.load_settings()
+
+    def set_style(self, style_name):
+        if style_name in self.styles:
+            self.current_style = style_name
+            self.save_settings()
+
+    def set_user_appearance(self, appearance):
+        self.user_appearance = appearance
+        self.save_settings()
+
+    def get_style_string(self, content, style_name=None):
+        style = self.styles.get(style_name) or self.styles[self.current_style]
+        return f"{self.user_appearance} {style['prepend']} {content} {style['append']}".strip()
+
+    def save_settings(self):
+        settings = {
+            "current_style": self.current_style,
+            "user_appearance": self.user_appearance
+        }
+        write_json_atomic(self.path, settings)
+
+    def load_settings(self):
+        try:
+            with open(self.path, "r") as f:
+                settings = json.load(f)
+                self.current_style = settings.get("current_style", "photographic")
+                self.user_appearance = settings.get("user_appearance", "")
+        except FileNotFoundError:
+            # If the file doesn't exist, we'll use the default values
+            pass
+
+class JournalStore:
+    # SQLite storage for journal entries, in WAL mode so reads never wait on
+    # writes. Rows hold each Entry's id, text and image path; position keeps
+    # their order within a day. Every write is a single transaction, so a
+    # crash can't leave a day half written.
+    def __init__(self, path=JOURNAL_DB, synchronous="NORMAL"):
+        self.path = path
+        self.lock = threading.Lock()  # The connection is shared with image workers
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                entry_id TEXT PRIMARY KEY,
+                day TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                image_path TEXT
+            );
+            CREATE INDEX IF NOT EXISTS entries_by_day ON entries (day, position);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS image_files (
+                image_path TEXT PRIMARY KEY,
+                last_viewed REAL,
+                evicted INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        self.add_image_columns()
+        self.conn.commit()
+        self.has_search_index = self.create_search_index()
+
+    def add_image_columns(self):
+        # What each image was generated from, so it can be made again exactly.
+        # Added in place to databases created before these columns existed.
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(entries)")}
+        for name, kind in (("seed", "INTEGER"), ("prompt", "TEXT"),
+                           ("image_width", "INTEGER"), ("image_height", "INTEGER")):
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE entries ADD COLUMN {name} {kind}")
+
+    def create_search_index(self):
+        # FTS5 inverted index over entry text, stored in the same database and
+        # kept in sync by triggers, so every write updates it incrementally
+        try:
+            self.conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+                    text, content='entries', content_rowid='rowid'
+                );
+                CREATE TRIGGER IF NOT EXISTS entries_fts_insert AFTER INSERT ON entries BEGIN
+                    INSERT INTO entries_fts (rowid, text) VALUES (new.rowid, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS entries_fts_delete AFTER DELETE ON entries BEGIN
+                    INSERT INTO entries_fts (entries_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS entries_fts_update AFTER UPDATE OF text ON entries BEGIN
+                    INSERT INTO entries_fts (entries_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                    INSERT INTO entries_fts (rowid, text) VALUES (new.rowid, new.text);
+                END;
+            """)
+        except sqlite3.OperationalError as e:
+            log.warning("Full-text search unavailable, falling back to plain matching: %s", e)
+            return False
+        # INSERT OR REPLACE has to fire the delete trigger for the replaced row
+        self.conn.execute("PRAGMA recursive_triggers=ON")
+        if self.conn.execute("SELECT value FROM meta WHERE key = 'search_index_built'").fetchone() is None:
+            self.rebuild_search_index(locked=True)
+        return True
+
+    def rebuild_search_index(self, locked=False):
+        # Build the index from scratch, only needed once for an existing journal
+        if not locked:
+            self.lock.acquire()
+        try:
+            with self.conn:
+                self.conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('rebuild')")
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('search_index_built', ?)",
+                                  (datetime.now().isoformat(),))
+        finally:
+            if not locked:
+                self.lock.release()
+
+    def search(self, query, start_day=None, end_day=None, limit=200):
+        # Ranked search. Quoted text is matched as a phrase, other words must all
+        # appear. Returns (day, entry_id, text) tuples, best matches first.
+        terms = [phrase or word for phrase, word in re.findall(r'"([^"]+)"|(\S+)', query)]
+        if not terms:
+            return []
+
+        conditions, params = [], []
+        if start_day:
+            conditions.append("e.day >= ?")
+            params.append(start_day)
+        if end_day:
+            conditions.append("e.day <= ?")
+            params.append(end_day)
+
+        if self.has_search_index:
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+            sql = ("SELECT e.day, e.entry_id, e.text FROM entries_fts "
+                   "JOIN entries e ON e.rowid = entries_fts.rowid "
+                   "WHERE entries_fts MATCH ?")
+            params.insert(0, match)
+            order = " ORDER BY bm25(entries_fts), e.day DESC"
+        else:
+            # % and _ in the query are literal characters, not wildcards
+            sql = "SELECT e.day, e.entry_id, e.text FROM entries e WHERE " + \
+                  " AND ".join("e.text LIKE ? ESCAPE '\\'" for _ in terms)
+            params[0:0] = ["%" + re.sub(r"([\\%_])", r"\\\1", term) + "%" for term in terms]
+            order = " ORDER BY e.day DESC"
+        if conditions:
+            sql += " AND " + " AND ".join(conditions)
+        sql += order + " LIMIT ?"
+        params.append(limit)
+
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def load_range(self, start_day=None, end_day=None):
+        # Entries grouped by day for start_day <= day <= end_day, inclusive
+        query = "SELECT day, entry_id, text, image_path FROM entries"
+        conditions, params = [], []
+        if start_day:
+            conditions.append("day >= ?")
+            params.append(start_day)
+        if end_day:
+            conditions.append("day <= ?")
+            params.append(end_day)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY day, position"
+
+        entries = {}
+        with self.lock:
+            for day, entry_id, text, image_path in self.conn.execute(query, params):
+                entries.setdefault(day, []).append(Entry.from_text(entry_id, text, image_path))
+        return entries
+
+    def load_months(self, months):
+        # {day: [Entry]} for the given "YYYY-MM" months
+        entries = {}
+        for month in months:
+            entries.update(self.load_range(f"{month}-01", f"{month}-31"))
+        return entries
+
+    def iter_range(self, start_day=None, end_day=None, batch_size=STREAM_BATCH_SIZE):
+        # Like load_range, but streamed in date order a batch at a time, so the
+        # journal is never in memory at once and writers only wait for one
+        # batch. Yields (day, entry_id, text, image_path, seed, prompt,
+        # image_width, image_height).
+        last = (start_day or "", -1)
+        while True:
+            query = ("SELECT day, position, entry_id, text, image_path, seed, prompt, image_width, image_height "
+                     "FROM entries WHERE (day, position) > (?, ?)")
+            params = list(last)
+            if end_day:
+                query += " AND day <= ?"
+                params.append(end_day)
+            query += " ORDER BY day, position LIMIT ?"
+            params.append(batch_size)
+            with self.lock:
+                rows = self.conn.execute(query, params).fetchall()
+            for row in rows:
+                yield (row[0],) + tuple(row[2:])
+            if len(rows) < batch_size:
+                return
+            last = rows[-1][:2]
+
+    def month_counts(self, start_day=None, end_day=None):
+        # [(YYYY-MM, entries)] in date order
+        query = "SELECT substr(day, 1, 7), COUNT(*) FROM entries WHERE day >= ?"
+        params = [start_day or ""]
+        if end_day:
+            query += " AND day <= ?"
+            params.append(end_day)
+        with self.lock:
+            return self.conn.execute(query + " GROUP BY 1 ORDER BY 1", params).fetchall()
+
+    def load_day(self, day):
+        return self.load_range(day, day).get(day, [])
+
+    def day_counts(self, start_day, end_day):
+        # {day: [entries, entries without an image]} for start_day <= day <= end_day
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT day, COUNT(*), SUM(image_path IS NULL) FROM entries "
+                "WHERE day >= ? AND day <= ? GROUP BY day",
+                (start_day, end_day)
+            ).fetchall()
+        return {day: [count, missing] for day, count, missing in rows}
+
+    def imageless_entries(self, start_day, end_day):
+        # {entry_id: day} of the entries without an image, start_day <= day <= end_day
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT entry_id, day FROM entries WHERE day >= ? AND day <= ? AND image_path IS NULL",
+                (start_day, end_day)
+            ).fetchall())
+
+    def get(self, entry_id):
+        # Returns (day, Entry) or None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT day, entry_id, text, image_path FROM entries WHERE entry_id = ?", (entry_id,)
+            ).fetchone()
+        return (row[0], Entry.from_text(*row[1:])) if row else None
+
+    def has_entry(self, entry_id):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM entries WHERE entry_id = ?", (entry_id,)).fetchone() is not None
+
+    def image_states(self):
+        # (entry_id, day, image_path) of every entry, image_path None if it has none
+        with self.lock:
+            return self.conn.execute("SELECT entry_id, day, image_path FROM entries").fetchall()
+
+    def image_paths(self):
+        # Every image file some entry shows
+        with self.lock:
+            return {row[0] for row in self.conn.execute(
+                "SELECT DISTINCT image_path FROM entries WHERE image_path IS NOT NULL")}
+
+    def summary(self):
+        # (entries, days, first day, last day)
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*), COUNT(DISTINCT day), MIN(day), MAX(day) FROM entries").fetchone()
+
+    def save_day(self, day, day_entries):
+        self.write_batch(days={day: day_entries})
+
+    def set_image(self, entry_id, image_path, info=None):
+        # info is the {prompt, seed, width, height} the image was generated from
+        self.write_batch(images={entry_id: (image_path, info)})
+
+    def write_batch(self, days=None, seeds=None, images=None, views=None):
+        # Any number of whole days ({day: entries}), seeds ({entry_id: seed}),
+        # images ({entry_id: (image_path, info)}) and image views
+        # ({image_path: time}) in one transaction
+        with self.lock, self.conn:
+            if views:
+                self.conn.executemany(
+                    "INSERT INTO image_files (image_path, last_viewed) VALUES (?, ?) "
+                    "ON CONFLICT (image_path) DO UPDATE SET last_viewed = excluded.last_viewed",
+                    views.items()
+                )
+            for day, day_entries in (days or {}).items():
+                self.write_day(day, day_entries)
+            if seeds:
+                self.conn.executemany("UPDATE entries SET seed = ? WHERE entry_id = ?",
+                                      [(seed, entry_id) for entry_id, seed in seeds.items()])
+            for entry_id, (image_path, info) in (images or {}).items():
+                if info is None:
+                    self.conn.execute("UPDATE entries SET image_path = ? WHERE entry_id = ?",
+                                      (image_path, entry_id))
+                else:
+                    self.conn.execute(
+                        "UPDATE entries SET image_path = ?, prompt = ?, seed = ?, image_width = ?, "
+                        "image_height = ? WHERE entry_id = ?",
+                        (image_path, info["prompt"], info["seed"], info["width"], info["height"], entry_id)
+                    )
+
+    # Must be called with the lock held, inside a transaction
+    def write_day(self, day, day_entries):
+        rows = [(entry.entry_id, day, position, entry.text, entry.image_path)
+                for position, entry in enumerate(day_entries)]
+        keep = {entry.entry_id for entry in day_entries}
+        stored = [row[0] for row in self.conn.execute("SELECT entry_id FROM entries WHERE day = ?", (day,))]
+        self.conn.executemany("DELETE FROM entries WHERE entry_id = ?",
+                              [(entry_id,) for entry_id in stored if entry_id not in keep])
+        # Upsert so the seed and prompt of existing entries are kept
+        self.conn.executemany(
+            "INSERT INTO entries (entry_id, day, position, text, image_path) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (entry_id) DO UPDATE SET day = excluded.day, position = excluded.position, "
+            "text = excluded.text, image_path = excluded.image_path",
+            rows
+        )
+
+    def get_seed(self, entry_id):
+        with self.lock:
+            row = self.conn.execute("SELECT seed FROM entries WHERE entry_id = ?", (entry_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_seed(self, entry_id, seed):
+        self.write_batch(seeds={entry_id: seed})
+
+    def image_references(self, image_path):
+        # Number of entries showing this image file, they can share one
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries WHERE image_path = ?",
+                                     (image_path,)).fetchone()[0]
+
+    def image_info(self, image_path):
+        # (entry_id, {prompt, seed, width, height}) of an entry showing this
+        # image, or None if it isn't known what the image was made from
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT entry_id, prompt, seed, image_width, image_height FROM entries "
+                "WHERE image_path = ? AND prompt IS NOT NULL AND seed IS NOT NULL LIMIT 1", (image_path,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], {"prompt": row[1], "seed": row[2], "width": row[3] or IMAGE_WIDTH,
+                        "height": row[4] or IMAGE_HEIGHT}
+
+    def regenerable_images(self):
+        # Image paths whose prompt and seed are saved, so they can be made again
+        with self.lock:
+            return {row[0] for row in self.conn.execute(
+                "SELECT DISTINCT image_path FROM entries "
+                "WHERE image_path IS NOT NULL AND prompt IS NOT NULL AND seed IS NOT NULL")}
+
+    def last_viewed(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT image_path, last_viewed FROM image_files "
+                                          "WHERE last_viewed IS NOT NULL"))
+
+    def evicted_images(self):
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT image_path FROM image_files WHERE evicted")}
+
+    def set_evicted(self, image_paths, evicted=True):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO image_files (image_path, evicted) VALUES (?, ?) "
+                "ON CONFLICT (image_path) DO UPDATE SET evicted = excluded.evicted",
+                [(image_path, int(evicted)) for image_path in image_paths]
+            )
+
+    def entries_with_images(self, image_paths):
+        # entry_ids showing any of these images
+        image_paths = list(image_paths)
+        entry_ids = []
+        with self.lock:
+            for start in range(0, len(image_paths), 500):  # Within SQLite's limit on query parameters
+                chunk = image_paths[start:start + 500]
+                entry_ids += [row[0] for row in self.conn.execute(
+                    f"SELECT entry_id FROM entries WHERE image_path IN ({','.join('?' * len(chunk))})", chunk)]
+        return entry_ids
+
+    def rename_image_files(self, renamed):
+        # Carry view times and eviction marks over to the new paths
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE OR REPLACE image_files SET image_path = ? WHERE image_path = ?",
+                                  [(new_path, old_path) for old_path, new_path in renamed.items()])
+
+    def migrate_from_json(self, save_dir=SAVE_DIR):
+        # One-time import of the old journal_entries/<day>.json files. The files
+        # are left in place as a backup.
+        if self.get_meta("json_migrated") or not os.path.isdir(save_dir):
+            return 0
+
+        rows = []
+        seen_ids = set()
+        for filename in sorted(os.listdir(save_dir)):
+            if not filename.endswith('.json'):
+                continue
+            day = filename[:-5]  # Remove '.json' from the filename
+            try:
+                with open(os.path.join(save_dir, filename), "r") as f:
+                    day_entries = json.load(f)
+            except json.JSONDecodeError:
+                log.error("Error migrating journal entries for %s. File may be corrupted.", day)
+                continue
+            for position, (entry_id, text, image_path) in enumerate(day_entries):
+                # Ids were per-second timestamps, keep both entries if two collided
+                unique_id = entry_id
+                suffix = 1
+                while unique_id in seen_ids:
+                    unique_id = f"{entry_id}_{suffix}"
+                    suffix += 1
+                if unique_id != entry_id:
+                    log.warning("Duplicate entry id %s on %s, migrated as %s", entry_id, day, unique_id)
+                seen_ids.add(unique_id)
+                rows.append((unique_id, day, position, text, image_path))
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entries (entry_id, day, position, text, image_path) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                              (datetime.now().isoformat(),))
+        log.info("Migrated %d entries from %s to %s", len(rows), save_dir, self.path)
+        return len(rows)
+
+    def check_integrity(self):
+        problems = []
+        with self.lock:
+            result = self.conn.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != "ok":
+                problems.append(f"Database integrity check failed: {result}")
+            if self.has_search_index:
+                try:
+                    self.conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('integrity-check')")
+                except sqlite3.DatabaseError as e:
+                    problems.append(f"Search index is out of date, rebuild it: {str(e)}")
+            for day, position, count in self.conn.execute(
+                "SELECT day, position, COUNT(*) FROM entries GROUP BY day, position HAVING COUNT(*) > 1"
+            ):
+                problems.append(f"{count} entries share position {position} on {day}")
+        return problems
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# Cheap check that a downloaded file is a whole image: reads the header and,
+# for JPEGs, the end of image marker, without decoding any pixels
+def check_image_file(path):
+    with Image.open(path) as image:
+        if image.format not in ("JPEG", "PNG", "WEBP") or not image.width or not image.height:
+            raise ValueError(f"Unexpected image format {image.format} {image.size}")
+        if image.format == "JPEG":
+            with open(path, "rb") as f:
+                f.seek(-2, os.SEEK_END)
+                if f.read(2) != b"\xff\xd9":
+                    raise ValueError("JPEG data is truncated")
+
+def save_image(image, path, image_format, quality):
+    # WebP, or progressive optimized JPEG, written under a temp name and
+    # renamed so readers never see half a file
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    if pil_format == "WEBP":
+        image.save(temp_path, "WEBP", quality=quality, method=4)
+    else:
+        image.save(temp_path, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(temp_path, path)
+
+def parse_image_size(value):
+    # "1280x720" -> (1280, 720), None for anything else
+    match = re.fullmatch(r"\s*(\d+)\s*[xX]\s*(\d+)\s*", str(value))
+    if match is None or not all(16 <= int(side) <= 4096 for side in match.groups()):
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+class ThumbnailCache:
+    # Small thumbnails for the entry list and screen sized previews for the
+    # image viewer. They are written to THUMB_DIR and PREVIEW_DIR next to the
+    # image they came from and count as valid while they are not older than
+    # the image. The Tk app layers an in-memory PhotoImage LRU on top.
+    def __init__(self, thumb_dir=THUMB_DIR, preview_dir=PREVIEW_DIR, image_format=DEFAULT_IMAGE_FORMAT):
+        self.thumb_dir = thumb_dir
+        self.preview_dir = preview_dir
+        self.image_format = image_format
+        self.extension = IMAGE_FORMATS[image_format][1]
+
+    def variant_path(self, folder, image_path, extension=None):
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(folder, name + (extension or self.extension))
+
+    def all_variant_paths(self, folder, image_path):
+        # The current format first, then the ones variants were made in before
+        extensions = [self.extension] + [ext for _, ext in IMAGE_FORMATS.values() if ext != self.extension]
+        return [self.variant_path(folder, image_path, ext) for ext in extensions]
+
+    def thumb_path(self, image_path):
+        return self.variant_path(self.thumb_dir, image_path)
+
+    def preview_path(self, image_path):
+        return self.variant_path(self.preview_dir, image_path)
+
+    def has_thumbnail(self, image_path):
+        return any(os.path.exists(path) for path in self.all_variant_paths(self.thumb_dir, image_path))
+
+    # Safe to call from worker threads. Both sizes come from one decode at a
+    # reduced JPEG scale, so the full resolution image is never in memory.
+    # source is read instead of image_path when given (a download not yet
+    # renamed into place).
+    def save_variants(self, image_path, source=None):
+        with Image.open(source or image_path) as image:
+            image.draft("RGB", PREVIEW_SIZE)
+            preview = image.convert("RGB")
+        preview.thumbnail(PREVIEW_SIZE)
+        save_image(preview, self.preview_path(image_path), self.image_format, PREVIEW_QUALITY)
+        preview.thumbnail(THUMB_SIZE)
+        save_image(preview, self.thumb_path(image_path), self.image_format, THUMB_QUALITY)
+
+    def fresh_variant(self, folder, image_path):
+        # Path of an up to date variant of image_path, both sizes are remade if needed
+        variant_path = self.variant_path(folder, image_path)
+        try:
+            fresh = os.stat(variant_path).st_mtime >= os.stat(image_path).st_mtime
+        except FileNotFoundError:
+            if not os.path.exists(image_path):
+                # An evicted original leaves its thumbnail behind, which is then
+                # all there is, possibly in the format used before
+                for path in self.all_variant_paths(folder, image_path):
+                    if os.path.exists(path):
+                        return path
+            fresh = False
+        if not fresh:
+            self.save_variants(image_path)
+        return variant_path
+
+    def get_thumbnail(self, image_path):
+        return self.fresh_variant(self.thumb_dir, image_path)
+
+    def get_preview(self, image_path):
+        return self.fresh_variant(self.preview_dir, image_path)
+
+    def discard(self, image_path):
+        for folder in (self.thumb_dir, self.preview_dir):
+            for path in self.all_variant_paths(folder, image_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def discard_preview(self, image_path):
+        # The thumbnail stays, for an original evicted to save space
+        for path in self.all_variant_paths(self.preview_dir, image_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+# Runs in a worker process of JournalEngine.migrate_images: brings one image's
+# files to the current formats. task is (image_path, thumb_dir, preview_dir,
+# image_format, original_format or None). Returns (image_path, new image path,
+# bytes before, bytes after), the old original is left for the caller to remove.
+def convert_image(task):
+    image_path, thumb_dir, preview_dir, image_format, original_format = task
+    cache = ThumbnailCache(thumb_dir, preview_dir, image_format)
+    variants = cache.all_variant_paths(thumb_dir, image_path) + cache.all_variant_paths(preview_dir, image_path)
+    current = {cache.thumb_path(image_path), cache.preview_path(image_path)}
+
+    def sizes(paths):
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    new_path = image_path
+    if original_format and os.path.exists(image_path):
+        new_path = os.path.splitext(image_path)[0] + IMAGE_FORMATS[original_format][1]
+    before = sizes(variants + [image_path])
+    up_to_date = new_path == image_path and all(os.path.exists(path) == (path in current) for path in variants)
+    if up_to_date:
+        return image_path, new_path, before, before
+
+    if os.path.exists(image_path):
+        if new_path != image_path:
+            with Image.open(image_path) as image:
+                save_image(image.convert("RGB"), new_path, original_format, ORIGINAL_QUALITY)
+        cache.save_variants(new_path)
+    else:
+        # Evicted, only the thumbnail is left to convert
+        thumb = next((path for path in cache.all_variant_paths(thumb_dir, image_path) if os.path.exists(path)), None)
+        if thumb is not None and thumb != cache.thumb_path(image_path):
+            with Image.open(thumb) as image:
+                save_image(image.convert("RGB"), cache.thumb_path(image_path), image_format, THUMB_QUALITY)
+    for path in variants:
+        if path not in current and os.path.exists(path):
+            os.remove(path)
+    after = sizes(list(current) + [new_path])
+    return image_path, new_path, before, after
+
+# Images are stored under a hash of everything that determines them
+def image_key(prompt, seed, width, height):
+    return hashlib.sha256(f"{prompt}\0{seed}\0{width}\0{height}".encode("utf-8")).hexdigest()[:32]
+
+def new_seed():
+    return random.randint(0, 999999)
+
+def content_seed(content):
+    # Seed for an entry that has none yet, stable for the same text
+    return int(hashlib.sha256(content.encode("utf-8")).hexdigest(), 16) % 1000000
+
+class ImageGenerator:
+    # Fixed pool of worker threads fetching images from an image provider,
+    # which paces the requests (see journalgen_providers).
+    # Images are content addressed: a job is keyed by the hash of (styled
+    # prompt, seed, width, height) and saved as <key>.jpg (or in original_format,
+    # see "compress_originals"), so a key that is already on disk in any format
+    # costs no request at all and concurrent requests for the
+    # same key collapse into one fetch whose result goes to every waiter.
+    # Jobs wait in a priority heap and can be promoted when their day is
+    # brought on screen. Failed attempts are parked in a delayed heap instead
+    # of sleeping, which keeps the workers free during the backoff.
+    def __init__(self, style_manager, image_dir=IMAGE_DIR, num_workers=DEFAULT_IMAGE_WORKERS, on_failure=None,
+                 thumbnail_cache=None, provider=None, image_size=(IMAGE_WIDTH, IMAGE_HEIGHT), original_format=None):
+        self.style_manager = style_manager
+        self.image_dir = image_dir
+        self.image_size = image_size  # (width, height) asked for with new images
+        self.original_format = original_format  # re-encode downloads in this format, None keeps them as they are
+        self.thumbnail_cache = thumbnail_cache
+        self.on_failure = on_failure  # called with (entry_id, content) once all retries are used up
+        self.provider = provider or create_provider(DEFAULT_IMAGE_PROVIDER, max_concurrency=max(1, int(num_workers)))
+        # Every worker blocks in its request, so there are at least as many as
+        # the provider may keep in flight, or its limit could never be reached
+        self.num_workers = max(1, int(num_workers), int(self.provider.concurrency.max_limit))
+
+        self.condition = threading.Condition()
+        self.ready = []       # heap of (priority, seq, key)
+        self.delayed = []     # heap of (ready_at, seq, key)
+        self.jobs = {}        # key -> job dict, queued or running
+        self.entry_jobs = {}  # entry_id -> key of the job it is waiting on
+        self.seq = itertools.count()
+
+        self.workers = []
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self.worker_loop, name=f"image-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    # style pins the job to an image style, otherwise the current style is used.
+    # The callback gets (entry_id, image_path, info) with the prompt, seed and
+    # size the image was made from. Returns that info right away. Passing info
+    # makes exactly that image again, whatever the style is now.
+    # on_failure, if given, is called for this waiter instead of the generator's own
+    def submit(self, entry_id, content, callback, priority=PRIORITY_NORMAL, style=None, seed=None, info=None,
+               on_failure=None):
+        if info is None:
+            prompt = self.style_manager.get_style_string(content, style)
+            info = {"prompt": prompt, "seed": new_seed() if seed is None else seed,
+                    "width": self.image_size[0], "height": self.image_size[1]}
+        key = image_key(info["prompt"], info["seed"], info["width"], info["height"])
+        with self.condition:
+            self.entry_jobs[entry_id] = key  # Any older job of this entry no longer reports to it
+            job = self.jobs.get(key)
+            if job is None:
+                job = {"key": key, "info": info, "waiters": {}, "priority": priority,
+                       "attempt": 0, "running": False, "delayed": False}
+                self.jobs[key] = job
+                self.push_ready(job)
+            elif priority < job["priority"]:
+                job["priority"] = priority
+                if not job["running"] and not job["delayed"]:  # A backing off job picks up the new priority when due
+                    self.push_ready(job)
+            job["waiters"][entry_id] = (content, callback, on_failure)
+            self.condition.notify()
+        return info
+
+    def promote(self, entry_ids, priority=PRIORITY_VISIBLE):
+        # Move already queued entries ahead of background work
+        with self.condition:
+            for entry_id in entry_ids:
+                job = self.jobs.get(self.entry_jobs.get(entry_id))
+                if job and not job["running"] and priority < job["priority"]:
+                    job["priority"] = priority
+                    if not job["delayed"]:
+                        self.push_ready(job)
+            self.condition.notify_all()
+
+    def is_pending(self, entry_id):
+        with self.condition:
+            return entry_id in self.entry_jobs
+
+    def is_key_pending(self, key):
+        with self.condition:
+            return key in self.jobs
+
+    def queue_size(self):
+        with self.condition:
+            return len(self.jobs)
+
+    # Must be called with the condition held. Re-pushing gives the job a new
+    # seq, older heap items for the same job are skipped as stale.
+    def push_ready(self, job):
+        job["seq"] = next(self.seq)
+        heapq.heappush(self.ready, (job["priority"], job["seq"], job["key"]))
+
+    def next_job(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                while self.delayed and self.delayed[0][0] <= now:
+                    _, seq, key = heapq.heappop(self.delayed)
+                    job = self.jobs.get(key)
+                    if job and job["seq"] == seq:
+                        job["delayed"] = False
+                        heapq.heappush(self.ready, (job["priority"], seq, key))
+
+                while self.ready:
+                    _, seq, key = heapq.heappop(self.ready)
+                    job = self.jobs.get(key)
+                    if job and job["seq"] == seq and not job["running"]:
+                        job["running"] = True
+                        return job
+
+                timeout = self.delayed[0][0] - now if self.delayed else None
+                self.condition.wait(timeout)
+
+    def worker_loop(self):
+        while True:
+            job = self.next_job()
+            try:
+                image_path = self.fetch_image(job)
+            except Exception:
+                # Never let one bad job take a pool worker down with it
+                log.exception("Unexpected error generating image %s", job["key"])
+                image_path = None
+            self.finish_job(job, image_path)
+
+    def finish_job(self, job, image_path):
+        key = job["key"]
+        with self.condition:
+            job["running"] = False
+            # Entries that were re-requested with another key since don't hear about this one
+            waiters = {entry_id: waiter for entry_id, waiter in job["waiters"].items()
+                       if self.entry_jobs.get(entry_id) == key}
+            if image_path is None and waiters and job["attempt"] < IMAGE_MAX_RETRIES - 1:
+                # As long as the provider asked for, otherwise exponential backoff with
+                # jitter so failed jobs don't all come back at once
+                wait_time = job.pop("retry_after", None)
+                if wait_time is None:
+                    wait_time = random.uniform(0.5, 1.0) * min(IMAGE_MAX_WAIT_TIME,
+                                                               IMAGE_BASE_WAIT_TIME * 2 ** job["attempt"])
+                log.debug("Retrying image %s in %.1f seconds", key, wait_time)
+                metrics.increment("image_fetch_retries")
+                job["waiters"] = waiters
+                job["attempt"] += 1
+                job["delayed"] = True
+                job["seq"] = next(self.seq)
+                heapq.heappush(self.delayed, (time.monotonic() + wait_time, job["seq"], key))
+                self.condition.notify()
+                return
+            del self.jobs[key]
+            for entry_id in waiters:
+                del self.entry_jobs[entry_id]
+
+        for entry_id, (content, callback, on_failure) in waiters.items():
+            # A failing listener must neither take the worker down nor keep the other waiters from hearing
+            try:
+                if image_path is not None:
+                    callback(entry_id, image_path, job["info"])
+                else:
+                    log.warning("Failed to generate image for entry %s after %d attempts", entry_id, IMAGE_MAX_RETRIES)
+                    metrics.increment("image_failures")
+                    on_failure = on_failure or self.on_failure
+                    if on_failure:
+                        on_failure(entry_id, content)
+            except Exception:
+                log.exception("Image callback for entry %s failed", entry_id)
+
+    def fetch_image(self, job):
+        key = job["key"]
+        info = job["info"]
+        attempt = job["attempt"]
+        image_path = self.cached_image(key)
+        if image_path is not None:
+            log.debug("Image %s is already cached", key)
+            metrics.increment("image_cache_hits")
+            return image_path
+        extension = IMAGE_FORMATS[self.original_format][1] if self.original_format else ".jpg"
+        image_path = os.path.join(self.image_dir, key + extension)
+
+        # The provider writes to a temp file, which is renamed into place once
+        # checked so a crash never leaves a half written image behind
+        temp_path = f"{image_path}.part"
+        started = time.perf_counter()
+        try:
+            log.debug("Generating image %s (attempt %d/%d)", key, attempt + 1, IMAGE_MAX_RETRIES)
+            written = self.provider.request(info["prompt"], info["seed"], info["width"], info["height"], temp_path)
+            check_image_file(temp_path)
+            if self.original_format:
+                with Image.open(temp_path) as image:
+                    image = image.convert("RGB")
+                save_image(image, temp_path, self.original_format, ORIGINAL_QUALITY)
+            if self.thumbnail_cache:
+                self.thumbnail_cache.save_variants(image_path, temp_path)
+            os.replace(temp_path, image_path)
+            log.debug("Image %s saved to %s with seed %s", key, image_path, info["seed"])
+            metrics.observe("image_fetch_seconds", time.perf_counter() - started)
+            metrics.increment("images_fetched")
+            metrics.increment("image_bytes_fetched", written)
+            return image_path
+
+        except (ProviderError, OSError, ValueError) as e:
+            if isinstance(e, ProviderError) and e.throttled and e.retry_after is not None:
+                job["retry_after"] = e.retry_after
+            log.warning("Error generating image %s (attempt %d/%d): %s", key, attempt + 1, IMAGE_MAX_RETRIES, e)
+            metrics.increment("image_fetch_errors")
+            return None
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def cached_image(self, key):
+        # The image saved under this key, in the original format first
+        extensions = [IMAGE_FORMATS[self.original_format][1]] if self.original_format else []
+        for extension in extensions + [".jpg", ".webp"]:
+            image_path = os.path.join(self.image_dir, key + extension)
+            if os.path.exists(image_path):
+                return image_path
+        return None
+
+class RetryStore:
+    # Persistent retry schedule for entries whose image generation failed.
+    # Every entry keeps its attempt count and next attempt time (wall clock, so
+    # it survives restarts). A min-heap orders the due times and the items dict
+    # doubles as the dedupe set; the worker sleeps on a condition variable until
+    # the earliest retry is due or something new is scheduled.
+    def __init__(self, path=RETRY_QUEUE_FILE, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.condition = threading.Condition()
+        self.items = {}  # entry_id -> {"text", "attempts", "next_attempt"}
+        self.heap = []   # (next_attempt, entry_id), stale items are skipped
+        self.on_dirty = None  # With a journal writer, saves are left to it
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError:
+            log.error("Error loading retry queue from %s. File may be corrupted.", self.path)
+            return
+        now = time.time()
+        for entry_id, item in items.items():
+            # Anything that was in flight when the app closed is due again right away
+            if item.get("next_attempt") is None:
+                item["next_attempt"] = now
+            self.items[entry_id] = item
+            heapq.heappush(self.heap, (item["next_attempt"], entry_id))
+        log.info("Loaded %d entries from the retry queue", len(self.items))
+
+    # Must be called with the condition held
+    def save(self):
+        if self.on_dirty is None:
+            write_json_atomic(self.path, self.items, self.fsync)
+        else:
+            self.dirty = True
+            self.on_dirty()
+
+    def write(self):
+        # Write a deferred save, called by the journal writer
+        with self.condition:
+            if self.dirty:
+                self.dirty = False
+                write_json_atomic(self.path, self.items, self.fsync)
+
+    # Must be called with the condition held
+    def schedule(self, entry_id, entry_text, delay):
+        item = self.items.get(entry_id)
+        if item is None:
+            item = {"text": entry_text, "attempts": 0}
+            self.items[entry_id] = item
+        else:
+            item["text"] = entry_text
+        item["next_attempt"] = time.time() + delay
+        heapq.heappush(self.heap, (item["next_attempt"], entry_id))
+
+    def add(self, entry_id, entry_text):
+        return self.add_many([(entry_id, entry_text)]) == 1
+
+    def add_many(self, items):
+        added = 0
+        with self.condition:
+            for entry_id, entry_text in items:
+                if entry_id not in self.items:
+                    self.schedule(entry_id, entry_text, 0)
+                    added += 1
+            if added:
+                self.save()
+                self.condition.notify()
+        return added
+
+    def reschedule(self, entry_id, entry_text):
+        # Back off exponentially after another failed attempt
+        with self.condition:
+            attempts = self.items[entry_id]["attempts"] + 1 if entry_id in self.items else 0
+            delay = min(RETRY_BASE_DELAY * (2 ** attempts), RETRY_MAX_DELAY)
+            self.schedule(entry_id, entry_text, delay)
+            self.items[entry_id]["attempts"] = attempts
+            self.save()
+            self.condition.notify()
+        return delay
+
+    def remove(self, entry_id):
+        with self.condition:
+            if self.items.pop(entry_id, None) is not None:
+                self.save()
+
+    def __contains__(self, entry_id):
+        with self.condition:
+            return entry_id in self.items
+
+    def __len__(self):
+        with self.condition:
+            return len(self.items)
+
+    def next_due(self):
+        # Block until a retry is due and hand it out. The item stays in the
+        # store (marked in flight) until it is removed or rescheduled.
+        with self.condition:
+            while True:
+                while self.heap:
+                    next_attempt, entry_id = self.heap[0]
+                    item = self.items.get(entry_id)
+                    if item is None or item["next_attempt"] != next_attempt:
+                        heapq.heappop(self.heap)  # Stale heap item
+                        continue
+                    break
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                wait_time = next_attempt - time.time()
+                if wait_time > 0:
+                    self.condition.wait(wait_time)
+                    continue
+                heapq.heappop(self.heap)
+                item["next_attempt"] = None
+                return entry_id, item["text"]
+
+class JournalWriter:
+    # Write-behind for the journal. Changes mark days dirty and queue seed and
+    # image updates; a background thread waits WRITE_BEHIND_DELAY for more to
+    # arrive and then writes everything pending in a single transaction, so a
+    # burst of finished images costs one write instead of one per image.
+    # Days are read back through snapshot_day at write time, which always
+    # writes their latest state. flush() writes right away.
+    def __init__(self, store, snapshot_day, retry_store=None, on_written=None, delay=WRITE_BEHIND_DELAY):
+        self.store = store
+        self.snapshot_day = snapshot_day  # day -> list of Entry, None if the day isn't in memory
+        self.retry_store = retry_store
+        self.on_written = on_written  # called with image paths entries stopped using
+        self.delay = delay
+
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()  # One write at a time, in order
+        self.days = set()
+        self.seeds = {}     # entry_id -> seed
+        self.images = {}    # entry_id -> (image_path, info)
+        self.views = {}     # image_path -> time it was last looked at
+        self.released = set()  # image paths that may no longer be used
+        self.retry_store_dirty = False
+        self.dirty_since = None
+        self.closed = False
+
+        if retry_store is not None:
+            retry_store.on_dirty = self.mark_retry_store
+        self.thread = threading.Thread(target=self.run, name="journal-writer", daemon=True)
+        self.thread.start()
+
+    # Must be called with the condition held
+    def touch(self):
+        if self.dirty_since is None:
+            self.dirty_since = time.monotonic()
+            self.condition.notify()
+
+    def mark_day(self, day):
+        with self.condition:
+            self.days.add(day)
+            self.touch()
+
+    def set_seed(self, entry_id, seed):
+        with self.condition:
+            self.seeds[entry_id] = seed
+            self.touch()
+
+    def pending_seed(self, entry_id):
+        with self.condition:
+            return self.seeds.get(entry_id)
+
+    def set_image(self, entry_id, image_path, info=None):
+        with self.condition:
+            self.images[entry_id] = (image_path, info)
+            self.touch()
+
+    def mark_viewed(self, image_path, when):
+        with self.condition:
+            self.views[image_path] = when
+            self.touch()
+
+    def release_image(self, image_path):
+        if image_path:
+            with self.condition:
+                self.released.add(image_path)
+                self.touch()
+
+    def pending_image_paths(self):
+        with self.condition:
+            return {image_path for image_path, _ in self.images.values()}
+
+    def pending_images(self):
+        # entry_id -> image_path not written yet
+        with self.condition:
+            return {entry_id: image_path for entry_id, (image_path, _) in self.images.items()}
+
+    def pending_days(self):
+        with self.condition:
+            return set(self.days)
+
+    def mark_retry_store(self):
+        with self.condition:
+            self.retry_store_dirty = True
+            self.touch()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.dirty_since is None and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                wait_time = self.dirty_since + self.delay - time.monotonic()
+                if wait_time > 0:
+                    self.condition.wait(wait_time)  # Let more changes pile up
+                    continue
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            self.write_pending()
+
+    # Must be called with flush_lock held
+    def write_pending(self):
+        with self.condition:
+            days, self.days = self.days, set()
+            seeds, self.seeds = self.seeds, {}
+            images, self.images = self.images, {}
+            views, self.views = self.views, {}
+            released, self.released = self.released, set()
+            retry_store_dirty, self.retry_store_dirty = self.retry_store_dirty, False
+            self.dirty_since = None
+        if not (days or seeds or images or views or released or retry_store_dirty):
+            return
+
+        snapshots = {}
+        for day in days:
+            day_entries = self.snapshot_day(day)
+            if day_entries is None:
+                # Months with pending days stay in memory, so this is a bug, but
+                # writing nothing beats writing the day as empty
+                log.error("Day %s was let go of before it was written", day)
+                continue
+            snapshots[day] = day_entries
+        try:
+            with metrics.timer("journal_write_seconds"):
+                self.store.write_batch(snapshots, seeds, images, views)
+        except sqlite3.Error:
+            # Keep the changes for the next attempt, newer ones win
+            log.exception("Could not write %d days to the journal, will retry", len(days))
+            with self.condition:
+                self.days |= days
+                self.seeds = {**seeds, **self.seeds}
+                self.images = {**images, **self.images}
+                self.views = {**views, **self.views}
+                self.released |= released
+                self.retry_store_dirty |= retry_store_dirty
+                self.touch()
+            return
+        metrics.increment("journal_writes")
+        metrics.increment("journal_days_written", len(days))
+        metrics.increment("journal_images_written", len(images))
+
+        if retry_store_dirty and self.retry_store is not None:
+            try:
+                self.retry_store.write()
+            except OSError as e:
+                log.error("Could not save the retry queue: %s", e)
+        if released and self.on_written:
+            self.on_written(released)
+
+    def close(self):
+        # Stop the background thread and write whatever is left
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+
+class RestyleJob:
+    # Regenerates the images of a date range in one style. Entries are streamed
+    # in date order through a bounded window of in-flight requests and a rate
+    # limit, so a journal of any size costs the same memory and never floods
+    # the image service. Progress is checkpointed to disk: the checkpoint keeps
+    # the number of entries (in stream order) that are all finished, so an
+    # interrupted job resumes right after them. Entries count as finished
+    # through the engine's image and failure listeners, so an entry requested
+    # again while the job runs (a retry, Regen, an edit) still finishes it.
+    def __init__(self, engine, start_day=None, end_day=None, style=None, position=0,
+                 max_in_flight=RESTYLE_MAX_IN_FLIGHT, rate=RESTYLE_RATE):
+        self.engine = engine
+        self.start_day = start_day
+        self.end_day = end_day
+        self.style = style or engine.style_manager.current_style
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+
+        engine.flush()
+        self.total = sum(count for _, count in engine.store.month_counts(start_day, end_day))
+        self.position = position  # Entries before this one (in stream order) are finished
+        self.done = 0
+        self.failed = 0
+        self.finished_positions = set()  # Finished entries past self.position
+        self.in_flight = {}  # entry_id -> stream position
+
+        self.lock = threading.Lock()
+        # Held from deciding to write a checkpoint until it's written, so image
+        # workers write them one at a time and none lands after clear_checkpoint
+        self.checkpoint_lock = threading.RLock()
+        self.slots = threading.Semaphore(max_in_flight)
+        self.running = threading.Event()  # Cleared while paused
+        self.running.set()
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.started_at = None
+        self.last_checkpoint = 0
+        self.thread = None
+
+    @classmethod
+    def resume(cls, engine, max_in_flight=RESTYLE_MAX_IN_FLIGHT, rate=RESTYLE_RATE):
+        # Rebuild an interrupted job from its checkpoint, or None if there isn't one
+        try:
+            with open(engine.restyle_checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return cls(engine, checkpoint.get("start_day"), checkpoint.get("end_day"),
+                   checkpoint.get("style"), checkpoint.get("position", 0), max_in_flight, rate)
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.engine.image_listeners.append(self.on_image)
+        self.engine.failure_listeners.append(self.on_failure)
+        self.save_checkpoint()
+        self.thread = threading.Thread(target=self.run, name="restyle", daemon=True)
+        self.thread.start()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume_run(self):
+        self.running.set()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.running.set()  # Wake the feeder so it can stop
+
+    def is_paused(self):
+        return not self.running.is_set()
+
+    def run(self):
+        interval = 1.0 / self.rate if self.rate else 0
+        next_request = time.monotonic()
+        for position, (day, entry) in enumerate(self.engine.iter_entries(self.start_day, self.end_day)):
+            if position < self.position:
+                continue  # Finished before the checkpoint
+            self.running.wait()
+            while not self.cancelled.is_set() and not self.slots.acquire(timeout=0.5):
+                self.release_lost()
+            if self.cancelled.is_set():
+                break
+
+            wait_time = next_request - time.monotonic()
+            if wait_time > 0:
+                time.sleep(wait_time)
+            next_request = max(next_request, time.monotonic()) + interval
+
+            with self.lock:
+                self.in_flight[entry.entry_id] = position
+            # The entry's own seed is kept, only the style changes
+            self.engine.request_image(entry.entry_id, entry.content, PRIORITY_BACKGROUND, style=self.style)
+
+        # Wait for the last requests, unless the job was cancelled
+        while not self.cancelled.is_set():
+            with self.lock:
+                if not self.in_flight:
+                    break
+            time.sleep(0.2)
+            self.release_lost()
+
+        # The checkpoint only outlives the job if the process dies mid-run
+        self.engine.image_listeners.remove(self.on_image)
+        self.engine.failure_listeners.remove(self.on_failure)
+        self.clear_checkpoint()
+        self.finished.set()
+        log.info("Restyle %s: %d images regenerated, %d failed",
+                 "cancelled" if self.cancelled.is_set() else "finished", self.done, self.failed)
+
+    def on_image(self, entry_id, day, old_image_path, image_path):
+        self.mark_finished(entry_id, failed=False)
+
+    def on_failure(self, entry_id, content):
+        self.mark_finished(entry_id, failed=True)
+
+    def release_lost(self):
+        # Entries deleted while their image was on its way never report back
+        with self.lock:
+            entry_ids = list(self.in_flight)
+        for entry_id in entry_ids:
+            if not self.engine.image_generator.is_pending(entry_id) and self.engine.get_entry(entry_id) is None:
+                self.mark_finished(entry_id, failed=None)
+
+    def mark_finished(self, entry_id, failed):
+        # failed is None for an entry that is gone, it counts as neither
+        with self.checkpoint_lock:
+            with self.lock:
+                position = self.in_flight.pop(entry_id, None)
+                if position is None:
+                    return
+                if failed:
+                    self.failed += 1  # Already in the retry queue, counts as handled
+                elif failed is not None:
+                    self.done += 1
+                self.finished_positions.add(position)
+                while self.position in self.finished_positions:
+                    self.finished_positions.discard(self.position)
+                    self.position += 1
+                save = time.monotonic() - self.last_checkpoint >= RESTYLE_CHECKPOINT_INTERVAL
+            if save:
+                self.save_checkpoint()
+        self.slots.release()
+
+    def save_checkpoint(self):
+        with self.checkpoint_lock:
+            with self.lock:
+                self.last_checkpoint = time.monotonic()
+                checkpoint = {"start_day": self.start_day, "end_day": self.end_day,
+                              "style": self.style, "position": self.position, "total": self.total}
+            write_json_atomic(self.engine.restyle_checkpoint_path, checkpoint, self.engine.fsync)
+
+    def clear_checkpoint(self):
+        with self.checkpoint_lock:
+            if os.path.exists(self.engine.restyle_checkpoint_path):
+                os.remove(self.engine.restyle_checkpoint_path)
+
+    def progress(self):
+        # (finished, total, seconds left or None) for progress displays
+        with self.lock:
+            finished = self.position + len(self.finished_positions)
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        handled_now = self.done + self.failed
+        rate = handled_now / elapsed if elapsed and handled_now else 0
+        eta = (self.total - finished) / rate if rate else None
+        return finished, self.total, eta
+
+class JournalEngine:
+    # Everything JOURNALGEN does besides drawing: the journal and its in-memory
+    # view, the entry index, missing image tracking, image generation and the
+    # retry queue. Listeners are called from image worker threads.
+    def __init__(self, base_dir=".", num_workers=None, thumbnail_cache_class=ThumbnailCache, provider=None):
+        self.base_dir = base_dir
+        self.save_dir = os.path.join(base_dir, SAVE_DIR)
+        self.image_dir = os.path.join(base_dir, IMAGE_DIR)
+        self.thumb_dir = os.path.join(base_dir, THUMB_DIR)
+        self.preview_dir = os.path.join(base_dir, PREVIEW_DIR)
+        self.settings_path = os.path.join(base_dir, SETTINGS_FILE)
+        self.restyle_checkpoint_path = os.path.join(base_dir, RESTYLE_CHECKPOINT_FILE)
+        self.ensure_dirs()
+        self.settings = self.load_settings()
+        fsync_policy = self.settings.get("fsync", DEFAULT_FSYNC_POLICY)
+        if fsync_policy not in FSYNC_POLICIES:
+            log.warning("Unknown fsync policy %s, using %s", fsync_policy, DEFAULT_FSYNC_POLICY)
+            fsync_policy = DEFAULT_FSYNC_POLICY
+        self.fsync = fsync_policy == "always"
+
+        self.style_manager = ImageStyleManager(os.path.join(base_dir, STYLE_SETTINGS_FILE))
+        self.store = JournalStore(os.path.join(base_dir, JOURNAL_DB), FSYNC_POLICIES[fsync_policy])
+        self.retry_store = RetryStore(os.path.join(base_dir, RETRY_QUEUE_FILE), self.fsync)
+        self.image_format = self.settings.get("image_format", DEFAULT_IMAGE_FORMAT)
+        if self.image_format not in IMAGE_FORMATS or (self.image_format == "webp" and not features.check("webp")):
+            log.warning("Image format %s is not available, using jpeg", self.image_format)
+            self.image_format = "jpeg"
+        self.original_format = self.image_format if self.settings.get("compress_originals") else None
+        image_size = parse_image_size(self.settings.get("image_size", f"{IMAGE_WIDTH}x{IMAGE_HEIGHT}"))
+        if image_size is None:
+            log.warning("Bad image size %s, using %dx%d", self.settings["image_size"], IMAGE_WIDTH, IMAGE_HEIGHT)
+            image_size = (IMAGE_WIDTH, IMAGE_HEIGHT)
+        self.thumbnails = thumbnail_cache_class(self.thumb_dir, self.preview_dir, self.image_format)
+        num_workers = num_workers or self.settings.get("image_workers", DEFAULT_IMAGE_WORKERS)
+        self.image_generator = ImageGenerator(
+            self.style_manager,
+            self.image_dir,
+            num_workers=num_workers,
+            on_failure=self.on_image_failed,
+            thumbnail_cache=self.thumbnails,
+            provider=provider or self.create_provider(num_workers),
+            image_size=image_size,
+            original_format=self.original_format
+        )
+
+        # Entries of the months around the one on screen, by day. The rest of
+        # the journal stays in the database and is read in a month at a time
+        # when needed (see page_in). Image workers change entries too, so
+        # changes are made under the lock.
+        self.lock = threading.RLock()
+        self.writer = JournalWriter(self.store, self.snapshot_day, self.retry_store, self.remove_unused_images)
+        self.entries = {}  # day -> [Entry], resident months only
+        self.entry_index = {}  # entry_id -> (day, position in self.entries[day])
+        self.resident_months = set()  # "YYYY-MM" months in self.entries
+        self.window = []  # months kept in memory, around the day on screen
+        self.resident_window = max(1, int(self.settings.get("resident_months", RESIDENT_MONTHS)))
+        self.missing_images = set()  # entry_ids that still need an image
+        self.evicted_images = self.store.evicted_images()  # image paths whose original was evicted
+        self.visible_day = None  # Day on screen, its images are fetched first
+
+        self.image_listeners = []    # called with (entry_id, day, old_image_path, image_path)
+        self.failure_listeners = []  # called with (entry_id, content) when all attempts failed
+        self.retry_thread = None
+        self.storage_thread = None
+        self.loader_thread = None
+
+        metrics.gauge_function("image_queue_depth", self.image_generator.queue_size)
+        metrics.gauge_function("retry_queue_size", lambda: len(self.retry_store))
+        metrics.gauge_function("missing_images", lambda: len(self.missing_images))
+        metrics.gauge_function("resident_entries", lambda: len(self.entry_index))
+        metrics.gauge_function("resident_months", lambda: len(self.resident_months))
+        metrics.gauge_function("evicted_images", lambda: len(self.evicted_images))
+        metrics.gauge_function("image_concurrency_limit",
+                               lambda: round(self.image_generator.provider.concurrency.limit, 2))
+
+    def create_provider(self, max_concurrency):
+        # "image_provider" names a built in provider or one described under
+        # "image_providers" in settings.json
+        name = self.settings.get("image_provider", DEFAULT_IMAGE_PROVIDER)
+        config = dict(self.settings.get("image_providers", {}).get(name, {}))
+        if name == DEFAULT_IMAGE_PROVIDER and self.settings.get("image_base_url"):
+            config.setdefault("base_url", self.settings["image_base_url"])
+        try:
+            provider = create_provider(name, config, max_concurrency)
+        except (TypeError, ValueError) as e:
+            log.error("Bad image provider settings for %s, using %s: %s", name, DEFAULT_IMAGE_PROVIDER, e)
+            provider = create_provider(DEFAULT_IMAGE_PROVIDER, max_concurrency=max_concurrency)
+        log.info("Generating images with %s", provider.name)
+        return provider
+
+    def ensure_dirs(self):
+        for path in (self.image_dir, self.thumb_dir, self.preview_dir):
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+    def load_settings(self):
+        # Create the settings file if it doesn't exist
+        if not os.path.exists(self.settings_path):
+            with open(self.settings_path, "w") as f:
+                json.dump({"always_on_top": False}, f)
+        with open(self.settings_path, "r") as f:
+            return json.load(f)
+
+    def save_settings(self):
+        write_json_atomic(self.settings_path, self.settings, self.fsync)
+
+    def load_entries(self, day=None):
+        # Open the journal in one go: migrate the old JSON files, read the
+        # months around day (today by default) and find the entries still
+        # missing an image. Returns the number of entries migrated.
+        with metrics.timer("startup_migrate_seconds"):
+            migrated = self.store.migrate_from_json(self.save_dir)
+        with metrics.timer("startup_load_seconds"):
+            self.set_window(self.visible_day or day or datetime.now().strftime("%Y-%m-%d"))
+        entries, days, _, _ = self.store.summary()
+        log.info("Journal has %d entries for %d days, %d of them in memory", entries, days, len(self.entry_index))
+        with metrics.timer("startup_verify_images_seconds"):
+            self.verify_images_on_disk()
+        return migrated
+
+    def manifest(self, day):
+        # What a first frame needs, read straight from the database without
+        # reading in any months: {day: [entries, missing images]} and
+        # {entry_id: day} of the entries missing an image for day's month,
+        # and day's entries. day becomes the day on screen.
+        self.visible_day = day
+        start_day, end_day = f"{day[:7]}-01", f"{day[:7]}-31"
+        return (self.store.day_counts(start_day, end_day), self.store.imageless_entries(start_day, end_day),
+                self.store.load_day(day))
+
+    def start_loader(self, day=None, on_loaded=None):
+        # Opens the journal on a background thread, for a window that is already
+        # showing: load_entries, then the entries without images are queued and
+        # the retry and storage workers started. on_loaded(migrated) is called
+        # from that thread once it's done.
+        if self.loader_thread is None:
+            self.loader_thread = threading.Thread(target=self.load_in_background, args=(day, on_loaded),
+                                                  name="journal-loader", daemon=True)
+            self.loader_thread.start()
+
+    def load_in_background(self, day, on_loaded):
+        started = time.perf_counter()
+        try:
+            migrated = self.load_entries(day)
+            self.check_entries_without_images()
+        except (OSError, sqlite3.Error):
+            log.exception("Could not load the journal")
+            return
+        self.start_retry_worker()
+        self.start_storage_worker()
+        seconds = time.perf_counter() - started
+        metrics.observe("startup_background_seconds", seconds)
+        log.info("Journal loaded in the background in %.2fs", seconds)
+        if on_loaded is not None:
+            on_loaded(migrated)
+
+    def window_months(self, day):
+        # resident_window months with day's month in the middle
+        index = int(day[:4]) * 12 + int(day[5:7]) - 1 - (self.resident_window - 1) // 2
+        return [f"{i // 12}-{i % 12 + 1:02d}" for i in range(index, index + self.resident_window)]
+
+    def set_window(self, day):
+        self.window = self.window_months(day)
+        self.page_in(self.window)
+        self.trim()
+
+    def page_in(self, months):
+        # Read months into memory. Pending writes go out first and images set
+        # while reading are applied on top, so nothing read is older than what
+        # the image workers have done. Call without the lock held.
+        with self.writer.flush_lock:
+            with self.lock:
+                months = [month for month in months if month not in self.resident_months]
+            if not months:
+                return
+            self.writer.write_pending()
+            with metrics.timer("page_in_seconds"):
+                loaded = self.store.load_months(months)
+            with self.lock:
+                pending = self.writer.pending_images()
+                for day, day_entries in loaded.items():
+                    for position, entry in enumerate(day_entries):
+                        if entry.entry_id in pending:
+                            day_entries[position] = entry.replace(image_path=pending[entry.entry_id])
+                    self.entries[day] = day_entries
+                    self.index_day(day)
+                self.resident_months.update(months)
+        metrics.increment("months_paged_in", len(months))
+
+    def trim(self):
+        # Let go of the months outside the window, once their changes are written
+        with self.writer.flush_lock, self.lock:
+            keep = set(self.window) | {day[:7] for day in self.writer.pending_days()}
+            for month in self.resident_months - keep:
+                for day in [day for day in self.entries if day.startswith(month)]:
+                    for entry in self.entries.pop(day):
+                        self.entry_index.pop(entry.entry_id, None)
+                self.resident_months.discard(month)
+
+    @contextlib.contextmanager
+    def resident(self, *days):
+        # Holds the lock with these days' months in memory, for changes to them
+        months = {day[:7] for day in days}
+        while True:
+            self.page_in(months)
+            self.lock.acquire()
+            if months <= self.resident_months:
+                break
+            self.lock.release()  # Trimmed again in between, rare
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def index_day(self, day):
+        # Re-number a day's entries after an insert or delete
+        for position, entry in enumerate(self.entries.get(day, [])):
+            self.entry_index[entry.entry_id] = (day, position)
+
+    def find_entry(self, entry_id):
+        # Returns (day, position) for an entry in memory
+        location = self.entry_index.get(entry_id)
+        if location is None:
+            return None
+        day, position = location
+        day_entries = self.entries.get(day, [])
+        if position < len(day_entries) and day_entries[position].entry_id == entry_id:
+            return location
+        return None
+
+    def entry_day(self, entry_id):
+        location = self.entry_index.get(entry_id)
+        if location is not None:
+            return location[0]
+        found = self.store.get(entry_id)
+        return found[0] if found else None
+
+    def get_entry(self, entry_id):
+        # From memory, or from the database without reading in its month
+        location = self.find_entry(entry_id)
+        if location is not None:
+            day, position = location
+            return self.entries[day][position]
+        found = self.store.get(entry_id)
+        return found[1] if found else None
+
+    def day_entries(self, day):
+        # A day's entries, its month is read in if it isn't in memory
+        with self.resident(day):
+            return list(self.entries.get(day, []))
+
+    def iter_entries(self, start_day=None, end_day=None):
+        # (day, Entry) in date order, streamed from the database
+        self.flush()
+        for day, entry_id, text, image_path, *_ in self.store.iter_range(start_day, end_day):
+            yield day, Entry.from_text(entry_id, text, image_path)
+
+    def save_day(self, day):
+        # Written by the journal writer shortly after, together with other
+        # changes. Call with the lock held, so the month can't be let go of first.
+        self.writer.mark_day(day)
+
+    def snapshot_day(self, day):
+        with self.lock:
+            if day[:7] not in self.resident_months:
+                return None
+            return list(self.entries.get(day, []))
+
+    def flush(self):
+        # Write pending changes now, before reading the database directly
+        self.writer.flush()
+
+    def new_entry_id(self, when=None):
+        # Timestamp ids, with a suffix when the second is taken already. Call
+        # with the lock held and add the entry before letting go of it. Entries
+        # can be on any day, so months not in memory are checked in the database.
+        base = (when or datetime.now()).strftime("%Y%m%d%H%M%S")
+        entry_id = base
+        suffix = 1
+        while entry_id in self.entry_index or self.store.has_entry(entry_id):
+            entry_id = f"{base}_{suffix}"
+            suffix += 1
+        return entry_id
+
+    # Must be called with the lock held and day's month in memory
+    def append_entry(self, day, entry):
+        day_entries = self.entries.setdefault(day, [])
+        day_entries.append(entry)
+        self.entry_index[entry.entry_id] = (day, len(day_entries) - 1)
+        if entry.image_path is None:
+            self.missing_images.add(entry.entry_id)
+        self.save_day(day)
+
+    def add_entry(self, day, entry_text):
+        # Add a new entry to a day, save it and start generating its image
+        with self.resident(day):
+            now = datetime.now()
+            entry = Entry.at(self.new_entry_id(now), now, entry_text)
+            self.append_entry(day, entry)
+        self.request_image(entry.entry_id, entry.content)
+        return entry
+
+    def import_entries(self, records, priority=PRIORITY_BACKGROUND, request_images=True):
+        # Bulk add (day, time or None, content, seed or None) records, as
+        # parsed by journalgen_import. Entries go after those already on their
+        # day and their images are queued behind everything else. Months are
+        # written and let go of every IMPORT_FLUSH_MONTHS, so memory stays
+        # bounded but an import that fails halfway leaves the months before
+        # the failure in the journal; running it again adds only the rest. An entry with the same time and
+        # text as one already on its day is skipped, so importing a file twice
+        # is harmless; repeats within a day are kept as often as they occur.
+        # Returns (added, duplicates, days that got entries).
+        added = []
+        duplicates = 0
+        days = set()
+        # A month at a time, so only a few months are in memory at once
+        months = {}
+        for record in records:
+            months.setdefault(record[0][:7], []).append(record)
+        for number, month in enumerate(sorted(months), 1):
+            with self.resident(f"{month}-01"):
+                # day -> Counter of (time, text) already there and seen in the import so far
+                existing, seen = {}, {}
+                for day, when, content, seed in months[month]:
+                    if day not in existing:
+                        existing[day] = Counter((entry.time_of_day or 0, entry.content)
+                                                for entry in self.entries.get(day, []))
+                        seen[day] = Counter()
+                    hour, minute = (int(part) for part in (when or "00:00").split(":"))
+                    key = (hour * 60 + minute, content)
+                    seen[day][key] += 1
+                    if seen[day][key] <= existing[day][key]:
+                        duplicates += 1
+                        continue
+                    moment = datetime(int(day[:4]), int(day[5:7]), int(day[8:10]), hour, minute)
+                    entry = Entry.at(self.new_entry_id(moment), moment, content)
+                    self.append_entry(day, entry)
+                    added.append((entry.entry_id, content, content_seed(content) if seed is None else seed))
+                    days.add(day)
+            if number % IMPORT_FLUSH_MONTHS == 0:
+                self.flush()
+                self.trim()
+        self.flush()
+        self.trim()
+        log.info("Imported %d entries over %d days, skipped %d duplicates", len(added), len(days), duplicates)
+        metrics.increment("entries_imported", len(added))
+
+        if request_images:
+            for entry_id, content, seed in added:
+                self.request_image(entry_id, content, priority, seed=seed)
+        return len(added), duplicates, len(days)
+
+    def update_entry_content(self, entry_id, content):
+        # Returns the changed entry, its time stays, or None if it doesn't exist
+        day = self.entry_day(entry_id)
+        if day is None:
+            return None
+        with self.resident(day):
+            location = self.find_entry(entry_id)
+            if location is None:
+                return None
+            day, position = location
+            entry = self.entries[day][position] = self.entries[day][position].replace(content=content)
+            self.save_day(day)
+        return entry
+
+    def delete_entry(self, entry_id):
+        # Returns (day, removed entry) or None if the entry doesn't exist
+        day = self.entry_day(entry_id)
+        if day is None:
+            return None
+        with self.resident(day):
+            location = self.find_entry(entry_id)
+            if location is None:
+                return None
+            day, position = location
+            entry = self.entries[day].pop(position)
+            del self.entry_index[entry_id]
+            self.index_day(day)
+            self.missing_images.discard(entry_id)
+            self.save_day(day)
+        self.retry_store.remove(entry_id)
+        self.writer.release_image(entry.image_path)
+        return day, entry
+
+    def remove_unused_images(self, image_paths):
+        # Called by the journal writer once the entries that stopped using
+        # these images are written. Images are shared by entries with the same
+        # prompt and seed, so a file is only deleted once no entry shows it and
+        # no job or pending write is about to.
+        pending = self.writer.pending_image_paths()
+        for image_path in image_paths:
+            if image_path in pending or self.store.image_references(image_path):
+                continue
+            if os.path.normpath(os.path.dirname(image_path)) != os.path.normpath(self.image_dir):
+                continue
+            key = os.path.splitext(os.path.basename(image_path))[0]
+            if self.image_generator.is_key_pending(key):
+                continue
+            if os.path.exists(image_path):
+                os.remove(image_path)
+            self.thumbnails.discard(image_path)
+            self.unmark_evicted(image_path)
+
+    def request_image(self, entry_id, content, priority=None, callback=None, style=None, new_seed=False, seed=None):
+        # The entry keeps its seed so its image can be made again exactly,
+        # new_seed asks for a different picture instead. seed overrides the
+        # saved one.
+        if priority is None:
+            # Entries of the day on screen go ahead of everything else
+            location = self.entry_index.get(entry_id)
+            on_screen = location is not None and location[0] == self.visible_day
+            priority = PRIORITY_VISIBLE if on_screen else PRIORITY_NORMAL
+        if new_seed and self.image_generator.is_pending(entry_id):
+            # Repeated Regen clicks wait for the image already on its way
+            self.image_generator.promote([entry_id], priority)
+            return
+        if new_seed:
+            seed = None  # The generator picks a random one
+        elif seed is None:
+            # Same text, same seed: identical entries share one image
+            seed = self.writer.pending_seed(entry_id)
+            if seed is None:
+                seed = self.store.get_seed(entry_id)
+            if seed is None:
+                seed = content_seed(content)
+        info = self.image_generator.submit(entry_id, content, callback or self.set_entry_image, priority,
+                                           style, seed)
+        self.writer.set_seed(entry_id, info["seed"])
+
+    def show_day(self, day):
+        # Note the day on screen and fetch its pending images before background work
+        self.visible_day = day
+        self.set_window(day)
+        self.image_generator.promote([entry.entry_id for entry in self.entries.get(day, [])])
+
+    # Update an entry with the generated image, whichever day it belongs to.
+    # Entries whose month isn't in memory are only updated in the database.
+    def set_entry_image(self, entry_id, image_path, info=None):
+        self.retry_store.remove(entry_id)
+        with self.lock:
+            self.missing_images.discard(entry_id)
+            location = self.find_entry(entry_id)
+            if location is not None:
+                day, position = location
+                old_image_path = self.entries[day][position].image_path
+                self.entries[day][position] = self.entries[day][position].replace(image_path=image_path)
+            else:
+                found = self.store.get(entry_id)
+                if found is None:
+                    log.warning("Could not find entry %s to update with image", entry_id)
+                    return
+                day, entry = found
+                old_image_path = self.writer.pending_images().get(entry_id, entry.image_path)
+            log.debug("Updating entry %s with image", entry_id)
+            # Queued with the lock held, so a month read in meanwhile sees it (see page_in)
+            self.writer.set_image(entry_id, image_path, info)
+        if old_image_path != image_path:
+            self.writer.release_image(old_image_path)
+        self.unmark_evicted(image_path)
+        for listener in self.image_listeners:
+            listener(entry_id, day, old_image_path, image_path)
+
+    def storage_budget(self):
+        # Bytes the full size images may take, 0 for no limit
+        return int(float(self.settings.get("image_storage_mb", 0)) * 1024 * 1024)
+
+    def is_evicted(self, image_path):
+        return image_path in self.evicted_images and not os.path.exists(image_path)
+
+    def unmark_evicted(self, image_path):
+        with self.lock:
+            if image_path not in self.evicted_images:
+                return
+            self.evicted_images.discard(image_path)
+        self.store.set_evicted([image_path], False)
+
+    def mark_viewed(self, image_path):
+        # Recently viewed originals are the last to be evicted
+        if image_path:
+            self.writer.mark_viewed(image_path, time.time())
+
+    def enforce_storage_budget(self, budget=None):
+        # Evict the least recently viewed originals until the image directory
+        # is back under STORAGE_TARGET of the budget. Thumbnails stay, and only
+        # images whose prompt, seed and size are saved are evicted, so each one
+        # can be made again exactly by restore_image. Returns the number evicted.
+        budget = self.storage_budget() if budget is None else budget
+        if not budget:
+            return 0
+        files = {}
+        with os.scandir(self.image_dir) as it:
+            for item in it:
+                if item.is_file() and not item.name.endswith(".part"):
+                    stat = item.stat()
+                    files[item.name] = (stat.st_size, stat.st_mtime)
+        total = sum(size for size, _ in files.values())
+        if total <= budget:
+            return 0
+
+        self.flush()  # Views and new images still in the writer count too
+        viewed = self.store.last_viewed()
+        with self.lock:
+            on_screen = {entry.image_path for entry in self.entries.get(self.visible_day, [])}
+        image_dir = os.path.normpath(self.image_dir)
+        candidates = []
+        for image_path in self.store.regenerable_images():
+            name = os.path.basename(image_path)
+            if name not in files or image_path in on_screen or \
+                    os.path.normpath(os.path.dirname(image_path)) != image_dir:
+                continue
+            size, mtime = files[name]
+            candidates.append((viewed.get(image_path) or mtime, image_path, size))
+        candidates.sort()
+
+        evicted = []
+        freed = 0
+        for _, image_path, size in candidates:
+            if total - freed <= budget * STORAGE_TARGET:
+                break
+            if self.image_generator.is_key_pending(os.path.splitext(os.path.basename(image_path))[0]):
+                continue
+            try:
+                self.thumbnails.get_thumbnail(image_path)  # Made now if missing, it has to outlive the original
+                os.remove(image_path)
+                self.thumbnails.discard_preview(image_path)
+            except (OSError, ValueError) as e:
+                log.warning("Could not evict %s: %s", image_path, e)
+                continue
+            evicted.append(image_path)
+            freed += size
+        with self.lock:
+            self.evicted_images.update(evicted)
+        self.store.set_evicted(evicted)
+        metrics.increment("images_evicted", len(evicted))
+        metrics.increment("image_bytes_evicted", freed)
+        log.info("Evicted %d images (%.1f MB) to stay within the %.0f MB image budget",
+                 len(evicted), freed / 1024 / 1024, budget / 1024 / 1024)
+        return len(evicted)
+
+    def restore_image(self, image_path, callback=None, on_failure=None):
+        # Make an evicted original again from its saved prompt, seed and size,
+        # ahead of all other image work. callback gets the image path once it
+        # is back, on_failure the image path if it couldn't be made. Returns
+        # False if the image can't be restored.
+        found = self.store.image_info(image_path)
+        if found is None:
+            log.warning("Can't restore %s, what it was made from isn't known", image_path)
+            return False
+        entry_id, info = found
+        entry = self.get_entry(entry_id)
+        content = entry.content if entry else info["prompt"]
+
+        def restored(waiter_id, restored_path, info):
+            self.unmark_evicted(image_path)
+            if restored_path != image_path:
+                # Made again in the current original format
+                self.rename_images({image_path: restored_path})
+            self.mark_viewed(restored_path)
+            metrics.increment("images_restored")
+            if callback:
+                callback(restored_path)
+
+        def failed(waiter_id, content):
+            # The entry itself is fine, it only lost its original, so no retry queue
+            log.warning("Couldn't restore evicted image %s", image_path)
+            if on_failure:
+                on_failure(image_path)
+
+        # Waits under its own id, so a restyle, edit or retry of the entry in the
+        # meantime still gets its own result
+        log.debug("Restoring evicted image %s", image_path)
+        self.image_generator.submit(f"restore:{image_path}", content, restored, PRIORITY_VISIBLE, info=info,
+                                    on_failure=failed)
+        return True
+
+    def rename_images(self, renamed):
+        # Point every entry showing one of these images (old path -> new path)
+        # at the new path, then remove the old files nothing shows any more
+        changed = []
+        with self.lock:
+            for entry_id in self.store.entries_with_images(renamed):
+                location = self.find_entry(entry_id)
+                if location is None:
+                    # Not in memory, only the database needs changing
+                    found = self.store.get(entry_id)
+                    if found is not None and found[1].image_path in renamed:
+                        self.writer.set_image(entry_id, renamed[found[1].image_path])
+                        changed.append((entry_id, found[0], found[1].image_path))
+                    continue
+                day, position = location
+                entry = self.entries[day][position]
+                if entry.image_path in renamed:
+                    self.entries[day][position] = entry.replace(image_path=renamed[entry.image_path])
+                    self.save_day(day)
+                    changed.append((entry_id, day, entry.image_path))
+            for old_path in renamed:
+                if old_path in self.evicted_images:
+                    self.evicted_images.discard(old_path)
+                    self.evicted_images.add(renamed[old_path])
+        self.store.rename_image_files(renamed)
+        self.flush()
+        for entry_id, day, old_path in changed:
+            for listener in self.image_listeners:
+                listener(entry_id, day, old_path, renamed[old_path])
+        for old_path in renamed:
+            if not self.store.image_references(old_path) and os.path.exists(old_path):
+                os.remove(old_path)
+
+    def migrate_images(self, workers=None):
+        # Bring every image to the current "image_format" for thumbnails and
+        # previews, and re-encode the originals too with "compress_originals".
+        # The work is spread over a pool of processes; images already in shape
+        # are skipped, so an interrupted run just carries on. Returns a summary
+        # with the space saved.
+        started = time.perf_counter()
+        self.flush()
+        image_dir = os.path.normpath(self.image_dir)
+        with self.lock:
+            image_paths = sorted(self.store.image_paths() | self.evicted_images)
+        tasks = [(image_path, self.thumb_dir, self.preview_dir, self.image_format, self.original_format)
+                 for image_path in image_paths if os.path.normpath(os.path.dirname(image_path)) == image_dir]
+        converted = 0
+        before = after = 0
+        renamed = {}
+        # Imported here, multiprocessing is only needed for this
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # Spawned, not forked: the engine's threads may hold locks at fork time
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            for number, (image_path, new_path, size_before, size_after) in enumerate(
+                    pool.map(convert_image, tasks, chunksize=16), 1):
+                before += size_before
+                after += size_after
+                converted += size_before != size_after or new_path != image_path
+                if new_path != image_path:
+                    renamed[image_path] = new_path
+                if len(renamed) >= MIGRATION_RENAME_BATCH:
+                    self.rename_images(renamed)
+                    renamed = {}
+                if number % 1000 == 0:
+                    log.info("Optimized %d of %d images", number, len(tasks))
+        if renamed:
+            self.rename_images(renamed)
+
+        seconds = time.perf_counter() - started
+        metrics.observe("image_migration_seconds", seconds)
+        log.info("Optimized %d images, %.1f MB saved", converted, (before - after) / 1024 / 1024)
+        return {"images": len(tasks), "converted": converted, "bytes_before": before, "bytes_after": after,
+                "saved_bytes": before - after, "format": self.image_format,
+                "originals": self.original_format or "unchanged", "seconds": round(seconds, 2)}
+
+    def start_storage_worker(self):
+        # Keeps the image directory within "image_storage_mb", if set
+        if self.storage_thread is None and self.storage_budget():
+            self.storage_thread = threading.Thread(target=self.storage_loop, name="storage-budget", daemon=True)
+            self.storage_thread.start()
+
+    def storage_loop(self):
+        while True:
+            try:
+                self.enforce_storage_budget()
+            except (OSError, sqlite3.Error):
+                log.exception("Could not enforce the image storage budget")
+            time.sleep(STORAGE_CHECK_INTERVAL)
+
+    def start_retry_worker(self):
+        if self.retry_thread is None:
+            self.retry_thread = threading.Thread(target=self.process_retry_queue, daemon=True)
+            self.retry_thread.start()
+
+    def process_retry_queue(self):
+        while True:
+            entry_id, entry_text = self.retry_store.next_due()
+            if entry_id in self.missing_images:
+                log.debug("Retrying image generation for entry %s", entry_id)
+                metrics.increment("retry_queue_attempts")
+                self.request_image(entry_id, entry_text, PRIORITY_BACKGROUND)
+            else:
+                log.debug("Entry %s no longer needs an image", entry_id)
+                self.retry_store.remove(entry_id)
+
+    def add_to_retry_queue(self, entry_id, entry_text):
+        if self.retry_store.add(entry_id, entry_text):
+            log.debug("Added entry %s to retry queue", entry_id)
+        else:
+            log.debug("Entry %s is already in the retry queue", entry_id)
+
+    def on_image_failed(self, entry_id, entry_text):
+        if entry_id in self.retry_store:
+            delay = self.retry_store.reschedule(entry_id, entry_text)
+            log.debug("Retry failed for entry %s. Next attempt in %s seconds.", entry_id, delay)
+            metrics.increment("retry_queue_reschedules")
+        else:
+            log.debug("Max retries reached for entry %s. Adding to retry queue.", entry_id)
+            self.add_to_retry_queue(entry_id, entry_text)
+        for listener in self.failure_listeners:
+            listener(entry_id, entry_text)
+
+    def check_entries_without_images(self):
+        # Queue every entry known to be missing an image, no filesystem access
+        missing = []
+        for entry_id in list(self.missing_images):
+            if entry_id in self.retry_store or self.image_generator.is_pending(entry_id):
+                continue
+            entry = self.get_entry(entry_id)
+            if entry is not None:
+                missing.append((entry_id, entry.content))
+        added = self.retry_store.add_many(missing)
+        if added:
+            log.info("Added %d entries without images to the retry queue", added)
+
+    def scan_image_dir(self):
+        # One directory listing instead of a stat per entry
+        with os.scandir(self.image_dir) as it:
+            # Downloads in progress (.part) aren't images yet
+            return {item.name: item.stat().st_size for item in it
+                    if item.is_file() and not item.name.endswith(".part")}
+
+    def verify_images_on_disk(self):
+        # Rebuild the missing image set from a single listing of the image
+        # directory, catching images that were removed behind the app's back.
+        # Entries in memory are newer than the database, and so are images
+        # still waiting in the journal writer.
+        on_disk = self.scan_image_dir()
+        image_dir = os.path.normpath(self.image_dir)
+        rows = self.store.image_states()
+
+        missing = set()
+        with self.lock:
+            pending = self.writer.pending_images()
+            states = [(entry_id, pending.get(entry_id, image_path)) for entry_id, day, image_path in rows
+                      if day[:7] not in self.resident_months]
+            states += [(entry.entry_id, entry.image_path) for day_entries in self.entries.values()
+                       for entry in day_entries]
+            for entry_id, image_path in states:
+                if image_path is None:
+                    missing.add(entry_id)
+                elif os.path.normpath(os.path.dirname(image_path)) == image_dir:
+                    # Evicted originals come back when opened, they aren't missing
+                    if os.path.basename(image_path) not in on_disk and image_path not in self.evicted_images:
+                        missing.add(entry_id)
+                elif not os.path.exists(image_path):
+                    missing.add(entry_id)
+            self.missing_images = missing
+        log.info("Found %d entries without images", len(missing))
+        return on_disk
+
+    def stats(self):
+        on_disk = self.scan_image_dir()
+        self.flush()
+        entries, days, first_day, last_day = self.store.summary()
+        return {
+            "entries": entries,
+            "days": days,
+            "first_day": first_day,
+            "last_day": last_day,
+            "resident_months": len(self.resident_months),
+            "missing_images": len(self.missing_images),
+            "evicted_images": len(self.evicted_images),
+            "retry_queue": len(self.retry_store),
+            "image_files": len(on_disk),
+            "image_bytes": sum(on_disk.values()),
+            "database_bytes": os.path.getsize(self.store.path),
+        }
+
+    def verify(self):
+        # List of problems found in the journal, empty if everything checks out
+        self.flush()
+        problems = self.store.check_integrity()
+        on_disk = self.verify_images_on_disk()
+        for entry_id in sorted(self.missing_images):
+            problems.append(f"Entry {entry_id} has no image")
+        referenced = {os.path.basename(image_path) for image_path in self.store.image_paths()}
+        for name in sorted(set(on_disk) - referenced):
+            problems.append(f"Image {name} does not belong to any entry")
+        return problems
+
+    def start_metrics_export(self):
+        # "metrics_file" in settings.json rewrites a JSON snapshot every
+        # METRICS_WRITE_INTERVAL seconds, "metrics_port" serves them on localhost
+        if self.settings.get("metrics_file"):
+            metrics.start_file_writer(self.metrics_path(), METRICS_WRITE_INTERVAL)
+        if self.settings.get("metrics_port"):
+            try:
+                metrics.start_server(int(self.settings["metrics_port"]))
+            except OSError as e:
+                log.warning("Could not serve metrics on port %s: %s", self.settings["metrics_port"], e)
+
+    def metrics_path(self):
+        return os.path.join(self.base_dir, self.settings["metrics_file"])
+
+    def close(self):
+        # Everything still waiting in the journal writer is written first
+        self.writer.close()
+        if self.settings.get("metrics_file"):
+            metrics.write_file(self.metrics_path())
+        self.store.close()
@@ -0,0 +1,320 @@
+# Whole-journal export, streamed in date order one month at a time so memory
+# use stays the same however long the journal is:
+#
+#   jsonl    one JSON object per entry, one entry per line
+#   archive  a .tar.gz with the entries as JSON Lines per month and the images
+#   site     a static HTML site, one page per month, with thumbnails that
+#            link to screen sized previews
+#
+# After every month the output is flushed and a checkpoint is written next to
+# it, so an interrupted export continues from the last finished month. Image
+# work (resizing, compressing) runs on a thread pool; thumbnails and previews
+# come from the journal's own caches when they are up to date.
+import html
+import json
+import os
+import shutil
+import tarfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+from journalgen_core import write_json_atomic
+from journalgen_metrics import log, metrics
+
+EXPORT_FORMATS = ("jsonl", "archive", "site")
+EXPORT_WORKERS = min(8, os.cpu_count() or 4)
+ARCHIVE_COMPRESSION = 6  # zlib level for the archive
+CHECKPOINT_SUFFIX = ".export.json"
+PART_SUFFIX = ".part"  # single file exports are written here and renamed when complete
+
+def export_records(store, start_day=None, end_day=None):
+    # One dict per entry, in date order, straight from the database
+    for day, entry_id, text, image_path, seed, prompt, width, height in store.iter_range(start_day, end_day):
+        yield {
+            "id": entry_id,
+            "day": day,
+            "text": text,
+            "image": os.path.basename(image_path) if image_path else None,
+            "seed": seed,
+            "prompt": prompt,
+            "width": width,
+            "height": height,
+        }
+
+def ordered_map(pool, fn, items, window):
+    # pool.map that keeps at most window results in memory, yielded in order
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def next_month(month):
+    year, number = (int(part) for part in month.split("-"))
+    return f"{year + number // 12}-{number % 12 + 1:02d}-01"
+
+class Exporter:
+    # Subclasses implement begin(), restore(checkpoint), write_month() and
+    # finish(). Checkpoints hold the last finished month and whatever the
+    # format needs to continue after it (see position()).
+    format = None
+
+    def __init__(self, engine, output, start_day=None, end_day=None, workers=EXPORT_WORKERS):
+        self.engine = engine
+        self.output = output
+        self.start_day = start_day
+        self.end_day = end_day
+        self.workers = workers
+        self.checkpoint_path = output.rstrip("/\\") + CHECKPOINT_SUFFIX
+        self.entries = 0
+        self.images = 0
+
+    def image_source(self, name):
+        # Images all live in the journal's image directory
+        path = os.path.join(self.engine.image_dir, name)
+        return path if os.path.exists(path) else None
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        # Only continue the same export, anything else starts over
+        if [checkpoint.get(key) for key in ("format", "start_day", "end_day")] != \
+                [self.format, self.start_day, self.end_day]:
+            return None
+        return checkpoint
+
+    def save_checkpoint(self, month):
+        checkpoint = {"format": self.format, "start_day": self.start_day, "end_day": self.end_day,
+                      "month": month, "entries": self.entries, "images": self.images}
+        checkpoint.update(self.position())
+        write_json_atomic(self.checkpoint_path, checkpoint, fsync=True)
+
+    def run(self, resume=True):
+        # Returns a summary of the export, raises OSError if the output can't be written
+        started = time.perf_counter()
+        self.engine.flush()  # Changes still waiting in the journal writer are exported too
+        checkpoint = self.load_checkpoint() if resume else None
+        start_day = self.start_day
+        if checkpoint is not None:
+            try:
+                self.restore(checkpoint)
+            except FileNotFoundError:
+                # The partial output went away since, all there is to do is start over
+                log.warning("Partial %s export %s is gone, starting over", self.format, self.output)
+                checkpoint = None
+        if checkpoint is not None:
+            self.entries, self.images = checkpoint["entries"], checkpoint["images"]
+            start_day = max(start_day or "", next_month(checkpoint["month"]))
+            log.info("Resuming %s export after %s", self.format, checkpoint["month"])
+        else:
+            self.begin()
+
+        months = 0
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="export") as pool:
+            records = export_records(self.engine.store, start_day, self.end_day)
+            for month, month_records in groupby(records, key=lambda record: record["day"][:7]):
+                with metrics.timer("export_month_seconds"):
+                    self.write_month(month, list(month_records), pool)
+                self.save_checkpoint(month)
+                months += 1
+                log.info("Exported %s, %d entries so far", month, self.entries)
+        self.finish()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        seconds = time.perf_counter() - started
+        metrics.observe("export_seconds", seconds)
+        return {"format": self.format, "output": self.output, "entries": self.entries, "images": self.images,
+                "months": months, "resumed": checkpoint is not None, "seconds": round(seconds, 2)}
+
+    def begin(self):
+        pass
+
+    def restore(self, checkpoint):
+        pass
+
+    def position(self):
+        return {}
+
+    def write_month(self, month, records, pool):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+class StreamExporter(Exporter):
+    # Single file output written to output.part and renamed when complete.
+    # The checkpoint keeps its size after each month, a resumed export cuts
+    # off anything written after that and appends.
+    def begin(self):
+        self.file = open(self.output + PART_SUFFIX, "wb")
+
+    def restore(self, checkpoint):
+        self.file = open(self.output + PART_SUFFIX, "r+b")
+        self.file.truncate(checkpoint["offset"])
+        self.file.seek(checkpoint["offset"])
+
+    def position(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"offset": self.file.tell()}
+
+    def finish(self):
+        self.file.close()
+        os.replace(self.output + PART_SUFFIX, self.output)
+
+class JsonlExporter(StreamExporter):
+    format = "jsonl"
+
+    def write_month(self, month, records, pool):
+        lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in records]
+        self.file.write("".join(lines).encode("utf-8"))
+        self.entries += len(records)
+
+class ArchiveExporter(StreamExporter):
+    # A tar stream, gzip compressed as a series of gzip members: one for each
+    # image, compressed in parallel, and one for each month's entries.
+    # Concatenated members read back as one stream with tar and gzip alike,
+    # and every month ends on a member boundary, which is what makes resuming
+    # by truncation possible. An image shared by several entries of a month
+    # goes in once; one shared across months goes in once for each, which
+    # keeps the checkpoint small and extracts to the same single file.
+    format = "archive"
+    root = "journal"
+
+    def tar_member(self, name, data):
+        info = tarfile.TarInfo(f"{self.root}/{name}")
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        padding = -len(data) % tarfile.BLOCKSIZE
+        return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape") + data + b"\0" * padding
+
+    def compress(self, data):
+        compressor = zlib.compressobj(ARCHIVE_COMPRESSION, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+        return compressor.compress(data) + compressor.flush()
+
+    def image_member(self, name):
+        path = self.image_source(name)
+        if path is None:
+            log.warning("Image %s is missing, exported without it", name)
+            return None
+        with open(path, "rb") as f:
+            return self.compress(self.tar_member(f"images/{name}", f.read()))
+
+    def write_month(self, month, records, pool):
+        names = sorted({record["image"] for record in records if record["image"]})
+        for member in ordered_map(pool, self.image_member, names, self.workers * 2):
+            if member is not None:
+                self.file.write(member)
+                self.images += 1
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        self.file.write(self.compress(self.tar_member(f"entries/{month}.jsonl", lines.encode("utf-8"))))
+        self.entries += len(records)
+
+    def finish(self):
+        self.file.write(self.compress(b"\0" * tarfile.BLOCKSIZE * 2))  # End of archive marker
+        super().finish()
+
+class SiteExporter(Exporter):
+    # index.html lists the months, each month is a page with its entries by
+    # day. Thumbnails go to thumbs/, screen sized previews to images/. Files
+    # already in place are kept, so a resumed export doesn't redo them.
+    format = "site"
+
+    def begin(self):
+        os.makedirs(os.path.join(self.output, "thumbs"), exist_ok=True)
+        os.makedirs(os.path.join(self.output, "images"), exist_ok=True)
+        self.months = [month for month, _ in self.engine.store.month_counts(self.start_day, self.end_day)]
+
+    def restore(self, checkpoint):
+        self.begin()
+
+    def copy_variants(self, name):
+        # Returns the name of the exported image, or None when there isn't one
+        thumbnails = self.engine.thumbnails
+        path = os.path.join(self.engine.image_dir, name)
+        if os.path.exists(path):
+            variants = (("thumbs", thumbnails.get_thumbnail), ("images", thumbnails.get_preview))
+        elif thumbnails.has_thumbnail(path):
+            # Evicted to save space, the thumbnail stands in for the preview too
+            variants = (("thumbs", thumbnails.get_thumbnail), ("images", thumbnails.get_thumbnail))
+        else:
+            log.warning("Image %s is missing, exported without it", name)
+            return None
+        exported = None
+        try:
+            for folder, variant in variants:
+                source = variant(path)
+                # Named after the thumbnail, whatever format the variants are in
+                exported = exported or os.path.splitext(name)[0] + os.path.splitext(source)[1]
+                target = os.path.join(self.output, folder, exported)
+                if not os.path.exists(target):
+                    shutil.copyfile(source, target)
+        except (OSError, ValueError) as e:
+            log.warning("Could not export image %s: %s", name, e)
+            return None
+        return exported
+
+    def page(self, title, body):
+        return (
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            f"<title>{html.escape(title)}</title>\n<style>"
+            "body{font-family:sans-serif;max-width:900px;margin:auto;padding:1em}"
+            ".entry{display:flex;gap:1em;margin:.5em 0}.entry img{width:150px;height:84px;object-fit:cover}"
+            "nav{display:flex;justify-content:space-between;margin:1em 0}"
+            f"</style></head><body>\n{body}\n</body></html>\n"
+        )
+
+    def month_link(self, month, label=None):
+        return f'<a href="{month}.html">{html.escape(label or month)}</a>' if month else "<span></span>"
+
+    def write_month(self, month, records, pool):
+        names = sorted({record["image"] for record in records if record["image"]})
+        exported = dict(zip(names, ordered_map(pool, self.copy_variants, names, self.workers * 2)))
+        self.images += sum(1 for name in exported.values() if name)
+
+        index = self.months.index(month) if month in self.months else -1
+        previous = self.months[index - 1] if index > 0 else None
+        following = self.months[index + 1] if 0 <= index < len(self.months) - 1 else None
+        nav = (f"<nav>{self.month_link(previous, '&larr; ' + previous if previous else None)}"
+               f'<a href="index.html">All months</a>'
+               f"{self.month_link(following, following + ' &rarr;' if following else None)}</nav>")
+        parts = [f"<h1>{month}</h1>", nav]
+        for day, day_records in groupby(records, key=lambda record: record["day"]):
+            parts.append(f"<h2>{day}</h2>")
+            for record in day_records:
+                image = exported.get(record["image"])
+                picture = (f'<a href="images/{image}"><img src="thumbs/{image}" alt="" loading="lazy"></a>'
+                           if image else "")
+                parts.append(f'<div class="entry" id="{record["id"]}">{picture}'
+                             f"<p>{html.escape(record['text'])}</p></div>")
+        parts.append(nav)
+        self.write_page(f"{month}.html", self.page(month, "\n".join(parts)))
+        self.entries += len(records)
+
+    def write_page(self, name, text):
+        path = os.path.join(self.output, name)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+    def finish(self):
+        items = "\n".join(f"<li>{self.month_link(month)} ({count} entries)</li>"
+                          for month, count in self.engine.store.month_counts(self.start_day, self.end_day))
+        self.write_page("index.html", self.page("Journal", f"<h1>Journal</h1>\n<ul>\n{items}\n</ul>"))
+
+EXPORTERS = {"jsonl": JsonlExporter, "archive": ArchiveExporter, "site": SiteExporter}
+
+def export_journal(engine, output, format, start_day=None, end_day=None, workers=EXPORT_WORKERS, resume=True):
+    if format not in EXPORTERS:
+        raise ValueError(f"Unknown export format {format}, choose from: {', '.join(EXPORT_FORMATS)}")
+    return EXPORTERS[format](engine, output, start_day, end_day, workers).run(resume)
@@ -0,0 +1,136 @@
+# Bulk import of existing diaries. Three formats are understood:
+#
+#   text      a line starting with a date (2023-05-01) starts that day; the
+#             rest of the line, and every paragraph after it, is an entry
+#   markdown  the same, with the date in a heading (## 2023-05-01) and each
+#             list item or paragraph an entry; other headings are skipped
+#   jsonl     one object per line with "day" (or "date") and "text", and
+#             optionally "time" and "seed", as written by the jsonl export
+#
+# An entry may start with its time, "14:05", "2:05pm" or "[02:05PM]". Parsing
+# yields (day, "HH:MM" or None, content, seed or None) records for
+# JournalEngine.import_entries.
+import json
+import os
+import re
+import time
+from datetime import datetime
+from functools import lru_cache
+
+from journalgen_metrics import log
+
+IMPORT_FORMATS = ("text", "markdown", "jsonl")
+FORMAT_EXTENSIONS = {".md": "markdown", ".markdown": "markdown", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+DATE_LINE = re.compile(r"^(\d{4}-\d{2}-\d{2})\b[\s:,.-]*(.*)$")
+HEADING = re.compile(r"^#{1,6}\s+(.*)$")
+LIST_ITEM = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+(.*)$")
+TIME_PREFIX = re.compile(r"^\[?(\d{1,2}):(\d{2})\s*([AaPp][Mm])?\]?\s+(.*)$", re.S)
+
+@lru_cache(maxsize=4096)  # Diaries repeat the same days, strptime is slow
+def valid_day(day):
+    try:
+        datetime.strptime(day, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def split_time(text):
+    # ("HH:MM" or None, text without the time)
+    match = TIME_PREFIX.match(text)
+    if match is None:
+        return None, text
+    hour, minute, half, rest = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+    if half:
+        if not 1 <= hour <= 12:
+            return None, text
+        hour = hour % 12 + (12 if half.lower() == "pm" else 0)
+    if hour > 23 or minute > 59:
+        return None, text
+    return f"{hour:02d}:{minute:02d}", rest
+
+def parse_text(lines, markdown=False):
+    day = None
+    paragraph = []
+    skipped = 0
+
+    def finish():
+        text = " ".join(paragraph).strip()
+        paragraph.clear()
+        if text:
+            when, content = split_time(text)
+            return day, when, content.strip(), None
+        return None
+
+    for line in lines:
+        line = line.strip()
+        heading = HEADING.match(line) if markdown else None
+        date_line = DATE_LINE.match(heading.group(1) if heading else line)
+        item = LIST_ITEM.match(line) if markdown else None
+
+        if date_line and valid_day(date_line.group(1)):
+            record = finish()
+            if record:
+                yield record
+            day = date_line.group(1)
+            if date_line.group(2) and not heading:
+                paragraph.append(date_line.group(2))
+        elif not line or heading:
+            record = finish()
+            if record:
+                yield record
+        elif day is None:
+            skipped += 1
+        elif item:
+            record = finish()
+            if record:
+                yield record
+            paragraph.append(item.group(1))
+        else:
+            paragraph.append(line)
+    record = finish()
+    if record:
+        yield record
+    if skipped:
+        log.warning("Skipped %d lines before the first date", skipped)
+
+def parse_jsonl(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            day = str(item.get("day") or item.get("date") or "")[:10]
+            text = item["text"].strip()
+        except (ValueError, KeyError, AttributeError, TypeError) as e:
+            log.warning("Skipped line %d, not an entry: %s", number, e)
+            continue
+        if not valid_day(day) or not text:
+            log.warning("Skipped line %d, no valid day or text", number)
+            continue
+        when, content = split_time(text)
+        if item.get("time"):
+            when, _ = split_time(f"{item['time']} ")
+        seed = item.get("seed")
+        yield day, when, content.strip(), seed if isinstance(seed, int) else None
+
+def detect_format(path):
+    return FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower(), "text")
+
+def parse_file(path, format=None):
+    # All records of a file, in file order
+    format = format or detect_format(path)
+    if format not in IMPORT_FORMATS:
+        raise ValueError(f"Unknown import format {format}, choose from: {', '.join(IMPORT_FORMATS)}")
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if format == "jsonl":
+            return list(parse_jsonl(f))
+        return list(parse_text(f, markdown=format == "markdown"))
+
+def import_file(engine, path, format=None, request_images=True):
+    # Returns a summary of the import, raises OSError or ValueError for an unreadable file
+    started = time.perf_counter()
+    records = parse_file(path, format)
+    added, duplicates, days = engine.import_entries(records, request_images=request_images)
+    return {"path": path, "entries": added, "duplicates": duplicates, "days": days,
+            "seconds": round(time.perf_counter() - started, 2)}
@@ -0,0 +1,223 @@
+# Logging and metrics for JOURNALGEN. Log lines go through the standard
+# logging module under the "journalgen" logger, so per-entry chatter can sit at
+# DEBUG and cost nothing unless asked for. Metrics are plain in-process
+# counters, gauges and latency histograms in one registry, which can be
+# written to a JSON file or served on localhost for a scraper.
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger("journalgen")
+
+# Histogram buckets: upper bounds growing by 2x from 100 microseconds to ~2 minutes
+HISTOGRAM_BUCKETS = tuple(0.0001 * 2 ** i for i in range(21))
+
+def configure_logging(level="INFO"):
+    # Plain one-line records on stderr, only configured once per process
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S"))
+        log.addHandler(handler)
+        log.propagate = False
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def snapshot(self):
+        return {"type": "counter", "value": self.value}
+
+class Gauge:
+    # Either set explicitly or read from a function when a snapshot is taken
+    def __init__(self, read=None):
+        self.value = 0
+        self.read = read
+
+    def snapshot(self):
+        value = self.read() if self.read else self.value
+        return {"type": "gauge", "value": value}
+
+class Histogram:
+    # Fixed exponential buckets: constant memory and O(log n) observe,
+    # percentiles are estimated to within one bucket
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one counts everything above the top bucket
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value):
+        low, high = 0, len(self.buckets)
+        while low < high:
+            middle = (low + high) // 2
+            if value <= self.buckets[middle]:
+                high = middle
+            else:
+                low = middle + 1
+        self.counts[low] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                value = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+                return round(value, 6)
+        return round(self.max, 6)
+
+    def snapshot(self):
+        return {
+            "type": "histogram",
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": round(self.min, 6) if self.count else None,
+            "max": round(self.max, 6),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # name -> Counter, Gauge or Histogram
+        self.started = time.time()
+        self.server = None
+        self.writer = None
+
+    def get(self, name, kind, *args):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = kind(*args)
+        return metric
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.get(name, Counter).value += amount
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.get(name, Gauge).value = value
+
+    def gauge_function(self, name, read):
+        # Gauge read from read() whenever metrics are looked at, e.g. a queue length
+        with self.lock:
+            self.metrics[name] = Gauge(read)
+
+    def observe(self, name, value):
+        with self.lock:
+            self.get(name, Histogram).observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        # Records the seconds spent in the with block into a histogram
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.items())
+            snapshot = {}
+            for name, metric in metrics:
+                if not isinstance(metric, Gauge):
+                    snapshot[name] = metric.snapshot()
+        # Gauge functions may take other locks, so they are read outside ours
+        for name, metric in metrics:
+            if isinstance(metric, Gauge):
+                try:
+                    snapshot[name] = metric.snapshot()
+                except Exception as e:
+                    log.debug("Could not read gauge %s: %s", name, e)
+        return dict(sorted(snapshot.items()))
+
+    def to_prometheus(self):
+        # Text exposition format, names prefixed with journalgen_
+        lines = []
+        for name, values in self.snapshot().items():
+            full_name = f"journalgen_{name}"
+            if values["type"] == "histogram":
+                lines.append(f"# TYPE {full_name} summary")
+                for key, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                    if values[key] is not None:
+                        lines.append(f'{full_name}{{quantile="{quantile}"}} {values[key]}')
+                lines.append(f"{full_name}_sum {values['sum']}")
+                lines.append(f"{full_name}_count {values['count']}")
+            else:
+                lines.append(f"# TYPE {full_name} {values['type']}")
+                lines.append(f"{full_name} {values['value']}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        data = {"uptime_seconds": round(time.time() - self.started, 3), "metrics": self.snapshot()}
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+
+    def start_file_writer(self, path, interval):
+        # Rewrites the metrics file every interval seconds until the process exits
+        if self.writer is not None:
+            return
+
+        def write_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_file(path)
+                except OSError as e:
+                    log.warning("Could not write metrics to %s: %s", path, e)
+
+        self.writer = threading.Thread(target=write_loop, name="metrics-writer", daemon=True)
+        self.writer.start()
+
+    def start_server(self, port, host="127.0.0.1"):
+        # /metrics in Prometheus text format, /metrics.json as JSON. localhost only.
+        if self.server is not None:
+            return self.server.server_address[1]
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler  # Only when asked for, it's slow to import
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(registry.snapshot()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+        log.info("Serving metrics at http://%s:%d/metrics", host, self.server.server_address[1])
+        return self.server.server_address[1]
+
+# The process wide registry
+metrics = MetricsRegistry()
@@ -0,0 +1,267 @@
+# Image providers: where generated images come from. Each provider paces its
+# own requests with a token bucket (a hard requests per second cap) and an
+# AIMD concurrency limit that grows while the service answers quickly and is
+# cut back as soon as it slows down or throttles, so we use whatever rate the
+# service gives us without getting banned. Providers are picked with
+# "image_provider" in settings.json; extra HTTP services can be described
+# under "image_providers".
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlencode
+
+from journalgen_metrics import log, metrics
+
+POLLINATIONS_URL = "https://image.pollinations.ai/prompt/"
+
+# Defaults for an HTTP provider
+DEFAULT_RATE = 2.0       # requests per second, 0 for no cap
+DEFAULT_BURST = 4        # requests that may go out back to back
+DEFAULT_CONCURRENCY = 4  # requests in flight at most
+REQUEST_TIMEOUT = 60     # seconds
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+THROTTLE_STATUSES = (429, 503)
+DEFAULT_RETRY_AFTER = 10  # seconds to back off after a throttle without a Retry-After header
+
+# AIMD tuning
+LATENCY_TOLERANCE = 2.0  # slower than this many times the best recent latency counts as overload
+LATENCY_BACKOFF = 0.9    # limit multiplier when requests get slow
+THROTTLE_BACKOFF = 0.5   # limit multiplier when the service throttles
+BASELINE_DRIFT = 0.05    # how fast the latency baseline follows slower requests
+
+class ProviderError(Exception):
+    # A failed image request. throttled means the service asked us to slow
+    # down, retry_after is how long it asked us to wait, in seconds.
+    def __init__(self, message, throttled=False, retry_after=None):
+        super().__init__(message)
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class TokenBucket:
+    # rate tokens per second up to burst, one per request. pause() holds every
+    # request back until a deadline, for Retry-After.
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.rate:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    wait_time = self.paused_until - now
+                elif not self.rate:
+                    return
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class AdaptiveConcurrency:
+    # Additive increase, multiplicative decrease on the number of requests in
+    # flight. Each quick success adds 1/limit (about +1 per round of requests),
+    # a slow one multiplies by LATENCY_BACKOFF and a throttle by THROTTLE_BACKOFF.
+    def __init__(self, max_limit=DEFAULT_CONCURRENCY, initial=None, min_limit=1):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.limit = float(initial if initial is not None else min(2, self.max_limit))
+        self.in_flight = 0
+        self.baseline = None  # Best recent latency
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self, latency):
+        with self.condition:
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                self.baseline += (latency - self.baseline) * BASELINE_DRIFT
+            if latency > self.baseline * LATENCY_TOLERANCE:
+                self.limit = max(self.min_limit, self.limit * LATENCY_BACKOFF)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def on_throttle(self):
+        with self.condition:
+            self.limit = max(self.min_limit, self.limit * THROTTLE_BACKOFF)
+
+class ImageProvider:
+    # Base class. Subclasses implement generate(), request() adds the pacing.
+    name = "provider"
+
+    def __init__(self, name=None, rate=0, burst=DEFAULT_BURST, max_concurrency=DEFAULT_CONCURRENCY,
+                 initial_concurrency=None):
+        self.name = name or self.name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, initial_concurrency)
+
+    def request(self, prompt, seed, width, height, path):
+        # Writes the image to path and returns its size in bytes, or raises
+        # ProviderError (or OSError for local trouble)
+        self.concurrency.acquire()
+        try:
+            self.bucket.acquire()
+            started = time.perf_counter()
+            try:
+                written = self.generate(prompt, seed, width, height, path)
+            except ProviderError as e:
+                if e.throttled:
+                    retry_after = e.retry_after if e.retry_after is not None else DEFAULT_RETRY_AFTER
+                    log.info("%s is throttling, backing off for %.0f seconds", self.name, retry_after)
+                    metrics.increment("image_throttled")
+                    self.concurrency.on_throttle()
+                    self.bucket.pause(retry_after)
+                raise
+            self.concurrency.on_success(time.perf_counter() - started)
+            return written
+        finally:
+            self.concurrency.release()
+
+    def generate(self, prompt, seed, width, height, path):
+        raise NotImplementedError
+
+class HttpImageProvider(ImageProvider):
+    # Any service answering GET <base_url><prompt>?seed=&width=&height= with
+    # image bytes, like Pollinations
+    name = "http"
+
+    def __init__(self, name=None, base_url=POLLINATIONS_URL, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_concurrency=DEFAULT_CONCURRENCY, initial_concurrency=None, params="nologo=true"):
+        super().__init__(name, rate, burst, max_concurrency, initial_concurrency)
+        self.base_url = base_url
+        self.params = params  # extra query string sent with every request
+        self.max_concurrency = max_concurrency
+        self.session = None
+        self.session_lock = threading.Lock()
+
+    def get_session(self):
+        # One shared keep-alive session for every worker, made on the first
+        # request so starting the app doesn't wait for requests to import
+        with self.session_lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, self.max_concurrency))
+                self.session.mount("https://", adapter)
+                self.session.mount("http://", adapter)
+            return self.session
+
+    def url(self, prompt, seed, width, height):
+        # The prompt is one path segment, so "/", "?" and "#" in an entry stay part of it
+        query = urlencode({"seed": seed, "width": width, "height": height})
+        return f"{self.base_url}{quote(prompt, safe='')}?{self.params + '&' if self.params else ''}{query}"
+
+    def generate(self, prompt, seed, width, height, path):
+        # Streamed to path in fixed size chunks so memory use doesn't grow with the image
+        session = self.get_session()
+        from requests.exceptions import RequestException
+        try:
+            with session.get(self.url(prompt, seed, width, height), timeout=REQUEST_TIMEOUT,
+                                  stream=True) as response:
+                if response.status_code in THROTTLE_STATUSES:
+                    raise ProviderError(f"HTTP {response.status_code}", throttled=True,
+                                        retry_after=parse_retry_after(response.headers.get("Retry-After")))
+                response.raise_for_status()  # Raises an HTTPError for bad responses
+                written = 0
+                with open(path, "wb") as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        written += len(chunk)
+                expected = response.headers.get("Content-Length")
+                compressed = response.headers.get("Content-Encoding", "identity") != "identity"
+        except RequestException as e:
+            raise ProviderError(str(e))
+
+        if not written:
+            raise ProviderError("Empty response received")
+        if expected and not compressed and int(expected) != written:
+            raise ProviderError(f"Download cut short, {written} of {expected} bytes")
+        return written
+
+class LocalImageProvider(ImageProvider):
+    # Draws a simple abstract picture from the prompt and seed, no network.
+    # The same prompt and seed always give the same image, which makes it
+    # useful offline and for testing.
+    name = "local"
+
+    def __init__(self, name=None, rate=0, burst=DEFAULT_BURST, max_concurrency=DEFAULT_CONCURRENCY,
+                 initial_concurrency=None):
+        super().__init__(name, rate, burst, max_concurrency, initial_concurrency or max_concurrency)
+
+    def generate(self, prompt, seed, width, height, path):
+        from PIL import Image, ImageDraw, ImageOps
+        rng = random.Random(f"{prompt}\0{seed}")
+        colors = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(2)]
+        gradient = Image.linear_gradient("L").rotate(rng.randrange(360)).resize((width, height))
+        image = ImageOps.colorize(gradient, *colors)
+        draw = ImageDraw.Draw(image)
+        for _ in range(rng.randint(3, 8)):
+            x, y = rng.randrange(width), rng.randrange(height)
+            radius = rng.randint(height // 20, height // 4)
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                         fill=tuple(rng.randrange(256) for _ in range(3)))
+        image.save(path, "JPEG", quality=90)
+        return os.path.getsize(path)
+
+PROVIDER_TYPES = {"http": HttpImageProvider, "local": LocalImageProvider}
+
+# Providers available without any configuration
+BUILTIN_PROVIDERS = {
+    "pollinations": {"type": "http", "base_url": POLLINATIONS_URL},
+    "local": {"type": "local"},
+}
+
+def create_provider(name, config=None, max_concurrency=DEFAULT_CONCURRENCY):
+    # config comes from settings.json and overrides the built in defaults:
+    # {"type": "http", "base_url": ..., "rate": ..., "burst": ..., "max_concurrency": ...}
+    settings = dict(BUILTIN_PROVIDERS.get(name, {}))
+    settings.update(config or {})
+    settings.setdefault("max_concurrency", max_concurrency)
+    kind = settings.pop("type", "http")
+    if kind not in PROVIDER_TYPES:
+        raise ValueError(f"Unknown image provider type {kind} for {name}")
+    return PROVIDER_TYPES[kind](name, **settings)
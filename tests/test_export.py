@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journalgen_core import JournalEngine
+from journalgen_export import CHECKPOINT_SUFFIX, export_journal
+from journalgen_providers import LocalImageProvider
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp(prefix="journalgen-test-")
+        with open(os.path.join(self.base_dir, "settings.json"), "w") as f:
+            json.dump({"image_size": "64x36"}, f)
+        self.engine = JournalEngine(self.base_dir, num_workers=2, provider=LocalImageProvider())
+        self.engine.load_entries("2023-01-15")
+        images = threading.Semaphore(0)
+        self.engine.image_listeners.append(lambda *args: images.release())
+        # The same text and seed make the same image, shared by all these entries
+        for day in ("2023-01-15", "2023-02-15", "2023-02-15"):
+            self.engine.add_entry(day, "A walk by the sea")
+        self.engine.add_entry("2023-02-15", "Rain all day")
+        for _ in range(4):
+            self.assertTrue(images.acquire(timeout=30))
+        self.engine.flush()
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def test_archive_has_shared_image_once_a_month(self):
+        output = os.path.join(self.base_dir, "journal.tar.gz")
+        summary = export_journal(self.engine, output, "archive")
+        with tarfile.open(output) as archive:
+            images = [name for name in archive.getnames() if name.startswith("journal/images/")]
+        self.assertEqual(len(images), 3)  # The walk in January and February, the rain in February
+        self.assertEqual(len(set(images)), 2)
+        self.assertEqual(summary["images"], 3)
+        self.assertEqual(summary["entries"], 4)
+
+    def test_resume_without_partial_output_starts_over(self):
+        output = os.path.join(self.base_dir, "journal.jsonl")
+        with open(output + CHECKPOINT_SUFFIX, "w") as f:
+            json.dump({"format": "jsonl", "start_day": None, "end_day": None, "month": "2023-01",
+                       "entries": 1, "images": 0, "offset": 100}, f)
+        summary = export_journal(self.engine, output, "jsonl")
+        self.assertFalse(summary["resumed"])
+        with open(output, "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 4)
+
+    def test_site_links_evicted_images_to_their_thumbnail(self):
+        self.assertEqual(self.engine.enforce_storage_budget(budget=1), 2)
+        output = os.path.join(self.base_dir, "site")
+        export_journal(self.engine, output, "site")
+        with open(os.path.join(output, "2023-02.html"), "r", encoding="utf-8") as f:
+            page = f.read()
+        self.assertEqual(page.count("<img"), 3)
+        for folder in ("thumbs", "images"):
+            self.assertEqual(len(os.listdir(os.path.join(output, folder))), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import journalgen_core
+from journalgen_core import JournalEngine
+from journalgen_providers import LocalImageProvider
+
+class ImageCallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp(prefix="journalgen-test-")
+        self.engine = JournalEngine(self.base_dir, num_workers=1, provider=LocalImageProvider(max_concurrency=1))
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def test_failing_callback_keeps_worker_and_other_waiters(self):
+        generator = self.engine.image_generator
+        heard = {}
+        done = threading.Event()
+
+        def failing(entry_id, image_path, info):
+            raise RuntimeError("listener bug")
+
+        def record(entry_id, image_path, info):
+            heard[entry_id] = image_path
+            if len(heard) == 2:
+                done.set()
+
+        # Same prompt and seed, so both entries wait on one job
+        generator.submit("first", "A walk in the park", failing, seed=1)
+        generator.submit("second", "A walk in the park", record, seed=1)
+        # The worker is still there to generate the next image
+        generator.submit("third", "Rain at the window", record, seed=2)
+        self.assertTrue(done.wait(30))
+        self.assertEqual(sorted(heard), ["second", "third"])
+
+    def test_failed_restore_leaves_entry_alone(self):
+        images = threading.Semaphore(0)
+        self.engine.image_listeners.append(lambda *args: images.release())
+        self.engine.load_entries("2024-03-01")
+        entry = self.engine.add_entry("2024-03-01", "A walk in the park")
+        self.assertTrue(images.acquire(timeout=30))
+        self.engine.flush()
+        image_path = self.engine.get_entry(entry.entry_id).image_path
+        self.assertEqual(self.engine.enforce_storage_budget(budget=1), 1)
+
+        failed = threading.Event()
+        provider = self.engine.image_generator.provider
+        with mock.patch.object(journalgen_core, "IMAGE_MAX_RETRIES", 1), \
+                mock.patch.object(provider, "generate", side_effect=OSError("offline")):
+            self.assertTrue(self.engine.restore_image(image_path, on_failure=lambda path: failed.set()))
+            self.assertTrue(failed.wait(30))
+        self.assertNotIn(entry.entry_id, self.engine.retry_store)
+        self.assertFalse(self.engine.image_generator.is_pending(entry.entry_id))
+        self.assertEqual(self.engine.get_entry(entry.entry_id).image_path, image_path)
+
+if __name__ == "__main__":
+    unittest.main()
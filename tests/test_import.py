@@ -0,0 +1,56 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journalgen_core import JournalEngine
+from journalgen_import import import_file
+from journalgen_providers import LocalImageProvider
+
+DIARY = """## 2023-01-02
+- Went running
+- 14:05 Lunch with Sam
+- Went running
+
+## 2023-01-03
+"""
+
+class ImportTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp(prefix="journalgen-test-")
+        self.engine = JournalEngine(self.base_dir, num_workers=1, provider=LocalImageProvider())
+        self.engine.load_entries("2023-01-02")
+        self.path = os.path.join(self.base_dir, "diary.md")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(DIARY)
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def test_repeated_entries_are_kept(self):
+        summary = import_file(self.engine, self.path, request_images=False)
+        self.assertEqual((summary["entries"], summary["duplicates"], summary["days"]), (3, 0, 1))
+        contents = [entry.content for entry in self.engine.day_entries("2023-01-02")]
+        self.assertEqual(contents, ["Went running", "Lunch with Sam", "Went running"])
+
+    def test_second_import_adds_nothing(self):
+        import_file(self.engine, self.path, request_images=False)
+        summary = import_file(self.engine, self.path, request_images=False)
+        self.assertEqual((summary["entries"], summary["duplicates"], summary["days"]), (0, 3, 0))
+        self.assertEqual(len(self.engine.day_entries("2023-01-02")), 3)
+
+    def test_rerun_after_partial_import_adds_the_rest(self):
+        records = [(f"2023-{month:02d}-15", None, f"Entry for month {month}", None) for month in range(1, 13)]
+        records += [("2024-03-01", "09:30", "Entry in the next year", None)]
+        self.engine.import_entries(records[:7], request_images=False)  # As if it failed after July
+
+        added, duplicates, days = self.engine.import_entries(records, request_images=False)
+        self.assertEqual((added, duplicates, days), (6, 7, 6))
+        self.assertEqual(len(list(self.engine.iter_entries())), len(records))
+
+if __name__ == "__main__":
+    unittest.main()
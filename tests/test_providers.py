@@ -0,0 +1,30 @@
+import os
+import sys
+import unittest
+from urllib.parse import parse_qs, unquote, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journalgen_providers import HttpImageProvider
+
+class HttpImageProviderUrlTest(unittest.TestCase):
+    def test_prompt_with_url_characters(self):
+        provider = HttpImageProvider(base_url="https://images.example/prompt/")
+        prompt = "Fireworks at night #1? yes / 100% & more"
+        url = urlsplit(provider.url(prompt, 1234, 1280, 720))
+
+        self.assertEqual(url.fragment, "")
+        self.assertEqual(unquote(url.path), "/prompt/" + prompt)
+        query = parse_qs(url.query)
+        self.assertEqual(query["seed"], ["1234"])
+        self.assertEqual(query["width"], ["1280"])
+        self.assertEqual(query["height"], ["720"])
+        self.assertEqual(query["nologo"], ["true"])
+
+    def test_without_extra_params(self):
+        provider = HttpImageProvider(base_url="http://127.0.0.1:8765/prompt/", params="")
+        self.assertEqual(provider.url("a cat", 7, 64, 32),
+                         "http://127.0.0.1:8765/prompt/a%20cat?seed=7&width=64&height=32")
+
+if __name__ == "__main__":
+    unittest.main()
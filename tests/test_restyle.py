@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import journalgen_core
+from journalgen_cli import run_regen
+from journalgen_core import JournalEngine, RestyleJob
+from journalgen_providers import LocalImageProvider
+
+class SlowProvider(LocalImageProvider):
+    # Slow enough that a restyle still has requests in flight when the test steps in
+    def generate(self, prompt, seed, width, height, path):
+        time.sleep(0.2)
+        return super().generate(prompt, seed, width, height, path)
+
+class RestyleJobTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp(prefix="journalgen-test-")
+        self.engine = JournalEngine(self.base_dir, num_workers=2, provider=SlowProvider(max_concurrency=2))
+        self.engine.load_entries("2024-01-10")
+        for number in range(6):
+            self.engine.add_entry("2024-01-10", f"Entry number {number}")
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def wait_in_flight(self, job):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            with job.lock:
+                if job.in_flight:
+                    return next(iter(job.in_flight))
+            time.sleep(0.01)
+        self.fail("Restyle never sent a request")
+
+    def test_entry_requested_again_during_restyle(self):
+        job = RestyleJob(self.engine, "2024-01-10", "2024-01-10", "watercolor", max_in_flight=2, rate=0)
+        job.start()
+        entry_id = self.wait_in_flight(job)
+        entry = self.engine.get_entry(entry_id)
+        self.engine.request_image(entry_id, entry.content)  # As the retry worker or an edit does
+
+        self.assertTrue(job.finished.wait(30))
+        self.assertEqual(job.in_flight, {})
+        self.assertEqual(job.done + job.failed, 6)
+        self.assertFalse(os.path.exists(self.engine.restyle_checkpoint_path))
+
+    def test_entry_deleted_during_restyle(self):
+        job = RestyleJob(self.engine, "2024-01-10", "2024-01-10", "watercolor", max_in_flight=2, rate=0)
+        job.start()
+        entry_id = self.wait_in_flight(job)
+        self.engine.delete_entry(entry_id)
+
+        self.assertTrue(job.finished.wait(30))
+        self.assertEqual(job.in_flight, {})
+        self.assertEqual(job.done + job.failed, 5)
+
+    def test_resume_without_checkpoint_does_nothing(self):
+        args = Namespace(style=None, resume=True, start_day=None, end_day=None, rate=0)
+        with mock.patch.object(self.engine, "request_image") as request_image:
+            self.assertEqual(run_regen(self.engine, args), 1)
+        request_image.assert_not_called()
+
+    def test_checkpoints_from_many_workers(self):
+        # Image workers finish entries at the same time, each writing a checkpoint
+        job = RestyleJob(self.engine, "2024-01-10", "2024-01-10", "watercolor", max_in_flight=400, rate=0)
+        job.in_flight = {f"entry-{position}": position for position in range(400)}
+        errors = []
+
+        def finish(positions):
+            try:
+                for position in positions:
+                    job.mark_finished(f"entry-{position}", failed=False)
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(journalgen_core, "RESTYLE_CHECKPOINT_INTERVAL", 0):
+            threads = [threading.Thread(target=finish, args=(range(i, 400, 8),)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(job.position, 400)
+        with open(self.engine.restyle_checkpoint_path, "r") as f:
+            self.assertEqual(json.load(f)["position"], 400)
+
+if __name__ == "__main__":
+    unittest.main()
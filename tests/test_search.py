@@ -0,0 +1,39 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journalgen_core import Entry, JournalStore
+
+class LikeSearchTest(unittest.TestCase):
+    # The fallback used when SQLite has no FTS5
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp(prefix="journalgen-test-")
+        self.store = JournalStore(os.path.join(self.base_dir, "journal.db"))
+        self.store.has_search_index = False
+        self.store.save_day("2024-05-01", [
+            Entry("1", None, "Finished 100% of the tax forms"),
+            Entry("2", None, "Finished 1000 piece puzzle"),
+            Entry("3", None, "renamed file_name.txt"),
+            Entry("4", None, "renamed filename.txt"),
+            Entry("5", None, "a back\\slash"),
+        ])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def found(self, query):
+        return sorted(entry_id for _, entry_id, _ in self.store.search(query))
+
+    def test_percent_and_underscore_are_literal(self):
+        self.assertEqual(self.found("100%"), ["1"])
+        self.assertEqual(self.found("file_name"), ["3"])
+        self.assertEqual(self.found("back\\slash"), ["5"])
+        self.assertEqual(self.found("renamed"), ["3", "4"])
+
+if __name__ == "__main__":
+    unittest.main()